@@ -0,0 +1,75 @@
+"""
+Двухуровневый кэш товаров страницы поиска.
+
+Товары категории меняются только при сохранении парсинга, поэтому
+посчитанные группы и счетчики можно отдавать повторно:
+
+1. LRU в памяти процесса - без сериализации, ограничен по числу записей;
+2. кэш Django (settings.CACHES) - общий для всех процессов сервера.
+
+Ключ - (id категории, Category.products_version, страница). Версия лежит
+в БД и растет в той же транзакции, что сохраняет товары парсинга (в том
+числе в отдельном процессе scrape_worker), поэтому старые записи перестают
+находиться во всех процессах сразу - без сигналов между процессами.
+Версия берется из уже прочитанной запросом категории.
+"""
+from collections import OrderedDict
+import threading
+
+from django.core.cache import cache
+
+# Сколько страниц держит LRU одного процесса
+LOCAL_CACHE_SIZE = 256
+# Сколько живет запись в общем кэше, с
+SHARED_CACHE_TIMEOUT = 60 * 60
+
+_local = OrderedDict()
+_lock = threading.Lock()
+
+
+def _cache_key(category, page):
+    return f"catalog:products:{category.id}:{category.products_version}:{page}"
+
+
+def _local_get(key):
+    with _lock:
+        value = _local.get(key)
+        if value is not None:
+            _local.move_to_end(key)
+        return value
+
+
+def _local_set(key, value):
+    with _lock:
+        _local[key] = value
+        _local.move_to_end(key)
+        while len(_local) > LOCAL_CACHE_SIZE:
+            _local.popitem(last=False)
+
+
+def get_or_compute(category, page, compute):
+    """
+    Значение страницы из кэша или compute() с сохранением в оба уровня
+
+    Args:
+        category: Категория, товары которой кэшируются
+        page: Имя страницы ('first', '<группа>') - из конечного набора, чтобы
+            число ключей было ограничено
+        compute: Функция без аргументов, считающая значение из БД
+    """
+    key = _cache_key(category, page)
+    value = _local_get(key)
+    if value is not None:
+        return value
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, SHARED_CACHE_TIMEOUT)
+    _local_set(key, value)
+    return value
+
+
+def clear():
+    """Очищает LRU процесса (общий кэш чистится через django.core.cache)"""
+    with _lock:
+        _local.clear()
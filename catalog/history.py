@@ -0,0 +1,117 @@
+"""
+История цен товаров (PriceObservation).
+
+Парсинг пишет наблюдение только при изменении цены (run-length), а старые
+наблюдения сжимаются в дневные сводки - таблица растет с числом изменений
+цен, а не с числом парсингов.
+"""
+from collections import defaultdict
+from datetime import timedelta
+import logging
+
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import PriceObservation
+
+logger = logging.getLogger(__name__)
+
+# Поле цены товара для каждого магазина истории
+PRICE_FIELDS = {
+    'pyat': 'price_pyat',
+    'mag': 'price_mag',
+}
+# Наблюдения старше этого (дней) сжимаются в дневные сводки
+COMPACT_AFTER_DAYS = 90
+HISTORY_BATCH_SIZE = 500
+
+
+def observations(product, old_prices, now):
+    """
+    Наблюдения для изменившихся цен товара
+
+    Args:
+        product: Товар с уже новыми ценами
+        old_prices: {магазин: прежняя цена} (пусто для нового товара)
+    """
+    return [
+        PriceObservation(product=product, store=store, price=getattr(product, field),
+                         observed_at=now)
+        for store, field in PRICE_FIELDS.items()
+        if getattr(product, field) is not None
+        and getattr(product, field) != old_prices.get(store)
+    ]
+
+
+def record(observations_list):
+    """Пакетно дописывает наблюдения (только вставка)"""
+    PriceObservation.objects.bulk_create(observations_list, batch_size=HISTORY_BATCH_SIZE)
+
+
+def lowest_prices(product_ids, days=30):
+    """
+    Минимальная цена товаров за последние дни
+
+    Учитывается и цена, действовавшая на начало периода (последнее
+    наблюдение до него), и дневные сводки.
+
+    Returns:
+        {(id товара, магазин): минимальная цена}
+    """
+    since = timezone.now() - timedelta(days=days)
+    history = PriceObservation.objects.filter(product_id__in=product_ids)
+    lowest = {}
+    for row in history.filter(observed_at__gte=since).values('product_id', 'store').annotate(
+            low=Min('price'), low_daily=Min('price_min')):
+        low = min(p for p in (row['low'], row['low_daily']) if p is not None)
+        lowest[(row['product_id'], row['store'])] = low
+
+    # Цена на начало периода - последнее наблюдение до него
+    before = history.filter(observed_at__lt=since).order_by(
+        'product_id', 'store', '-observed_at').values_list('product_id', 'store', 'price')
+    seen = set()
+    for product_id, store, price in before:
+        key = (product_id, store)
+        if key in seen:
+            continue
+        seen.add(key)
+        lowest[key] = min(lowest.get(key, price), price)
+    return lowest
+
+
+def compact(older_than_days=COMPACT_AFTER_DAYS, now=None):
+    """
+    Сжимает старые наблюдения: одна строка на (товар, магазин, день)
+
+    Дневная строка хранит минимум, максимум и последнюю цену дня и
+    датируется временем последнего наблюдения дня.
+
+    Returns:
+        (сколько строк удалено, сколько дневных строк создано)
+    """
+    now = now or timezone.now()
+    # Граница - начало дня, чтобы день всегда сжимался целиком и один раз
+    cutoff = timezone.localtime(now - timedelta(days=older_than_days)).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    old = PriceObservation.objects.filter(observed_at__lt=cutoff, is_daily=False).order_by(
+        'product_id', 'store', 'observed_at')
+
+    days = defaultdict(list)
+    for observation in old.iterator(chunk_size=HISTORY_BATCH_SIZE):
+        day = timezone.localtime(observation.observed_at).date()
+        days[(observation.product_id, observation.store, day)].append(observation)
+
+    daily = []
+    for (product_id, store, _), rows in days.items():
+        prices = [row.price for row in rows]
+        daily.append(PriceObservation(
+            product_id=product_id, store=store, price=rows[-1].price,
+            price_min=min(prices), price_max=max(prices), is_daily=True,
+            observed_at=rows[-1].observed_at))
+
+    with transaction.atomic():
+        deleted, _ = old.delete()
+        PriceObservation.objects.bulk_create(daily, batch_size=HISTORY_BATCH_SIZE)
+    logger.info("🗜 История цен: %s наблюдений сжато в %s дневных строк", deleted, len(daily))
+    return deleted, len(daily)
@@ -0,0 +1,80 @@
+"""
+Ключ идентичности товара в магазине.
+
+Магазины по-разному пишут одно и то же название: "Молоко Простоквашино
+2,5% 1л" и "Молоко ПРОСТОКВАШИНО 2.5% 1 л" - один товар. Ключ строится
+из нормализованного названия:
+
+- слова без учета регистра, ё/е и порядка;
+- бренд - текст в кавычках ("...", «...»);
+- объем/вес/штуки, приведенные к мл, г и шт (1л = 1000мл, 0,5 кг = 500г).
+
+Артикул магазина (SKU) надежнее названия - если он есть, ключ по
+названию нужен только для старых предложений без артикула.
+"""
+from decimal import Decimal, InvalidOperation
+import hashlib
+import re
+
+from catalog.models import normalize_name
+
+# Единица -> (базовая единица, множитель)
+UNITS = {
+    'кг': ('g', 1000),
+    'г': ('g', 1),
+    'гр': ('g', 1),
+    'л': ('ml', 1000),
+    'мл': ('ml', 1),
+    'шт': ('pcs', 1),
+}
+# "2х100 г", "1,5л", "900 мл", "10шт"
+QUANTITY_RE = re.compile(
+    r'(?:(\d+)\s*[xх×]\s*)?(\d+(?:[.,]\d+)?)\s*(кг|гр|г|мл|л|шт)\.?(?![а-яa-z])')
+BRAND_RE = re.compile(r'["«“]([^"»”]+)["»”]')
+WORD_RE = re.compile(r'[a-zа-я0-9]+(?:[.,]\d+)?%?')
+
+
+def parse_quantity(name):
+    """
+    Объем/вес/количество из названия в базовых единицах
+
+    Returns:
+        Строка вида '1000ml', '2x100g' или '', если в названии его нет
+    """
+    match = QUANTITY_RE.search(normalize_name(name))
+    if not match:
+        return ''
+    packs, value, unit = match.groups()
+    base, factor = UNITS[unit]
+    try:
+        amount = Decimal(value.replace(',', '.')) * factor
+    except InvalidOperation:
+        return ''
+    amount = f"{amount.normalize():f}"
+    return f"{packs}x{amount}{base}" if packs else f"{amount}{base}"
+
+
+def parse_brand(name):
+    """Бренд - первый текст в кавычках (нормализованный) или ''"""
+    match = BRAND_RE.search(normalize_name(name))
+    return match.group(1).strip() if match else ''
+
+
+def canonical_name(name):
+    """
+    Каноническая запись названия: 'слова|бренд|количество'
+
+    Слова отсортированы и без повторов, дробная часть - через точку,
+    количество убрано из слов и записано отдельно в базовых единицах.
+    """
+    normalized = normalize_name(name)
+    quantity = parse_quantity(normalized)
+    brand = parse_brand(normalized)
+    rest = QUANTITY_RE.sub(' ', normalized)
+    words = sorted({word.replace(',', '.') for word in WORD_RE.findall(rest)})
+    return f"{' '.join(words)}|{brand}|{quantity}"
+
+
+def identity_key(name):
+    """Ключ идентичности по названию: sha1 канонической записи (для индекса)"""
+    return hashlib.sha1(canonical_name(name).encode('utf-8')).hexdigest()
@@ -0,0 +1,75 @@
+"""
+Аренда парсинга категории.
+
+Флаг "идет парсинг" - это аренда с владельцем и сроком: взять ее можно только
+атомарным условным UPDATE, пока парсер жив - фоновый поток продлевает срок,
+а если процесс умер - аренда просто истекает и категорию можно парсить снова.
+"""
+from contextlib import contextmanager
+import logging
+import os
+import socket
+import threading
+import uuid
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Срок аренды: должен с запасом перекрывать интервал продления
+LEASE_SECONDS = 120
+# Как часто живой парсер продлевает аренду
+HEARTBEAT_SECONDS = 30
+
+
+def new_owner():
+    """Уникальное имя владельца аренды: хост, процесс, случайный суффикс"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaseLost(Exception):
+    """Аренда истекла и перехвачена другим воркером - результат не сохраняется"""
+
+
+class Lease:
+    """Удерживаемая аренда; lost=True - продлить не удалось, ее перехватили"""
+
+    def __init__(self, category, owner):
+        self.category = category
+        self.owner = owner
+        self.lost = False
+
+
+@contextmanager
+def hold_lease(category, owner=None, seconds=LEASE_SECONDS, heartbeat=HEARTBEAT_SECONDS):
+    """
+    Берет аренду парсинга категории и продлевает ее, пока выполняется блок
+
+    Yields:
+        Lease или None, если категорию уже парсит кто-то другой.
+        Не освобожденная в блоке аренда освобождается на выходе.
+    """
+    lease = Lease(category, owner or new_owner())
+    if not category.acquire_lease(lease.owner, seconds):
+        yield None
+        return
+
+    stop = threading.Event()
+
+    def renew():
+        try:
+            while not stop.wait(heartbeat):
+                if not category.renew_lease(lease.owner, seconds):
+                    lease.lost = True
+                    logger.warning("⚠️ Аренда парсинга '%s' потеряна", category.name)
+                    return
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=renew, name=f'lease-{category.pk}', daemon=True)
+    thread.start()
+    try:
+        yield lease
+    finally:
+        stop.set()
+        thread.join()
+        category.release_lease(lease.owner)
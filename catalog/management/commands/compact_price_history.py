@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from catalog.history import COMPACT_AFTER_DAYS, compact
+
+
+class Command(BaseCommand):
+    help = 'Сжимает старую историю цен в дневные сводки (минимум, максимум, последняя цена)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=COMPACT_AFTER_DAYS,
+                            help=f'Сжимать наблюдения старше N дней (по умолчанию: {COMPACT_AFTER_DAYS})')
+
+    def handle(self, *args, **options):
+        deleted, daily = compact(options['older_than'])
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Сжато наблюдений: {deleted}, дневных строк: {daily}'))
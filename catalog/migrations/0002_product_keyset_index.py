@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-17 00:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["-updated_at", "id"], name="product_updated_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-17 00:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0002_product_keyset_index"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="category",
+            name="is_parsing",
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="lease_expires_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Аренда парсинга продлевается, пока парсер жив, и истекает сама",
+                null=True,
+                verbose_name="Аренда до",
+            ),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="lease_owner",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Владелец аренды парсинга (воркер)",
+                max_length=100,
+                verbose_name="Кто парсит",
+            ),
+        ),
+    ]
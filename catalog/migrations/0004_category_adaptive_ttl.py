@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-17 00:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0003_category_parse_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="last_searched_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Последний поиск"
+            ),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="search_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="Поисков"),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="ttl_hours",
+            field=models.FloatField(
+                default=24,
+                help_text="Через сколько часов данные устаревают (зависит от изменчивости цен)",
+                verbose_name="Срок свежести, ч",
+            ),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="volatility",
+            field=models.FloatField(
+                default=0,
+                help_text="Сглаженная доля товаров, у которых цена менялась при парсинге",
+                verbose_name="Изменчивость цен",
+            ),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 6.0 on 2026-10-17 00:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0004_category_adaptive_ttl"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PriceObservation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "store",
+                    models.CharField(
+                        choices=[("pyat", "Пятёрочка"), ("mag", "Магнит")],
+                        max_length=4,
+                        verbose_name="Магазин",
+                    ),
+                ),
+                (
+                    "price",
+                    models.DecimalField(
+                        decimal_places=2,
+                        help_text="Новая цена (у дневной строки - последняя цена дня)",
+                        max_digits=10,
+                        verbose_name="Цена",
+                    ),
+                ),
+                (
+                    "price_min",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=10,
+                        null=True,
+                        verbose_name="Минимум за день",
+                    ),
+                ),
+                (
+                    "price_max",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=10,
+                        null=True,
+                        verbose_name="Максимум за день",
+                    ),
+                ),
+                (
+                    "is_daily",
+                    models.BooleanField(default=False, verbose_name="Дневная сводка"),
+                ),
+                ("observed_at", models.DateTimeField(verbose_name="Когда замечена")),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="price_history",
+                        to="catalog.product",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["product", "store", "observed_at"],
+                        name="priceobs_series_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations
+
+# Копия на момент миграции: код магазина -> (название, поля названия и цены в Product)
+STORES = {
+    "pyat": ("Пятёрочка", "name_pyat", "price_pyat"),
+    "mag": ("Магнит", "name_mag", "price_mag"),
+}
+BATCH_SIZE = 500
+
+
+def normalize_name(name):
+    return " ".join(name.lower().replace("ё", "е").split())
+
+
+def offers_from_columns(apps, schema_editor):
+    """Создает магазины и переносит колонки name_*/price_* товаров в Offer"""
+    Store = apps.get_model("catalog", "Store")
+    Offer = apps.get_model("catalog", "Offer")
+    Product = apps.get_model("catalog", "Product")
+
+    stores = {
+        code: Store.objects.get_or_create(code=code, defaults={"name": name})[0]
+        for code, (name, _, _) in STORES.items()
+    }
+    offers = []
+    for product in Product.objects.order_by("id").iterator(chunk_size=BATCH_SIZE):
+        for code, (_, name_field, price_field) in STORES.items():
+            name = getattr(product, name_field)
+            if name is None:
+                continue
+            offers.append(
+                Offer(
+                    product=product,
+                    store=stores[code],
+                    name=name,
+                    normalized_name=normalize_name(name),
+                    price=getattr(product, price_field),
+                )
+            )
+        if len(offers) >= BATCH_SIZE:
+            Offer.objects.bulk_create(offers)
+            offers = []
+    Offer.objects.bulk_create(offers)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0006_store_offer"),
+    ]
+
+    operations = [
+        migrations.RunPython(offers_from_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 6.0 on 2026-10-17 00:45
+
+from django.db import migrations, models
+
+from catalog.identity import identity_key
+
+BATCH_SIZE = 500
+
+
+def fill_identity_keys(apps, schema_editor):
+    """
+    Ключи идентичности существующих предложений
+
+    Ключ считается той же функцией, что и при сохранении парсинга, иначе
+    старые предложения не находились бы. Если у магазина несколько
+    предложений с одним ключом (дубликаты до этой миграции), ключ получает
+    самое старое, остальные остаются без ключа.
+    """
+    Offer = apps.get_model("catalog", "Offer")
+
+    taken = set()
+    batch = []
+    for offer in Offer.objects.order_by("id").iterator(chunk_size=BATCH_SIZE):
+        key = identity_key(offer.name)
+        if (offer.store_id, key) in taken:
+            continue
+        taken.add((offer.store_id, key))
+        offer.identity_key = key
+        batch.append(offer)
+        if len(batch) >= BATCH_SIZE:
+            Offer.objects.bulk_update(batch, ["identity_key"])
+            batch = []
+    Offer.objects.bulk_update(batch, ["identity_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0007_offers_from_product_columns"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="offer",
+            name="identity_key",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="sha1 канонического названия (catalog.identity): слова, бренд, объем/вес",
+                max_length=40,
+                verbose_name="Ключ идентичности",
+            ),
+        ),
+        migrations.RunPython(fill_identity_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="offer",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("identity_key", ""), _negated=True),
+                fields=("store", "identity_key"),
+                name="offer_store_identity_uniq",
+            ),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 6.0 on 2026-10-17 01:10
+
+import logging
+
+from django.db import DatabaseError, migrations
+
+logger = logging.getLogger(__name__)
+
+# SQLite: триграммные FTS5-таблицы поверх catalog_offer / catalog_category
+# (external content - текст хранится только в исходной таблице) и триггеры,
+# которые держат их в актуальном состоянии
+SQLITE_FTS = {
+    "catalog_offer_fts": ("catalog_offer", "normalized_name"),
+    "catalog_category_fts": ("catalog_category", "name"),
+}
+
+# PostgreSQL: GIN-индексы pg_trgm для contains/icontains
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS offer_name_trgm_idx "
+    "ON catalog_offer USING gin (normalized_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS category_name_trgm_idx "
+    "ON catalog_category USING gin (UPPER(name) gin_trgm_ops)",
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS offer_name_trgm_idx",
+    "DROP INDEX IF EXISTS category_name_trgm_idx",
+]
+
+
+def sqlite_forward(table, source, column):
+    return [
+        f"CREATE VIRTUAL TABLE {table} USING fts5("
+        f"{column}, content='{source}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER {table}_ai AFTER INSERT ON {source} BEGIN "
+        f"INSERT INTO {table}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"CREATE TRIGGER {table}_ad AFTER DELETE ON {source} BEGIN "
+        f"INSERT INTO {table}({table}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END",
+        f"CREATE TRIGGER {table}_au AFTER UPDATE OF {column} ON {source} BEGIN "
+        f"INSERT INTO {table}({table}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+        f"INSERT INTO {table}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        # Уже сохраненные строки
+        f"INSERT INTO {table}({table}) VALUES ('rebuild')",
+    ]
+
+
+def sqlite_backward(table):
+    return [
+        f"DROP TRIGGER IF EXISTS {table}_ai",
+        f"DROP TRIGGER IF EXISTS {table}_ad",
+        f"DROP TRIGGER IF EXISTS {table}_au",
+        f"DROP TABLE IF EXISTS {table}",
+    ]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        for sql in POSTGRES_FORWARD:
+            schema_editor.execute(sql)
+    elif vendor == "sqlite":
+        for table, (source, column) in SQLITE_FTS.items():
+            try:
+                for sql in sqlite_forward(table, source, column):
+                    schema_editor.execute(sql)
+            except DatabaseError as e:
+                # SQLite собран без FTS5 или без триграммного токенизатора (< 3.34):
+                # поиск работает вхождением подстроки (catalog.search)
+                logger.warning("⚠️ Поисковый индекс %s не создан: %s", table, e)
+                for sql in sqlite_backward(table):
+                    schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        for sql in POSTGRES_BACKWARD:
+            schema_editor.execute(sql)
+    elif vendor == "sqlite":
+        for table in SQLITE_FTS:
+            for sql in sqlite_backward(table):
+                schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0008_offer_identity_key"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
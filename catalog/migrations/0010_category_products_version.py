@@ -0,0 +1,47 @@
+# Generated by Django 6.0 on 2026-10-17 01:23
+
+import importlib
+
+from django.db import DatabaseError, migrations, models
+
+search_index = importlib.import_module("catalog.migrations.0009_search_index")
+
+CATEGORY_FTS = "catalog_category_fts"
+
+
+def rebuild_category_search_index(apps, schema_editor):
+    # SQLite пересоздает catalog_category при добавлении/удалении столбца -
+    # триггеры поискового индекса удаляются вместе со старой таблицей
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    source, column = search_index.SQLITE_FTS[CATEGORY_FTS]
+    for sql in search_index.sqlite_backward(CATEGORY_FTS):
+        schema_editor.execute(sql)
+    try:
+        for sql in search_index.sqlite_forward(CATEGORY_FTS, source, column):
+            schema_editor.execute(sql)
+    except DatabaseError as e:
+        search_index.logger.warning("⚠️ Поисковый индекс %s не создан: %s", CATEGORY_FTS, e)
+        for sql in search_index.sqlite_backward(CATEGORY_FTS):
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0009_search_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, rebuild_category_search_index),
+        migrations.AddField(
+            model_name="category",
+            name="products_version",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Растет при каждом сохранении парсинга (ключ кэша страниц поиска)",
+                verbose_name="Версия товаров",
+            ),
+        ),
+        migrations.RunPython(rebuild_category_search_index, migrations.RunPython.noop),
+    ]
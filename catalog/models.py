@@ -1,10 +1,21 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from django.utils.functional import cached_property
 from datetime import timedelta
 
 User = get_user_model()
 
+# Срок свежести данных категории (часы) - подстраивается под изменчивость цен
+DEFAULT_TTL_HOURS = 24
+MIN_TTL_HOURS = 3
+MAX_TTL_HOURS = 7 * 24
+# Доля изменившихся цен за парсинг: выше - срок вдвое короче, ниже - в полтора раза длиннее
+VOLATILE_SHARE = 0.2
+STABLE_SHARE = 0.05
+# Вес последнего парсинга в сглаженной изменчивости
+VOLATILITY_SMOOTHING = 0.3
+
 
 class Category(models.Model):
     name = models.CharField("Название категории",
@@ -15,11 +26,36 @@ class Category(models.Model):
         blank=True,
         help_text="Время последнего успешного парсинга"
     )
-    is_parsing = models.BooleanField(
-        "Идет парсинг",
-        default=False,
-        help_text="Флаг текущего статуса парсинга"
+    lease_owner = models.CharField(
+        "Кто парсит",
+        max_length=100,
+        blank=True,
+        default='',
+        help_text="Владелец аренды парсинга (воркер)"
+    )
+    lease_expires_at = models.DateTimeField(
+        "Аренда до",
+        null=True,
+        blank=True,
+        help_text="Аренда парсинга продлевается, пока парсер жив, и истекает сама"
     )
+    ttl_hours = models.FloatField(
+        "Срок свежести, ч",
+        default=DEFAULT_TTL_HOURS,
+        help_text="Через сколько часов данные устаревают (зависит от изменчивости цен)"
+    )
+    volatility = models.FloatField(
+        "Изменчивость цен",
+        default=0,
+        help_text="Сглаженная доля товаров, у которых цена менялась при парсинге"
+    )
+    products_version = models.PositiveIntegerField(
+        "Версия товаров",
+        default=0,
+        help_text="Растет при каждом сохранении парсинга (ключ кэша страниц поиска)"
+    )
+    search_count = models.PositiveIntegerField("Поисков", default=0)
+    last_searched_at = models.DateTimeField("Последний поиск", null=True, blank=True)
     created_at = models.DateTimeField("Создано", auto_now_add=True)
     updated_at = models.DateTimeField("Обновлено", auto_now=True)
 
@@ -30,15 +66,97 @@ class Category(models.Model):
     def needs_update(self):
         """
         Проверяет, нужно ли обновить данные категории
-        По умолчанию обновляет если прошло более 24 часов
+        Обновляет, если истек срок свежести категории (ttl_hours)
         """
-        hours = 24
         if not self.last_parsed_at:
             # Если никогда не парсилась - нужно обновить
             return True
 
         time_diff = timezone.now() - self.last_parsed_at
-        return time_diff > timedelta(hours=hours)
+        return time_diff > timedelta(hours=self.ttl_hours)
+
+    @property
+    def staleness(self):
+        """Какая доля срока свежести прошла (1 - данные устарели)"""
+        if not self.last_parsed_at:
+            return float('inf')
+        return self.hours_since_last_parse / self.ttl_hours
+
+    def record_search(self):
+        """Учитывает поиск по категории (популярность для планировщика)"""
+        now = timezone.now()
+        Category.objects.filter(pk=self.pk).update(
+            search_count=models.F('search_count') + 1, last_searched_at=now)
+        self.last_searched_at = now
+
+    def bump_products_version(self):
+        """Отмечает, что товары категории изменились (кэш страниц поиска устарел)"""
+        Category.objects.filter(pk=self.pk).update(
+            products_version=models.F('products_version') + 1)
+
+    def record_parse(self, changed, seen):
+        """
+        Подстраивает срок свежести по результату парсинга
+
+        Args:
+            changed: Сколько известных товаров изменили цену
+            seen: Сколько известных товаров пришло в парсинге
+        """
+        if not seen:
+            return
+        share = changed / seen
+        self.volatility = (1 - VOLATILITY_SMOOTHING) * self.volatility \
+            + VOLATILITY_SMOOTHING * share
+        if share >= VOLATILE_SHARE:
+            self.ttl_hours = max(MIN_TTL_HOURS, self.ttl_hours / 2)
+        elif share <= STABLE_SHARE:
+            self.ttl_hours = min(MAX_TTL_HOURS, self.ttl_hours * 1.5)
+        Category.objects.filter(pk=self.pk).update(
+            ttl_hours=self.ttl_hours, volatility=self.volatility)
+
+    @property
+    def is_parsing(self):
+        """Идет ли парсинг: есть неистекшая аренда"""
+        return bool(self.lease_expires_at and self.lease_expires_at > timezone.now())
+
+    def acquire_lease(self, owner, seconds):
+        """
+        Атомарно берет аренду парсинга (UPDATE ... WHERE аренда свободна или истекла)
+
+        Returns:
+            True, если аренда получена этим владельцем
+        """
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=seconds)
+        acquired = Category.objects.filter(pk=self.pk).filter(
+            models.Q(lease_expires_at__isnull=True) | models.Q(lease_expires_at__lte=now)
+            | models.Q(lease_owner=owner)
+        ).update(lease_owner=owner, lease_expires_at=expires_at, updated_at=now)
+        if acquired:
+            self.lease_owner, self.lease_expires_at = owner, expires_at
+        return bool(acquired)
+
+    def renew_lease(self, owner, seconds):
+        """Продлевает свою аренду. False - аренда истекла и перехвачена"""
+        expires_at = timezone.now() + timedelta(seconds=seconds)
+        renewed = Category.objects.filter(pk=self.pk, lease_owner=owner).update(
+            lease_expires_at=expires_at)
+        if renewed:
+            self.lease_expires_at = expires_at
+        return bool(renewed)
+
+    def release_lease(self, owner, parsed=False):
+        """Освобождает свою аренду; parsed=True - отмечает успешный парсинг"""
+        now = timezone.now()
+        # updated_at - для ETag статуса парсинга
+        fields = {'lease_owner': '', 'lease_expires_at': None, 'updated_at': now}
+        if parsed:
+            fields['last_parsed_at'] = now
+        released = Category.objects.filter(pk=self.pk, lease_owner=owner).update(**fields)
+        if released:
+            for name, value in fields.items():
+                setattr(self, name, value)
+        return bool(released)
 
     @property
     def hours_since_last_parse(self):
@@ -49,6 +167,37 @@ class Category(models.Model):
         return time_diff.total_seconds() / 3600
 
 
+def normalize_name(name):
+    """Название для поиска предложений: нижний регистр, е вместо ё, одиночные пробелы"""
+    return " ".join(name.lower().replace('ё', 'е').split())
+
+
+class Store(models.Model):
+    """Магазин (сеть), в котором парсятся предложения товаров"""
+    # Магазины, которые создаются миграцией: код -> название
+    DEFAULT_STORES = {
+        'pyat': 'Пятёрочка',
+        'mag': 'Магнит',
+    }
+
+    code = models.SlugField("Код", max_length=20, unique=True)
+    name = models.CharField("Название", max_length=100)
+
+    _ids = {}
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def id_for(cls, code):
+        """id магазина по коду (магазины не удаляются - кэшируется в процессе)"""
+        if code not in cls._ids:
+            store, _ = cls.objects.get_or_create(
+                code=code, defaults={'name': cls.DEFAULT_STORES.get(code, code)})
+            cls._ids[code] = store.id
+        return cls._ids[code]
+
+
 class Product(models.Model):
     categories = models.ManyToManyField(
         Category,
@@ -70,19 +219,78 @@ class Product(models.Model):
     created_at = models.DateTimeField("Создано", auto_now_add=True)
     updated_at = models.DateTimeField("Обновлено", auto_now=True)
 
+    # Совместимость: колонки магазинов в Product (код магазина -> поля
+    # названия и цены). Данные магазинов живут в Offer, колонки - их копия
+    # для шаблонов и корзины
+    LEGACY_STORE_FIELDS = {
+        'pyat': ('name_pyat', 'price_pyat'),
+        'mag': ('name_mag', 'price_mag'),
+    }
+
+    class Meta:
+        indexes = [
+            # Порядок keyset-пагинации на странице поиска
+            models.Index(fields=['-updated_at', 'id'], name='product_updated_id_idx'),
+        ]
+
     def __str__(self):
         name = self.name_pyat or self.name_mag or "Товар"
         return f"{name}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.sync_offers()
+
+    def sync_offers(self):
+        """Приводит предложения товара к колонкам name_*/price_* (одиночное сохранение)"""
+        from catalog.identity import identity_key
+
+        for code, (name_field, price_field) in self.LEGACY_STORE_FIELDS.items():
+            name = getattr(self, name_field)
+            store_id = Store.id_for(code)
+            if name is None:
+                Offer.objects.filter(product=self, store_id=store_id).delete()
+                continue
+            key = identity_key(name)
+            # Ключ уже у предложения другого товара - этот остается без ключа
+            if Offer.objects.filter(store_id=store_id, identity_key=key).exclude(product=self).exists():
+                key = ''
+            Offer.objects.update_or_create(
+                product=self, store_id=store_id,
+                defaults={'name': name, 'normalized_name': normalize_name(name),
+                          'identity_key': key, 'price': getattr(self, price_field)})
+        self.__dict__.pop('store_prices', None)
+
+    @cached_property
+    def store_prices(self):
+        """
+        {код магазина: цена} по предложениям товара
+
+        Страницы поиска и корзина подгружают предложения
+        (prefetch_related('offers__store'), см. catalog.views.OFFERS_PREFETCH);
+        без этого берется из колонок товара, чтобы свойства ниже не делали
+        запрос на каждый товар.
+        """
+        offers = self._prefetched_offers()
+        if offers is not None:
+            return {offer.store.code: offer.price for offer in offers}
+        return {code: getattr(self, price_field)
+                for code, (name_field, price_field) in self.LEGACY_STORE_FIELDS.items()
+                if getattr(self, name_field) is not None}
+
+    def _prefetched_offers(self):
+        """Подгруженные предложения товара или None"""
+        return getattr(self, '_prefetched_objects_cache', {}).get('offers')
+
     @property
     def has_pyat(self):
         """Есть ли товар в Пятёрочке"""
-        return self.name_pyat is not None
+        return 'pyat' in self.store_prices
 
     @property
     def has_mag(self):
         """Есть ли товар в Магните"""
-        return self.name_mag is not None
+        return 'mag' in self.store_prices
 
     @property
     def has_both(self):
@@ -92,33 +300,119 @@ class Product(models.Model):
     @property
     def price_difference(self):
         """Разница в цене"""
-        if self.has_both and self.price_pyat and self.price_mag:
-            return abs(float(self.price_pyat) - float(self.price_mag))
+        prices = [price for price in self.store_prices.values() if price]
+        if len(prices) > 1:
+            return float(max(prices)) - float(min(prices))
         return 0
 
     @property
     def cheaper_store(self):
-        """Какой магазин дешевле"""
-        if not self.has_both:
+        """Какой магазин дешевле (при равных ценах - последний по порядку)"""
+        if len(self.store_prices) < 2:
             return None
-        if self.price_pyat < self.price_mag:
-            return 'pyat'
-        return 'mag'
+        cheapest = min(self.store_prices.values(), key=lambda price: price or 0)
+        return [code for code, price in self.store_prices.items() if price == cheapest][-1]
 
     @property
     def cheaper_store_name(self):
         """Название магазина который дешевле"""
-        if self.cheaper_store == 'pyat':
-            return 'Пятёрочка'
-        if self.cheaper_store == 'mag':
-            return 'Магнит'
-        return None
+        code = self.cheaper_store
+        for offer in self._prefetched_offers() or ():
+            if offer.store.code == code:
+                return offer.store.name
+        return Store.DEFAULT_STORES.get(code)
 
     @property
     def main_name(self):
         return self.name_pyat or self.name_mag or "Товар без названия"
 
 
+class Offer(models.Model):
+    """
+    Предложение товара в магазине: название и цена на сайте магазина
+
+    Товар (Product) объединяет предложения разных магазинов; новый магазин -
+    это новая строка Store, а не новые колонки.
+    """
+    store = models.ForeignKey(Store, on_delete=models.PROTECT, related_name='offers')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='offers')
+    external_id = models.CharField(
+        "Артикул в магазине", max_length=100, blank=True, default='',
+        help_text="SKU или ссылка карточки, если магазин их отдает")
+    name = models.CharField("Название в магазине", max_length=255)
+    normalized_name = models.CharField("Нормализованное название", max_length=255)
+    identity_key = models.CharField(
+        "Ключ идентичности", max_length=40, blank=True, default='',
+        help_text="sha1 канонического названия (catalog.identity): слова, бренд, объем/вес")
+    price = models.DecimalField("Цена", max_digits=10, decimal_places=2, null=True, blank=True)
+    updated_at = models.DateTimeField("Обновлено", auto_now=True)
+
+    class Meta:
+        constraints = [
+            # Одно предложение магазина на товар
+            models.UniqueConstraint(fields=['product', 'store'], name='offer_product_store_uniq'),
+            models.UniqueConstraint(
+                fields=['store', 'external_id'],
+                condition=~models.Q(external_id=''),
+                name='offer_store_external_id_uniq',
+            ),
+            # Один товар магазина - одно предложение: повторный парсинг
+            # обновляет его, а не создает дубликат
+            models.UniqueConstraint(
+                fields=['store', 'identity_key'],
+                condition=~models.Q(identity_key=''),
+                name='offer_store_identity_uniq',
+            ),
+        ]
+        indexes = [
+            # Поиск товара по названию в магазине при сохранении парсинга
+            models.Index(fields=['store', 'normalized_name'], name='offer_store_name_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.store_id}): {self.price}₽"
+
+
+class PriceObservation(models.Model):
+    """
+    История цены товара в магазине
+
+    Записывается только изменение цены: наблюдение действует, пока не
+    появится следующее (ряд кусочно-постоянный). Старые наблюдения
+    сжимаются командой compact_price_history в одну строку за день
+    (is_daily) с минимумом, максимумом и последней ценой дня.
+    """
+    STORE_CHOICES = [
+        ('pyat', 'Пятёрочка'),
+        ('mag', 'Магнит'),
+    ]
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='price_history'
+    )
+    store = models.CharField("Магазин", max_length=4, choices=STORE_CHOICES)
+    price = models.DecimalField(
+        "Цена", max_digits=10, decimal_places=2,
+        help_text="Новая цена (у дневной строки - последняя цена дня)")
+    price_min = models.DecimalField(
+        "Минимум за день", max_digits=10, decimal_places=2, null=True, blank=True)
+    price_max = models.DecimalField(
+        "Максимум за день", max_digits=10, decimal_places=2, null=True, blank=True)
+    is_daily = models.BooleanField("Дневная сводка", default=False)
+    observed_at = models.DateTimeField("Когда замечена")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'store', 'observed_at'],
+                         name='priceobs_series_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product} ({self.store}): {self.price}₽ {self.observed_at:%d.%m.%Y}"
+
+
 class CartItem(models.Model):
     """
     Товар в корзине пользователя
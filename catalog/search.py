@@ -0,0 +1,143 @@
+"""
+Поиск по локальному каталогу без полного просмотра таблицы.
+
+Поиск вхождением подстроки (LIKE '%...%') не использует обычный индекс
+по названию, поэтому у каждой СУБД - свой индекс (миграция 0009):
+
+- SQLite: FTS5-таблицы с триграммным токенизатором catalog_offer_fts
+  (названия предложений) и catalog_category_fts (названия категорий),
+  синхронизируются триггерами - в том числе при bulk_create/bulk_update.
+  Ранжирование - bm25;
+- PostgreSQL: GIN-индексы pg_trgm: по названиям предложений - для
+  обычного contains, по UPPER(названия категории) - для оператора %
+  (похожие категории). Ранжирование - сходство триграмм;
+- другие СУБД или SQLite без FTS5 - вхождение подстроки без индекса.
+
+Триграммы ищут только слова от 3 символов: более короткие слова запроса
+пропускаются.
+
+Миграции, которые пересоздают таблицу catalog_offer или catalog_category
+в SQLite (AlterField и т.п.), удаляют и триггеры - их нужно создать заново
+(см. catalog/migrations/0009_search_index.py).
+"""
+from django.db import connection
+from django.db.models.functions import Upper
+
+from .models import Category, Offer, Product, normalize_name
+
+# Минимальная длина слова для триграммного индекса
+MIN_TERM_LENGTH = 3
+# Сколько товаров и категорий отдает поиск по умолчанию
+SEARCH_LIMIT = 20
+CATEGORY_LIMIT = 5
+
+OFFER_FTS_TABLE = 'catalog_offer_fts'
+CATEGORY_FTS_TABLE = 'catalog_category_fts'
+
+_fts_tables = {}
+
+
+def search_backend():
+    """Как искать в текущей БД: 'fts5', 'trigram' или 'like'"""
+    if connection.vendor == 'postgresql':
+        return 'trigram'
+    if connection.vendor == 'sqlite':
+        if connection.alias not in _fts_tables:
+            _fts_tables[connection.alias] = OFFER_FTS_TABLE in connection.introspection.table_names()
+        if _fts_tables[connection.alias]:
+            return 'fts5'
+    return 'like'
+
+
+def search_terms(query):
+    """Слова запроса, по которым работает триграммный индекс"""
+    return [term for term in normalize_name(query).split() if len(term) >= MIN_TERM_LENGTH]
+
+
+def _fts_phrase(text):
+    """Строка в выражении MATCH - фраза в кавычках (без операторов FTS5)"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _fts_ids(sql, expression, limit):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [expression, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_products(query, limit=SEARCH_LIMIT):
+    """
+    Товары, в названиях предложений которых есть все слова запроса,
+    лучшие совпадения первыми
+
+    Returns:
+        Список товаров (не больше limit)
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    backend = search_backend()
+    if backend == 'fts5':
+        ids = _fts_ids(
+            f"SELECT o.product_id FROM {OFFER_FTS_TABLE} f "
+            f"JOIN catalog_offer o ON o.id = f.rowid "
+            f"WHERE {OFFER_FTS_TABLE} MATCH %s "
+            f"GROUP BY o.product_id ORDER BY MIN(f.rank), o.product_id LIMIT %s",
+            ' '.join(_fts_phrase(term) for term in terms), limit)
+    else:
+        offers = Offer.objects.all()
+        for term in terms:
+            offers = offers.filter(normalized_name__contains=term)
+        if backend == 'trigram':
+            # django.contrib.postgres нужен только для PostgreSQL
+            from django.contrib.postgres.search import TrigramSimilarity
+            offers = offers.annotate(
+                rank=TrigramSimilarity('normalized_name', normalize_name(query))
+            ).order_by('-rank', 'product_id')
+        else:
+            offers = offers.order_by('-updated_at', 'product_id')
+        ids = []
+        for product_id in offers.values_list('product_id', flat=True).iterator():
+            if product_id not in ids:
+                ids.append(product_id)
+            if len(ids) >= limit:
+                break
+    products = Product.objects.in_bulk(ids)
+    return [products[product_id] for product_id in ids if product_id in products]
+
+
+def nearby_categories(query, limit=CATEGORY_LIMIT):
+    """
+    Категории с похожими названиями: есть хотя бы одно слово запроса
+
+    "молоко 2.5%" находит категории "Молоко" и "Молоко топленое" - их
+    товары уже есть в каталоге без нового парсинга.
+
+    Returns:
+        Список категорий, самые похожие первыми
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    backend = search_backend()
+    if backend == 'fts5':
+        ids = _fts_ids(
+            f"SELECT rowid FROM {CATEGORY_FTS_TABLE} WHERE {CATEGORY_FTS_TABLE} MATCH %s "
+            f"ORDER BY rank, rowid LIMIT %s",
+            ' OR '.join(_fts_phrase(term) for term in terms), limit)
+        categories = Category.objects.in_bulk(ids)
+        return [categories[category_id] for category_id in ids if category_id in categories]
+    if backend == 'trigram':
+        from django.contrib.postgres.lookups import TrigramSimilar
+        from django.contrib.postgres.search import TrigramSimilarity
+        # Оператор % (порог pg_trgm.similarity_threshold, по умолчанию 0.3) по
+        # UPPER(name) - выражению GIN-индекса category_name_trgm_idx; сравнение
+        # вычисленного сходства с порогом индекс не использует
+        name = Upper('name')
+        return list(Category.objects.filter(TrigramSimilar(name, query.upper())).annotate(
+            rank=TrigramSimilarity(name, query.upper())
+        ).order_by('-rank', 'id')[:limit])
+    lookup = Category.objects.none()
+    for term in terms:
+        lookup |= Category.objects.filter(name__icontains=term)
+    return list(lookup.order_by('name')[:limit])
@@ -1,9 +1,25 @@
 import json
-from unittest.mock import patch, MagicMock
+from asgiref.sync import async_to_sync
+from decimal import Decimal
+import time
+from datetime import timedelta
+from unittest.mock import ANY, MagicMock, patch
 from django.test import TestCase, RequestFactory, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from catalog.models import Product, Category, CartItem
+from django.utils import timezone
+from django.core.cache import cache
+from catalog import cache as product_cache
+from catalog.identity import canonical_name, identity_key, parse_quantity
+from catalog.leases import hold_lease
+from catalog import history
+from catalog import search
+from catalog.models import Product, Category, CartItem, Offer, PriceObservation, Store
+from catalog.views import run_parser
+from scraping.jobs import enqueue_scrape
+from scraping.models import ScrapeEvent, ScrapeJob
+from scraping.progress import ScrapeProgress
+from scraping.scrapers import save_results_to_db
 
 User = get_user_model()
 
@@ -39,6 +55,137 @@ class TestCatalogModels(TestCase):
         # Дешевле в магните ('mag')
         self.assertEqual(p2.cheaper_store, 'mag')
 
+    def test_parse_lease_is_exclusive(self):
+        """Аренду парсинга берет только один владелец, пока она не истекла"""
+        self.assertTrue(self.category.acquire_lease('w1', seconds=60))
+        self.assertTrue(self.category.is_parsing)
+
+        other = Category.objects.get(pk=self.category.pk)
+        self.assertFalse(other.acquire_lease('w2', seconds=60))
+        self.assertFalse(other.renew_lease('w2', seconds=60))
+        self.assertTrue(self.category.renew_lease('w1', seconds=60))
+
+        self.assertTrue(self.category.release_lease('w1', parsed=True))
+        self.category.refresh_from_db()
+        self.assertFalse(self.category.is_parsing)
+        self.assertIsNotNone(self.category.last_parsed_at)
+        self.assertTrue(other.acquire_lease('w2', seconds=60))
+
+    def test_parse_lease_expires(self):
+        """Аренду умершего парсера можно перехватить после истечения"""
+        self.category.acquire_lease('w1', seconds=60)
+        Category.objects.filter(pk=self.category.pk).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.category.refresh_from_db()
+        self.assertFalse(self.category.is_parsing)
+
+        self.assertTrue(self.category.acquire_lease('w2', seconds=60))
+        self.assertFalse(self.category.release_lease('w1'))
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.lease_owner, 'w2')
+
+    def test_ttl_adapts_to_price_volatility(self):
+        """Цены часто меняются - срок свежести короче, стабильны - длиннее"""
+        self.assertEqual(self.category.ttl_hours, 24)
+        self.category.record_parse(changed=5, seen=10)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.ttl_hours, 12)
+        self.assertAlmostEqual(self.category.volatility, 0.15)
+
+        for _ in range(10):
+            self.category.record_parse(changed=0, seen=10)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.ttl_hours, 7 * 24)
+
+        self.category.last_parsed_at = timezone.now() - timedelta(hours=100)
+        self.assertFalse(self.category.needs_update)
+
+    def test_hold_lease_heartbeat(self):
+        """Пока блок выполняется, аренда продлевается; перехваченная - помечается lost"""
+        category = MagicMock()
+        category.acquire_lease.return_value = True
+        category.renew_lease.side_effect = [True, False]
+
+        with hold_lease(category, 'w1', seconds=1, heartbeat=0.01) as lease:
+            deadline = time.monotonic() + 2
+            while not lease.lost and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        self.assertTrue(lease.lost)
+        self.assertEqual(category.renew_lease.call_count, 2)
+        category.release_lease.assert_called_once_with('w1')
+
+    def test_price_history_compaction(self):
+        """Старые наблюдения сжимаются в дневные min/max/last, свежие не трогаются"""
+        product = Product.objects.create(name_pyat="Масло", price_pyat=150)
+        day = timezone.now().replace(hour=12) - timedelta(days=100)
+        for hours, price in [(0, 150), (2, 120), (5, 140), (26, 130)]:
+            PriceObservation.objects.create(product=product, store='pyat', price=price,
+                                            observed_at=day + timedelta(hours=hours))
+        PriceObservation.objects.create(product=product, store='pyat', price=99,
+                                        observed_at=timezone.now() - timedelta(days=1))
+
+        deleted, daily = history.compact(older_than_days=90)
+
+        self.assertEqual((deleted, daily), (4, 2))
+        first_day = PriceObservation.objects.filter(is_daily=True).order_by('observed_at').first()
+        self.assertEqual((first_day.price_min, first_day.price_max, first_day.price), (120, 150, 140))
+        self.assertEqual(PriceObservation.objects.filter(is_daily=False).count(), 1)
+        # Повторное сжатие ничего не меняет
+        self.assertEqual(history.compact(older_than_days=90), (0, 0))
+
+    def test_lowest_price_in_period(self):
+        """Минимум за 30 дней учитывает цену, действовавшую на начало периода"""
+        product = Product.objects.create(name_pyat="Масло", price_pyat=150)
+        now = timezone.now()
+        PriceObservation.objects.create(product=product, store='pyat', price=110,
+                                        observed_at=now - timedelta(days=40))
+        PriceObservation.objects.create(product=product, store='pyat', price=90,
+                                        observed_at=now - timedelta(days=50))
+        PriceObservation.objects.create(product=product, store='pyat', price=150,
+                                        observed_at=now - timedelta(days=3))
+
+        self.assertEqual(history.lowest_prices([product.id]), {(product.id, 'pyat'): 110})
+
+    def test_product_save_syncs_offers(self):
+        """Колонки магазинов товара отражаются в предложениях Offer"""
+        product = Product.objects.create(name_pyat="Сыр  Российский", price_pyat=100)
+        offer = product.offers.get()
+        self.assertEqual((offer.store.code, offer.normalized_name, offer.price),
+                         ('pyat', 'сыр российский', 100))
+
+        product.name_mag, product.price_mag = "Сыр Российский", 90
+        product.save()
+        self.assertEqual(product.offers.count(), 2)
+        self.assertEqual(product.cheaper_store, 'mag')
+
+        product.name_pyat = None
+        product.save()
+        self.assertEqual(list(product.offers.values_list('store__code', flat=True)), ['mag'])
+
+    def test_identity_key_ignores_spelling(self):
+        """Регистр, порядок слов, ё и запись объема не меняют ключ товара"""
+        self.assertEqual(canonical_name('Молоко "Простоквашино" 2,5% 1л'),
+                         '2.5% молоко простоквашино|простоквашино|1000ml')
+        self.assertEqual(identity_key('Молоко "Простоквашино" 2,5% 1л'),
+                         identity_key('молоко 2.5% "ПРОСТОКВАШИНО" 1000 мл'))
+        self.assertEqual(parse_quantity('Йогурт 4х100 г'), '4x100g')
+        self.assertNotEqual(identity_key('Молоко 2,5% 1л'), identity_key('Молоко 2,5% 0,5л'))
+
+    def test_store_properties_from_offers(self):
+        """С prefetch свойства считаются по предложениям - и для нового магазина"""
+        product = Product.objects.create(name_pyat="Сыр", price_pyat=100,
+                                         name_mag="Сыр М", price_mag=120)
+        lenta = Store.objects.create(code='lenta', name='Лента')
+        Offer.objects.create(product=product, store=lenta, name="Сыр Л",
+                             normalized_name="сыр л", price=95)
+
+        product = Product.objects.prefetch_related('offers__store').get(pk=product.pk)
+        self.assertEqual(product.store_prices, {'pyat': 100, 'mag': 120, 'lenta': 95})
+        self.assertTrue(product.has_both)
+        self.assertEqual(product.cheaper_store, 'lenta')
+        self.assertEqual(product.price_difference, 25.0)
+
     def test_cart_item_creation(self):
         """Проверка создания элемента корзины"""
         user = User.objects.create_user(username='testuser_model', password='password')
@@ -59,14 +206,12 @@ class TestCatalogViews(TestCase):
         self.user = User.objects.create_user(username='testuser', password='password')
         self.client = Client()
         self.client.force_login(self.user)
+        # Кэш страниц поиска не должен переживать тест (id категорий повторяются)
+        cache.clear()
+        product_cache.clear()
         
-    @patch('catalog.views.threading.Thread')
-    def test_product_list_search_trigger(self, mock_thread):
-        """Проверяем, что при поиске создается категория и запускается фоновый поток парсинга"""
-        
-        # Настройка мока для потока
-        mock_thread_instance = MagicMock()
-        mock_thread.return_value = mock_thread_instance
+    def test_product_list_search_trigger(self):
+        """Проверяем, что при поиске создается категория и парсинг ставится в очередь"""
 
         query = 'Яблоки' 
         response = self.client.get(reverse('product_list'), {'q': query})
@@ -76,16 +221,13 @@ class TestCatalogViews(TestCase):
         # Проверяем, что категория создалась в БД (вьюха делает capitalize(), поэтому 'Яблоки')
         self.assertTrue(Category.objects.filter(name='Яблоки').exists())
         
-        # Проверяем, что был создан и запущен поток
-        self.assertTrue(mock_thread.called)
-        mock_thread_instance.start.assert_called_once()
+        # Проверяем, что задание на парсинг стоит в очереди, и повторный поиск его не дублирует
+        self.assertEqual(ScrapeJob.objects.filter(query='Яблоки', status=ScrapeJob.PENDING).count(), 1)
+        self.client.get(reverse('product_list'), {'q': 'яблоки'})
+        self.assertEqual(ScrapeJob.objects.count(), 1)
 
-    @patch('catalog.views.threading.Thread')
-    def test_product_list_context(self, mock_thread):
+    def test_product_list_context(self):
         """Проверка контекста страницы при поиске существующего товара"""
-        
-        # Мокаем поток, чтобы он не запускался реально
-        mock_thread.return_value = MagicMock()
 
         # 1. Создаем товар с русским именем
         Product.objects.create(name_pyat="Зеленое Яблоко", price_pyat=10)
@@ -96,6 +238,347 @@ class TestCatalogViews(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn('total_products', response.context)
 
+    @patch('catalog.views.save_results_to_db',
+           return_value={'created': 0, 'updated': 1, 'price_changed': 1, 'unchanged': 1, 'errors': 0,
+                         'categories_added': 0})
+    @patch('catalog.views.smart_product_search', return_value={})
+    def test_run_parser_skips_leased_category(self, mock_search, mock_save):
+        """Категорию, которую уже парсит другой воркер, второй раз не парсим"""
+        category = Category.objects.create(name='Сметана')
+        category.acquire_lease('other-worker', seconds=60)
+
+        run_parser('сметана')
+        mock_search.assert_not_called()
+
+        Category.objects.filter(pk=category.pk).update(lease_expires_at=timezone.now())
+        run_parser('сметана')
+        mock_search.assert_called_once_with('сметана', progress=ANY, quick=False)
+        self.assertEqual(list(ScrapeEvent.objects.values_list('kind', flat=True)),
+                         [ScrapeEvent.START, ScrapeEvent.DONE])
+        category.refresh_from_db()
+        self.assertFalse(category.is_parsing)
+        self.assertEqual(category.lease_owner, '')
+        self.assertIsNotNone(category.last_parsed_at)
+
+    @patch('catalog.views.smart_product_search', side_effect=RuntimeError('нет сети'))
+    def test_run_parser_releases_lease_on_error(self, mock_search):
+        category = Category.objects.create(name='Сметана')
+        with self.assertRaises(RuntimeError):
+            run_parser('сметана')
+        category.refresh_from_db()
+        self.assertFalse(category.is_parsing)
+        self.assertIsNone(category.last_parsed_at)
+
+    @patch('catalog.views.save_results_to_db',
+           return_value={'created': 1, 'updated': 1, 'price_changed': 1, 'unchanged': 0, 'errors': 0,
+                         'categories_added': 1})
+    @patch('catalog.views.smart_product_search', return_value={})
+    def test_quick_phase_does_not_mark_category_parsed(self, mock_search, mock_save):
+        """Быстрый этап сохраняет товары, но свежей категорию делает только полный парсинг"""
+        category = Category.objects.create(name='Сметана')
+        run_parser('сметана', quick=True)
+        mock_search.assert_called_once_with('сметана', progress=ANY, quick=True)
+        category.refresh_from_db()
+        self.assertFalse(category.is_parsing)
+        self.assertIsNone(category.last_parsed_at)
+        self.assertEqual(category.volatility, 0)
+
+        run_parser('сметана')
+        category.refresh_from_db()
+        self.assertIsNotNone(category.last_parsed_at)
+        self.assertGreater(category.volatility, 0)
+
+    @patch('catalog.views.smart_product_search')
+    def test_renamed_products_do_not_shorten_ttl(self, mock_search):
+        """Срок свежести подстраивается по изменившимся ценам, а не по правкам названий"""
+        category = Category.objects.create(name='Хлеб')
+        mock_search.return_value = {'pairs': [], 'magnit_single': [],
+                                    'pyat_single': [{'name': 'Хлеб белый', 'price': Decimal('40.00')}]}
+        run_parser('хлеб')
+        category.refresh_from_db()
+        ttl_hours = category.ttl_hours
+
+        # Тот же товар под другим написанием, цена прежняя
+        mock_search.return_value['pyat_single'] = [{'name': 'Белый хлеб', 'price': Decimal('40.00')}]
+        run_parser('хлеб')
+        category.refresh_from_db()
+        self.assertEqual(Product.objects.get().name_pyat, 'Белый хлеб')
+        self.assertGreaterEqual(category.ttl_hours, ttl_hours)
+        self.assertEqual(category.volatility, 0)
+
+        mock_search.return_value['pyat_single'] = [{'name': 'Белый хлеб', 'price': Decimal('45.00')}]
+        run_parser('хлеб')
+        category.refresh_from_db()
+        self.assertLess(category.ttl_hours, ttl_hours)
+
+    def test_stale_category_served_while_refreshing(self):
+        """Устаревшие данные показываются сразу, обновление уходит в очередь без индикатора"""
+        category = Category.objects.create(
+            name='Ряженка', last_parsed_at=timezone.now() - timedelta(hours=30))
+        product = Product.objects.create(name_pyat='Ряженка 1л', price_pyat=70)
+        product.categories.add(category)
+
+        response = self.client.get(reverse('product_list'), {'q': 'ряженка'})
+
+        self.assertEqual(response.context['total_products'], 1)
+        self.assertFalse(response.context['is_searching'])
+        self.assertIn('обновляется', response.context['last_update_info'])
+        self.assertTrue(ScrapeJob.objects.filter(query='Ряженка').exists())
+        category.refresh_from_db()
+        self.assertEqual(category.search_count, 1)
+
+    def test_repeat_search_served_from_cache(self):
+        """Повторный поиск анонима не читает товары из БД, новый парсинг сбрасывает кэш"""
+        category = Category.objects.create(name='Молоко', last_parsed_at=timezone.now())
+        product = Product.objects.create(name_pyat='Молоко 1л', price_pyat=80)
+        product.categories.add(category)
+        self.client.logout()
+        self.client.get(reverse('product_list'), {'q': 'молоко'})
+
+        # категория + задания в очереди + учет поиска, без счётчиков и групп товаров
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('product_list'), {'q': 'молоко'})
+        self.assertEqual(response.context['total_products'], 1)
+
+        result = {'pairs': [], 'pyat_single': [{'name': 'Молоко 2л', 'price': 150}],
+                  'magnit_single': []}
+        # Сохраняет воркер в другом процессе: сбросить кэш сервера может только версия в БД
+        save_results_to_db(result, 'молоко')
+        response = self.client.get(reverse('product_list'), {'q': 'молоко'})
+        self.assertEqual(response.context['total_products'], 2)
+
+    def test_check_status_reports_queued_job(self):
+        self.client.get(reverse('product_list'), {'q': 'Творог'})
+        response = self.client.get(reverse('check_status'), {'q': 'творог'})
+        self.assertTrue(response.json()['is_parsing'])
+
+    def test_check_status_reports_saved_fast_results(self):
+        """Быстрый этап сохранил товары - страницу можно обновить, не дожидаясь полного"""
+        self.client.get(reverse('product_list'), {'q': 'Творог'})
+        self.assertFalse(self.client.get(reverse('check_status'), {'q': 'творог'}).json()['has_results'])
+
+        product = Product.objects.create(name_pyat="Творог 5%", price_pyat=90)
+        Category.objects.get(name='Творог').products.add(product)
+        data = self.client.get(reverse('check_status'), {'q': 'творог'}).json()
+        self.assertTrue(data['is_parsing'])
+        self.assertTrue(data['has_results'])
+
+    def test_pending_deep_crawl_shown_as_background_update(self):
+        """Полный парсинг в очереди после быстрого этапа: данные + "обновляется в фоне", без нового задания"""
+        category = Category.objects.create(name='Ряженка', last_parsed_at=timezone.now())
+        Product.objects.create(name_pyat='Ряженка 1л', price_pyat=70).categories.add(category)
+        enqueue_scrape('ряженка', priority=ScrapeJob.PRIORITY_DEEP, deep=True)
+
+        response = self.client.get(reverse('product_list'), {'q': 'ряженка'})
+        self.assertFalse(response.context['is_searching'])
+        self.assertIn('обновляется', response.context['last_update_info'])
+        self.assertEqual(ScrapeJob.objects.count(), 1)
+
+    def test_check_status_conditional_get(self):
+        """Пока статус не изменился - 304 без тела, после взятия аренды - новый ETag"""
+        category = Category.objects.create(name='Творог', last_parsed_at=timezone.now())
+        url = reverse('check_status')
+        response = self.client.get(url, {'q': 'творог'})
+        etag = response['ETag']
+        self.assertFalse(response.json()['is_parsing'])
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(url, {'q': 'творог'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        category.acquire_lease('w1', seconds=60)
+        response = self.client.get(url, {'q': 'творог'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_parsing'])
+        self.assertNotEqual(response['ETag'], etag)
+
+    @patch('catalog.views.LONG_POLL_CHECK_SECONDS', 0.05)
+    def test_check_status_long_poll(self):
+        """Long-poll ждет до таймаута и возвращается, как только статус в БД изменился"""
+        Category.objects.create(name='Творог', last_parsed_at=timezone.now())
+        url = reverse('check_status')
+        etag = self.client.get(url, {'q': 'творог'})['ETag']
+
+        started = time.monotonic()
+        response = self.client.get(url, {'q': 'творог', 'wait': 0.2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+        # Без wait (и с некорректным wait) отвечает сразу
+        started = time.monotonic()
+        for wait in ('0', 'nan', 'мусор'):
+            response = self.client.get(url, {'q': 'творог', 'wait': wait}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        self.assertLess(time.monotonic() - started, 1)
+
+        # Воркер в другом процессе начал парсинг - изменение видно только по БД
+        started_at = time.monotonic() + 0.1
+        with patch('catalog.views._parsing_in_progress',
+                   lambda category: time.monotonic() >= started_at):
+            started = time.monotonic()
+            response = self.client.get(url, {'q': 'творог', 'wait': 5}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_parsing'])
+        self.assertLess(time.monotonic() - started, 5)
+
+    def _stream(self, **headers):
+        async def read():
+            response = await self.async_client.get(
+                reverse('product_stream'), {'q': 'сметана'}, headers=headers)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            return b''.join([chunk async for chunk in response.streaming_content]).decode()
+        return async_to_sync(read)()
+
+    def test_product_stream_partial_results(self):
+        """Поток отдает товары магазинов по мере сбора, пары и закрывается после done"""
+        ScrapeProgress('Сметана').start()
+        progress = ScrapeProgress('Сметана')
+        progress.products('Пятёрочка', [{'name': 'Сметана 20%', 'price': Decimal('95.50')}])
+        progress.products('Магнит', [{'name': 'Сметана 20 %', 'price': Decimal('99')}])
+        progress.pairs({'pairs': [{'pyat': {'name': 'Сметана 20%'}, 'price_pyat': Decimal('95.50'),
+                                   'magnit': {'name': 'Сметана 20 %'}, 'price_mag': Decimal('99'),
+                                   'similarity': 95}],
+                        'pyat_single': [], 'magnit_single': []})
+        progress.done({'created': 1})
+
+        body = self._stream()
+
+        events = [line[len('event: '):] for line in body.splitlines() if line.startswith('event: ')]
+        self.assertEqual(events, ['start', 'products', 'products', 'pairs', 'done'])
+        self.assertIn('"name": "Сметана 20%", "price": "95.50"', body)
+        self.assertIn('"store": "Магнит"', body)
+
+        # Переподключение EventSource продолжает после последнего полученного события
+        last_id = ScrapeEvent.objects.get(kind=ScrapeEvent.PAIRS).id
+        body = self._stream(last_event_id=str(last_id))
+        self.assertNotIn('event: pairs', body)
+        self.assertIn('event: done', body)
+
+    @patch('catalog.views.STREAM_MAX_SECONDS', 0.2)
+    @patch('catalog.views.STREAM_POLL_SECONDS', 0.05)
+    def test_product_stream_waits_for_start(self):
+        """Пока парсинг не начался, поток ждет и закрывается по таймауту"""
+        body = self._stream()
+        self.assertTrue(body.startswith('retry: '))
+        self.assertNotIn('event:', body)
+
+    def test_product_list_query_count(self):
+        """Страница поиска укладывается в фиксированное число запросов"""
+        category = Category.objects.create(name='Молоко', last_parsed_at=timezone.now())
+        for i in range(6):
+            product = Product.objects.create(
+                name_pyat=f"Молоко {i}" if i % 3 != 2 else None, price_pyat=80,
+                name_mag=f"Молоко М {i}" if i % 3 != 1 else None, price_mag=85)
+            product.categories.add(category)
+
+        # сессия + пользователь + категория + задания в очереди + учет поиска + счётчики
+        # + 3 группы товаров + предложения товаров групп + корзина
+        with self.assertNumQueries(11):
+            response = self.client.get(reverse('product_list'), {'q': 'молоко'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['pairs_count'], 2)
+        self.assertEqual(response.context['pyat_single_count'], 2)
+        self.assertEqual(response.context['magnit_single_count'], 2)
+        self.assertEqual(response.context['total_products'], 6)
+        self.assertEqual(len(response.context['pairs']), 2)
+
+    def _fill_category(self, count):
+        category = Category.objects.create(name='Кефир', last_parsed_at=timezone.now())
+        for i in range(count):
+            product = Product.objects.create(name_pyat=f"Кефир {i}", price_pyat=50,
+                                             name_mag=f"Кефир М {i}", price_mag=55)
+            product.categories.add(category)
+        # Одинаковое время обновления у части товаров - порядок держится на id
+        first_ids = list(Product.objects.order_by('id').values_list('id', flat=True)[:3])
+        Product.objects.filter(id__in=first_ids).update(updated_at=timezone.now())
+        return category
+
+    def test_product_page_reads_prices_from_offers(self):
+        """Цены и более дешевый магазин страницы поиска берутся из предложений магазинов"""
+        self._fill_category(1)
+        product = Product.objects.get()
+        Offer.objects.filter(product=product, store__code='mag').update(price=Decimal('45.00'))
+        Store.objects.filter(code='mag').update(name='Магнит у дома')
+
+        item = self.client.get(reverse('product_page'), {'q': 'кефир', 'bucket': 'pairs'}).json()[
+            'buckets']['pairs']['items'][0]
+        self.assertEqual(item['price_difference'], '5.00')
+        self.assertEqual(item['cheaper_store_name'], 'Магнит у дома')
+
+    @patch('catalog.views.PAGE_SIZE', 2)
+    def test_product_list_first_page(self):
+        self._fill_category(5)
+
+        response = self.client.get(reverse('product_list'), {'q': 'кефир'})
+
+        self.assertEqual(len(response.context['pairs']), 2)
+        self.assertEqual(response.context['pairs_count'], 5)
+        self.assertIsNotNone(response.context['pairs_next'])
+        self.assertIsNone(response.context['pyat_only_next'])
+
+    @patch('catalog.views.PAGE_SIZE', 2)
+    def test_product_page_walks_all_products(self):
+        """Курсоры проходят все товары группы без повторов и пропусков"""
+        self._fill_category(5)
+        expected = list(Product.objects.order_by('-updated_at', 'id').values_list('id', flat=True))
+
+        seen = []
+        params = {'q': 'кефир', 'bucket': 'pairs'}
+        while True:
+            response = self.client.get(reverse('product_page'), params)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()['buckets']['pairs']
+            seen += [item['id'] for item in page['items']]
+            if not page['next']:
+                break
+            params['pairs'] = page['next']
+
+        self.assertEqual(seen, expected)
+        # Страницы по курсору клиента в кэш не попадают - только первая
+        self.assertEqual(len(product_cache._local), 1)
+
+    def test_product_page_bad_cursor(self):
+        self._fill_category(1)
+        response = self.client.get(reverse('product_page'), {'q': 'кефир', 'pairs': 'мусор'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_product_page_unknown_category(self):
+        response = self.client.get(reverse('product_page'), {'q': 'неизвестно'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['buckets']['pairs'], {'items': [], 'next': None})
+
+    def test_product_search_ranks_local_catalog(self):
+        """Поиск по индексу: все слова запроса, похожие категории, без парсинга"""
+        milk = Product.objects.create(name_pyat="Молоко Простоквашино 2,5% 1л", price_pyat=90,
+                                      name_mag="Молоко ПРОСТОКВАШИНО 2.5%", price_mag=95)
+        Product.objects.create(name_mag="Молоко Домик в деревне", price_mag=85)
+        kefir = Product.objects.create(name_pyat="Кефир Простоквашино", price_pyat=70)
+        category = Category.objects.create(name='Молоко', last_parsed_at=timezone.now())
+        category.products.add(milk)
+
+        response = self.client.get(reverse('product_search'), {'q': 'простоквашино МОЛОКО'})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([p['id'] for p in data['products']], [milk.id])
+        self.assertEqual(data['categories'], [{
+            'name': 'Молоко', 'products_count': 1,
+            'last_parsed_at': category.last_parsed_at.isoformat()}])
+        self.assertTrue(data['needs_scrape'])
+        self.assertFalse(ScrapeJob.objects.exists())
+
+        # Индекс следует за изменением названий (триггеры срабатывают и на update)
+        Offer.objects.filter(product=kefir).update(normalized_name='молоко простоквашино')
+        data = self.client.get(reverse('product_search'), {'q': 'молоко'}).json()
+        self.assertEqual(len(data['products']), 3)
+        self.assertFalse(data['needs_scrape'])
+
+    def test_product_search_short_query(self):
+        response = self.client.get(reverse('product_search'), {'q': 'мо'})
+        self.assertEqual(response.status_code, 400)
+
     def test_add_to_cart_ajax(self):
         """Тест добавления в корзину через POST запрос (AJAX)"""
         product = Product.objects.create(name_pyat="Масло Сливочное", price_pyat=120)
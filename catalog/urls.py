@@ -4,6 +4,9 @@ from . import views
 urlpatterns = [
     path('', views.product_list, name='product_list'),
     path('check-status/', views.check_parsing_status, name='check_status'),
+    path('products/page/', views.product_page, name='product_page'),
+    path('products/stream/', views.product_stream, name='product_stream'),
+    path('products/search/', views.product_search, name='product_search'),
     path('cart/', views.cart_view, name='cart'),
     path('cart/add/', views.add_to_cart, name='add_to_cart'),
     path('cart/remove/<int:item_id>/',
@@ -1,14 +1,28 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
-from django.http import JsonResponse
-from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.db.models import Count, Exists, OuterRef, Prefetch, Q, prefetch_related_objects
 from django.utils import timezone
-import threading
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, quote_etag
+from asgiref.sync import sync_to_async
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+import asyncio
+import json
 import logging
+import math
 import sys
+import time
+from scraping.jobs import enqueue_scrape, normalize_query
+from scraping.models import ScrapeEvent, ScrapeJob
+from scraping.progress import ScrapeProgress, events_after
 from scraping.scrapers import smart_product_search, save_results_to_db
-from .models import Category, Product, CartItem
+from . import cache as product_cache
+from . import search
+from .leases import LeaseLost, hold_lease
+from .models import Category, Offer, Product, CartItem
 
 
 # --- Настройка логирования---
@@ -25,14 +39,93 @@ logger.addHandler(handler)
 logger.setLevel(logging.INFO) 
 # -----------------------------------------------
 
-# Константа для интервала обновления (в часах)
-REPARSE_INTERVAL_HOURS = 24
+# Сколько товаров каждой группы показывается за раз
+PAGE_SIZE = 30
+
+# Long-poll статуса парсинга: максимум ожидания и интервал проверки БД (с)
+LONG_POLL_MAX_SECONDS = 25
+LONG_POLL_CHECK_SECONDS = 1
+
+# Поток частичных результатов: интервал чтения событий, keep-alive,
+# максимальная длительность (с) и пауза переподключения EventSource (мс)
+STREAM_POLL_SECONDS = 0.5
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_MAX_SECONDS = 180
+STREAM_RETRY_MS = 3000
+
+
+def _offered_in(store_code):
+    """Условие: у товара есть предложение магазина"""
+    return Q(Exists(Offer.objects.filter(product=OuterRef('pk'), store__code=store_code)))
+
+
+def _offered_in_several_stores():
+    """Условие: у товара есть предложения хотя бы двух магазинов"""
+    other_store = Offer.objects.filter(product=OuterRef('product')).exclude(store=OuterRef('store'))
+    return Q(Exists(Offer.objects.filter(product=OuterRef('pk')).filter(Exists(other_store))))
+
+
+# Группы "есть только в одном магазине": имя группы -> код магазина
+SINGLE_STORE_BUCKETS = {
+    'pyat_only': 'pyat',
+    'magnit_only': 'mag',
+}
+# Группы товаров на странице поиска: ключ - имя в контексте/счётчиках.
+# Пары - товары нескольких магазинов, какие бы магазины ни были в Store
+PRODUCT_BUCKETS = {
+    'pairs': _offered_in_several_stores(),
+    **{name: _offered_in(code) & ~_offered_in_several_stores()
+       for name, code in SINGLE_STORE_BUCKETS.items()},
+}
+
+# Предложения с магазинами: по ним Product.store_prices считает наличие,
+# разницу цен и более дешевый магазин
+OFFERS_PREFETCH = Prefetch('offers', queryset=Offer.objects.select_related('store').order_by('store_id'))
+
+
+def _status_etag(category, is_parsing):
+    """
+    ETag статуса: меняется при взятии/снятии аренды, постановке в очередь
+    и сохранении товаров
+    """
+    return quote_etag(
+        f"{category.updated_at.timestamp():.6f}-{category.products_version}-{int(is_parsing)}")
+
+
+def _parsing_status(query):
+    """
+    Returns:
+        (данные ответа, категория или None, ETag или None)
+    """
+    category = Category.objects.filter(name=query.capitalize()).first()
+    if category is None:
+        logger.debug("Категория '%s' не найдена", query)
+        return {'is_parsing': False, 'query': query}, None, None
+    is_parsing = _parsing_in_progress(category)
+    logger.debug("Статус парсинга для '%s': is_parsing=%s",
+                 query, is_parsing)
+    return {
+        'is_parsing': is_parsing,
+        # Быстрый этап уже сохранил товары - их можно показать, не дожидаясь
+        # полного парсинга
+        'has_results': is_parsing and category.products.exists(),
+        'query': query
+    }, category, _status_etag(category, is_parsing)
+
 
 @require_http_methods(["GET"])
-def check_parsing_status(request):
+async def check_parsing_status(request):
     """
     Проверяет статус парсинга для запроса
     Возвращает JSON с информацией о статусе
+
+    Ответ помечен ETag/Last-Modified: повторный запрос с If-None-Match
+    получает пустой 304, пока статус не изменился. С параметром wait=<с>
+    запрос с совпавшим ETag ждет изменения статуса (long-poll, не дольше
+    LONG_POLL_MAX_SECONDS). Парсят воркеры в другом процессе, поэтому
+    изменение видно по ETag из БД, который перечитывается раз в
+    LONG_POLL_CHECK_SECONDS. Представление асинхронное, как product_stream:
+    под ASGI ожидание не занимает поток сервера.
     """
     query = request.GET.get('q', '').strip()
 
@@ -43,45 +136,77 @@ def check_parsing_status(request):
         })
 
     try:
-        category = Category.objects.get(name=query.capitalize())
-        logger.debug("Статус парсинга для '%s': is_parsing=%s",
-                     query, category.is_parsing)
-        return JsonResponse({
-            'is_parsing': category.is_parsing,
-            'query': query
-        })
-    except Category.DoesNotExist:
-        logger.debug("Категория '%s' не найдена", query)
-        return JsonResponse({
-            'is_parsing': False,
-            'query': query
-        })
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        wait = 0
+    wait = min(max(wait, 0), LONG_POLL_MAX_SECONDS) if math.isfinite(wait) else 0
+    client_etags = parse_etags(request.headers.get('If-None-Match', ''))
+    deadline = time.monotonic() + wait
+
+    while True:
+        data, category, etag = await sync_to_async(_parsing_status)(query)
+        left = deadline - time.monotonic()
+        if etag is None or etag not in client_etags or left <= 0:
+            break
+        await asyncio.sleep(min(left, LONG_POLL_CHECK_SECONDS))
+
+    response = JsonResponse(data)
+    if category is None:
+        return response
+    last_modified = int(category.updated_at.timestamp())
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'no-cache'
+    return get_conditional_response(
+        request, etag=etag, last_modified=last_modified, response=response)
+
+
+def run_parser(query, owner=None, quick=False):
+    """
+    Запускает парсинг (выполняется воркером очереди)
+
+    Парсинг идет под арендой категории: если ее держит другой воркер,
+    повторный запуск браузера пропускается.
 
+    quick=True - быстрый этап: первый экран/страница магазинов. Товары
+    сохраняются так же (полный парсинг потом дополнит и обновит их), но
+    категория не отмечается спарсенной и срок свежести по такой выборке не
+    подстраивается: если полный парсинг не выполнится, следующий поиск
+    запустит парсинг снова.
 
-def run_parser(query):
-    """Запускает парсинг"""
+    Raises:
+        Exception: Ошибка парсинга - аренда уже освобождена
+    """
+    progress = ScrapeProgress(normalize_query(query))
     try:
         logger.info("🔍 НАЧАЛО ПАРСИНГА: '%s'", query)
 
-        # 1️⃣ Получаем категорию и устанавливаем флаг is_parsing = True
+        # 1️⃣ Получаем категорию и берем аренду парсинга
         category = Category.objects.get(name=query.capitalize())
-        category.is_parsing = True
-        category.save()
-        logger.info(
-            "✅ Флаг парсинга установлен: is_parsing=True для категории '%s'", query)
-
-        # 2️⃣ Парсим
-        result = smart_product_search(query)
-
-        # 3️⃣ Сохраняем в БД
-        save_results_to_db(result, query)
-
-        # 4️⃣ Устанавливаем флаг is_parsing = False (ПАРСИНГ ЗАВЕРШЕН)
-        category.is_parsing = False
-        category.last_parsed_at = timezone.now()
-        category.save()
+        with hold_lease(category, owner) as lease:
+            if lease is None:
+                logger.info("⏳ Категорию '%s' уже парсит %s - пропускаем",
+                            query, category.lease_owner or 'другой воркер')
+                return
+            logger.info("✅ Аренда парсинга получена: %s для категории '%s'",
+                        lease.owner, query)
+            progress.start()
+
+            # 2️⃣ Парсим, частичные результаты идут в поток страницы поиска
+            result = smart_product_search(query, progress=progress, quick=quick)
+            if lease.lost:
+                raise LeaseLost(f"аренда парсинга '{query}' истекла во время парсинга")
+
+            # 3️⃣ Сохраняем в БД и подстраиваем срок свежести под изменчивость цен
+            stats = save_results_to_db(result, query)
+            if not quick:
+                # Изменчивость - доля изменившихся цен, правки названий не в счет
+                category.record_parse(stats['price_changed'], stats['updated'] + stats['unchanged'])
+
+            # 4️⃣ Освобождаем аренду; время парсинга отмечает только полный парсинг
+            category.release_lease(lease.owner, parsed=not quick)
+            progress.done(stats)
         logger.info("✅ ПАРСИНГ ЗАВЕРШЁН: '%s'", query)
-        logger.info("✅ Флаг парсинга обновлен: is_parsing=False")
         logger.info("✅ Время последнего парсинга: %r", category.last_parsed_at)
 
     except Category.DoesNotExist:
@@ -91,18 +216,24 @@ def run_parser(query):
     except Exception as e:
         logger.error("❌ ОШИБКА при парсинге '%s': %s",
                      query, str(e), exc_info=True)
-        try:
-            category = Category.objects.get(name=query.capitalize())
-            category.is_parsing = False
-            category.save()
-            logger.warning(
-                "⚠️ Флаг парсинга сброшен из-за ошибки: is_parsing=False")
-        except Exception as reset_error:
-            logger.error("❌ Ошибка при сбросе флага парсинга: %s",
-                         str(reset_error))
+        progress.error(str(e))
+        # Аренда уже освобождена, очередь повторит задание с задержкой
+        raise
+
+
+def _parsing_in_progress(category):
+    """Парсинг идет (аренда) или ждет воркера в очереди"""
+    return category.is_parsing or ScrapeJob.objects.filter(
+        query=normalize_query(category.name),
+        status__in=[ScrapeJob.PENDING, ScrapeJob.RUNNING],
+    ).exists()
 
 
 def _get_category(query):
+    """
+    Returns:
+        (категория, нужно ли ставить парсинг, идет ли парсинг - см. _parsing_in_progress)
+    """
     category, category_created = Category.objects.get_or_create(
         name=query.capitalize()
     )
@@ -113,13 +244,16 @@ def _get_category(query):
             "🏷️ Используется существующая категория: '%s'", category.name)
 
     should_parse = False
+    # У новой категории еще нет ни аренды, ни заданий
+    is_parsing = not category_created and _parsing_in_progress(category)
 
     if category_created:
         # Новая категория - парсим сразу
         should_parse = True
         logger.info("📌 Новая категория - запускаем парсинг")
-    elif category.is_parsing:
-        # Уже идет парсинг - не запускаем новый
+    elif is_parsing:
+        # Уже идет парсинг или он ждет в очереди (в том числе полный парсинг
+        # после быстрого этапа) - не запускаем новый
         should_parse = False
         logger.info("⏳ Парсинг уже идет для '%s'", query)
     elif not category.last_parsed_at:
@@ -128,17 +262,275 @@ def _get_category(query):
         logger.info(
             "📌 Категория никогда не парсилась - запускаем парсинг")
     elif category.needs_update:
-        # Прошло более 24 часов - обновляем
+        # Истек срок свежести категории - обновляем
         hours_ago = category.hours_since_last_parse
         should_parse = True
         logger.info(
-            "📌 Прошло %.1f часов с последнего парсинга - запускаем обновление", hours_ago)
+            "📌 Прошло %.1f часов с последнего парсинга (срок %.1f ч) - запускаем обновление",
+            hours_ago, category.ttl_hours)
     else:
-        # Данные свежие (менее 24 часов)
+        # Данные свежие (срок свежести не истек)
         hours_ago = category.hours_since_last_parse
         logger.info(
             "✅ Данные свежие (%.1f часов назад) - используем сохраненные данные", hours_ago)
-    return category, should_parse
+    return category, should_parse, is_parsing
+
+
+def _search_products(category):
+    """Товары для страницы поиска - товары категории запроса"""
+    logger.debug("🏷️ Категория: %s", category)
+    return category.products.all()
+
+
+def _encode_cursor(product):
+    """Курсор страницы - ключ (updated_at, id) последнего показанного товара"""
+    raw = json.dumps([product.updated_at.isoformat(), product.id])
+    return urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """
+    Raises:
+        ValueError: Курсор повреждён
+    """
+    try:
+        updated_at, product_id = json.loads(urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(updated_at), int(product_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+
+
+def _keyset_page(products, cursor=None, limit=None):
+    """
+    Страница товаров в порядке (-updated_at, id), начиная после курсора
+
+    В отличие от OFFSET, страница читается по индексу сразу с нужного
+    места и не "съезжает", если между запросами добавились товары.
+
+    Returns:
+        (список товаров, курсор следующей страницы или None)
+    """
+    limit = limit or PAGE_SIZE
+    products = products.order_by('-updated_at', 'id')
+    if cursor:
+        updated_at, product_id = _decode_cursor(cursor)
+        products = products.filter(
+            Q(updated_at__lt=updated_at) |
+            Q(updated_at=updated_at, id__gt=product_id)
+        )
+    page = list(products[:limit + 1])
+    next_cursor = _encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
+def _prefetch_offers(products):
+    """Подгружает предложения товаров одним запросом (см. OFFERS_PREFETCH)"""
+    prefetch_related_objects(products, OFFERS_PREFETCH)
+
+
+def _offers_page(products, cursor=None):
+    """_keyset_page с предложениями товаров"""
+    page, next_cursor = _keyset_page(products, cursor)
+    _prefetch_offers(page)
+    return page, next_cursor
+
+
+def _product_json(product, user_cart_ids):
+    return {
+        'id': product.id,
+        'name_pyat': product.name_pyat,
+        'price_pyat': str(product.price_pyat) if product.price_pyat is not None else None,
+        'name_mag': product.name_mag,
+        'price_mag': str(product.price_mag) if product.price_mag is not None else None,
+        'similarity': product.similarity,
+        'price_difference': f"{product.price_difference:.2f}",
+        'cheaper_store_name': product.cheaper_store_name,
+        'in_cart': product.id in user_cart_ids,
+    }
+
+
+@require_http_methods(["GET"])
+def product_page(request):
+    """
+    Следующая страница групп товаров для подгрузки на странице поиска
+
+    GET параметры:
+    - q: поисковый запрос
+    - bucket: группа (pairs, pyat_only, magnit_only), по умолчанию все
+    - <группа>: курсор из предыдущего ответа (или из страницы поиска)
+    """
+    query = request.GET.get('q', '').strip()
+    bucket_names = [request.GET['bucket']] if request.GET.get('bucket') else list(PRODUCT_BUCKETS)
+    if any(name not in PRODUCT_BUCKETS for name in bucket_names):
+        return JsonResponse({
+            'status': 'error',
+            'message': f"Неизвестная группа: {request.GET['bucket']}"
+        }, status=400)
+
+    category = Category.objects.filter(name=query.capitalize()).first()
+    if category is None:
+        return JsonResponse({
+            'query': query,
+            'buckets': {name: {'items': [], 'next': None} for name in bucket_names},
+        })
+
+    user_cart_ids = set()
+    if request.user.is_authenticated:
+        user_cart_ids = set(CartItem.objects.filter(
+            user=request.user).values_list('product_id', flat=True))
+
+    products = _search_products(category)
+    buckets = {}
+    try:
+        for name in bucket_names:
+            cursor = request.GET.get(name)
+            if cursor:
+                # Курсор присылает клиент - страницы по курсору не кэшируются,
+                # иначе число ключей кэша не ограничено
+                page, next_cursor = _offers_page(products.filter(PRODUCT_BUCKETS[name]), cursor)
+            else:
+                page, next_cursor = product_cache.get_or_compute(
+                    category, name, lambda: _offers_page(products.filter(PRODUCT_BUCKETS[name])))
+            buckets[name] = {
+                'items': [_product_json(product, user_cart_ids) for product in page],
+                'next': next_cursor,
+            }
+    except ValueError as e:
+        logger.warning("⚠️ %s", str(e))
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+
+    return JsonResponse({
+        'query': query,
+        'buckets': buckets,
+    })
+
+
+def _sse(event):
+    """Событие парсинга в формате text/event-stream"""
+    data = dict(event.data, store=event.store) if event.store else event.data
+    return f"id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@require_http_methods(["GET"])
+async def product_stream(request):
+    """
+    Поток частичных результатов парсинга (Server-Sent Events)
+
+    Отдает товары каждого магазина по мере сбора, затем найденные пары и
+    событие done/error. Представление асинхронное: под ASGI (config.asgi)
+    ожидание долгого парсинга не занимает поток сервера.
+
+    GET параметры:
+    - q: поисковый запрос
+    Заголовок Last-Event-ID (переподключение EventSource) - продолжить после события
+    """
+    query = normalize_query(request.GET.get('q', ''))
+    last_event_id = request.headers.get('Last-Event-ID')
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+
+    async def events():
+        nonlocal after
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        idle_since = time.monotonic()
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        while time.monotonic() < deadline:
+            batch = await sync_to_async(events_after)(query, after)
+            for event in batch:
+                after = event.id
+                yield _sse(event)
+                if event.kind in ScrapeEvent.FINAL:
+                    return
+            if batch:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= STREAM_KEEPALIVE_SECONDS:
+                # Комментарий SSE: не дает прокси закрыть молчащее соединение
+                idle_since = time.monotonic()
+                yield ": ping\n\n"
+            await asyncio.sleep(STREAM_POLL_SECONDS)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_http_methods(["GET"])
+def product_search(request):
+    """
+    Поиск по локальному каталогу без запуска парсинга
+
+    Отвечает сразу из поискового индекса (catalog.search): товары, в
+    названиях которых есть слова запроса, и категории с похожими
+    названиями. needs_scrape - нет свежей категории с таким названием,
+    то есть страница поиска поставила бы парсинг в очередь.
+
+    GET параметры:
+    - q: поисковый запрос (от 3 символов)
+    - limit: сколько товаров вернуть (не больше PAGE_SIZE)
+    """
+    query = request.GET.get('q', '').strip()
+    if len(query) <= 2:
+        return JsonResponse({
+            'status': 'error',
+            'message': "Запрос должен быть длиннее 2 символов"
+        }, status=400)
+    try:
+        limit = min(max(int(request.GET.get('limit', PAGE_SIZE)), 1), PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({
+            'status': 'error',
+            'message': f"Некорректный limit: {request.GET['limit']}"
+        }, status=400)
+
+    user_cart_ids = set()
+    if request.user.is_authenticated:
+        user_cart_ids = set(CartItem.objects.filter(
+            user=request.user).values_list('product_id', flat=True))
+
+    products = search.search_products(query, limit=limit)
+    categories = search.nearby_categories(query)
+    counts = dict(Category.objects.filter(id__in=[c.id for c in categories]).annotate(
+        products_count=Count('products')).values_list('id', 'products_count'))
+    category = next((c for c in categories if c.name == query.capitalize()), None)
+    if category is None:
+        category = Category.objects.filter(name=query.capitalize()).first()
+
+    return JsonResponse({
+        'query': query,
+        'products': [_product_json(product, user_cart_ids) for product in products],
+        'categories': [{
+            'name': c.name,
+            'products_count': counts.get(c.id, 0),
+            'last_parsed_at': c.last_parsed_at.isoformat() if c.last_parsed_at else None,
+        } for c in categories],
+        'needs_scrape': category is None or category.needs_update,
+    })
+
+
+def _first_pages(category):
+    """
+    Счётчики групп и первая страница каждой группы
+
+    Returns:
+        (счётчики, {группа: (товары, курсор следующей страницы)})
+    """
+    products = _search_products(category)
+
+    # Все счётчики - одним запросом с условной агрегацией
+    counts = products.aggregate(
+        total=Count('id'),
+        **{name: Count('id', filter=bucket) for name, bucket in PRODUCT_BUCKETS.items()}
+    )
+    # Пустые группы не читаются
+    pages = {
+        name: _keyset_page(products.filter(bucket)) if counts[name] else ([], None)
+        for name, bucket in PRODUCT_BUCKETS.items()
+    }
+    _prefetch_offers([product for page, _ in pages.values() for product in page])
+    return counts, pages
 
 
 def product_list(request):
@@ -149,6 +541,8 @@ def product_list(request):
     pyat_only = None
     mag_only = None
     total_products = 0
+    pairs_count = pyat_single_count = magnit_single_count = 0
+    pairs_next = pyat_only_next = magnit_only_next = None
     is_searching = False
     last_update_info = None
 
@@ -157,73 +551,52 @@ def product_list(request):
         logger.info("🔍 Поиск товаров по запросу: '%s'", query)
 
         # Получаем или создаем статус парсинга
-        category, should_parse = _get_category(query)
+        category, should_parse, is_parsing = _get_category(query)
+        category.record_search()
         # Запускаем парсинг если нужно
-        if should_parse and not category.is_parsing:
-            category.is_parsing = True
-            category.save()
-
-            thread = threading.Thread(
-                target=run_parser,
-                args=(query,),
-                daemon=False  # Не демонический поток
-            )
-            thread.start()
-            logger.info("✨ Парсинг запущен для '%s' в отдельном потоке", query)
-
-        # Получаем товары из категории
-        if category:
-            products = category.products.all().order_by('-updated_at')
-            logger.debug("🏷️ Категория: %s", category)
-            logger.debug("📦 Товаров в категориях: %s", products.count())
-        else:
-            products = Product.objects.all().filter(
-                Q(name_pyat__icontains=query) |
-                Q(name_mag__icontains=query)
-            ).order_by('-updated_at')
-
-        if products.exists():
-            logger.debug("📦 Найдено %s товаров для '%s'",
-                         products.count(), query)
-        else:
+        if should_parse:
+            # Парсят воркеры очереди (manage.py scrape_worker), не поток на запрос;
+            # одинаковые запросы очередь не дублирует
+            # Быстрый этап, полный парсинг воркер поставит после него
+            enqueue_scrape(query, priority=ScrapeJob.PRIORITY_USER, deep=False)
+            is_parsing = True
+            logger.info("✨ Парсинг '%s' поставлен в очередь", query)
+
+        # Товары категории меняются только при сохранении парсинга - берем из кэша
+        counts, pages = product_cache.get_or_compute(
+            category, 'first', lambda: _first_pages(category))
+        total_products = counts['total']
+        if not total_products:
             logger.warning("❌ Товары не найдены для запроса '%s'", query)
 
-        # Разделяем на категории
-        pairs = products.filter(
-            name_pyat__isnull=False,
-            name_mag__isnull=False,
-        )
-        pyat_only = products.filter(
-            name_pyat__isnull=False,
-            name_mag__isnull=True,
-        )
-        mag_only = products.filter(
-            name_pyat__isnull=True,
-            name_mag__isnull=False,
-        )
-
-        total_products = products.count()
+        (pairs, pairs_next), (pyat_only, pyat_only_next), (mag_only, magnit_only_next) = \
+            pages.values()
+        pairs_count = counts['pairs']
+        pyat_single_count = counts['pyat_only']
+        magnit_single_count = counts['magnit_only']
         logger.info(
-            "📊 Результаты поиска: пар=%s, только Пятёрочка=%s, только Магнит=%s, всего=%s", pairs.count(), pyat_only.count(), mag_only.count(), total_products)
+            "📊 Результаты поиска: пар=%s, только Пятёрочка=%s, только Магнит=%s, всего=%s",
+            pairs_count, pyat_single_count, magnit_single_count, total_products)
 
         if category.last_parsed_at:
             hours_ago = category.hours_since_last_parse
             last_update_info = f"Последнее обновление: {hours_ago:.1f}ч назад"
 
-        # Если товаров нет и парсинг активен - показываем индикатор
-        if total_products == 0 and category.is_parsing:
-            is_searching = True
+        # Индикатор - только если показать нечего; иначе отдаем сохраненные
+        # данные, а обновление идет в фоне (stale-while-revalidate)
+        is_searching = total_products == 0 and is_parsing
+        if is_searching:
             logger.info(
                 "🔄 Парсинг активен и товаров нет, показываем индикатор загрузки")
-        else:
-            is_searching = category.is_parsing  # Показываем статус парсинга
+        elif is_parsing and last_update_info:
+            last_update_info += " (обновляется в фоне)"
 
     # Товары в корзине текущего пользователя
     user_cart_ids = []
     if request.user.is_authenticated:
-        user_cart_ids = CartItem.objects.filter(
+        user_cart_ids = list(CartItem.objects.filter(
             user=request.user
-        ).values_list('product_id', flat=True)
+        ).values_list('product_id', flat=True))
         if user_cart_ids:
             logger.debug("🛒 Пользователь %s имеет %s товаров в корзине",
                          request.user.username, len(user_cart_ids))
@@ -231,13 +604,16 @@ def product_list(request):
     context = {
         'query': query,
         'pairs': pairs,
-        'pairs_count': pairs.count() if pairs else 0,
-        'pyat_single_count': pyat_only.count() if pyat_only else 0,
-        'magnit_single_count': mag_only.count() if mag_only else 0,
+        'pairs_count': pairs_count,
+        'pyat_single_count': pyat_single_count,
+        'magnit_single_count': magnit_single_count,
         'pyat_only': pyat_only,
         'magnit_only': mag_only,
+        'pairs_next': pairs_next,
+        'pyat_only_next': pyat_only_next,
+        'magnit_only_next': magnit_only_next,
         'total_products': total_products,
-        'user_cart_ids': list(user_cart_ids),
+        'user_cart_ids': user_cart_ids,
         'is_searching': is_searching,
         'last_update_info': last_update_info,
     }
@@ -253,7 +629,8 @@ def cart_view(request):
                 request.user.username)
     # Получаем все товары в корзине пользователя
     cart_items = CartItem.objects.filter(
-        user=request.user).select_related('product').order_by('-added_at')
+        user=request.user).select_related('product').prefetch_related(
+        Prefetch('product__offers', queryset=OFFERS_PREFETCH.queryset)).order_by('-added_at')
 
     # Расчет сумм по магазинам
     pyat_total = 0
@@ -263,24 +640,25 @@ def cart_view(request):
 
     for item in cart_items:
         product = item.product
+        prices = product.store_prices
 
         if not product.has_pyat:
             if product.has_mag:
-                only_mag += float(product.price_mag) * item.quantity
+                only_mag += float(prices['mag'] or 0) * item.quantity
             continue
 
         if not product.has_mag:
             if product.has_pyat:
-                only_pyat += float(product.price_pyat) * item.quantity
+                only_pyat += float(prices['pyat'] or 0) * item.quantity
             continue
 
         # Пятёрочка
-        if product.price_pyat:
-            pyat_total += float(product.price_pyat) * item.quantity
+        if prices['pyat']:
+            pyat_total += float(prices['pyat']) * item.quantity
 
         # Магнит
-        if product.price_mag:
-            mag_total += float(product.price_mag) * item.quantity
+        if prices['mag']:
+            mag_total += float(prices['mag']) * item.quantity
 
     total_savings = abs(mag_total - pyat_total)
 
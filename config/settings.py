@@ -88,6 +88,22 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# Кэш страниц поиска общий для процессов сервера, только если он файловый:
+# задайте CACHE_DIR, иначе у каждого процесса свой кэш в памяти
+
+CACHE_DIR = os.getenv('CACHE_DIR')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+    } if CACHE_DIR else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -133,6 +149,10 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
 
+# Каталог файловых логов не хранится в репозитории - создаем при запуске
+LOG_DIR = BASE_DIR / 'logs'
+LOG_DIR.mkdir(exist_ok=True)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -150,7 +170,7 @@ LOGGING = {
         },
         'file': {
             'class': 'logging.handlers.RotatingFileHandler',
-            'filename': 'logs/parsing.log',
+            'filename': LOG_DIR / 'parsing.log',
             'maxBytes': 1024 * 1024 * 10,
             'backupCount': 5,
         },
@@ -0,0 +1,70 @@
+"""
+Оптимальное (глобальное) сопоставление товаров.
+
+Жадный поиск зависит от порядка товаров: ранний слабый матч может занять
+товар Магнита, который позже нашёл бы пару намного лучше. Здесь пары
+выбираются сразу все - как задача о назначениях на разреженной матрице
+сходства (только пары не ниже порога), решаемая алгоритмом LAPJVsp из
+scipy.sparse.csgraph. Максимизируется суммарное сходство пар.
+
+Чтобы полное назначение существовало всегда, у каждого товара Пятёрочки
+есть фиктивный товар Магнита "без пары" со стоимостью как у сходства 0:
+стоимость пары = 101 - сходство, стоимость "без пары" = 101. Тогда минимум
+суммарной стоимости - это максимум суммарного сходства.
+"""
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+# Стоимость назначения "без пары" (сходство 0), все веса ненулевые
+UNMATCHED_COST = 101
+
+
+def optimal_pairs(pyat_products, magnit_products, edges):
+    """
+    Оптимальные пары по списку рёбер сходства
+
+    Args:
+        pyat_products: Товары из Пятёрочки
+        magnit_products: Товары из Магнита
+        edges: [(pyat_idx, magnit_idx, similarity)] - пары, прошедшие порог
+
+    Returns:
+        (pairs, used_pyat_indices, used_magnit_indices)
+    """
+    pairs = []
+    used_pyat_indices = set()
+    used_magnit_indices = set()
+    if not pyat_products or not edges:
+        return pairs, used_pyat_indices, used_magnit_indices
+
+    n_pyat = len(pyat_products)
+    n_magnit = len(magnit_products)
+    rows, cols, similarities = (np.asarray(column, dtype=np.int64)
+                                for column in zip(*edges))
+    dummy = np.arange(n_pyat, dtype=np.int64)
+    graph = sparse.csr_matrix(
+        (np.concatenate([UNMATCHED_COST - similarities,
+                         np.full(n_pyat, UNMATCHED_COST, dtype=np.int64)]),
+         (np.concatenate([rows, dummy]), np.concatenate([cols, n_magnit + dummy]))),
+        shape=(n_pyat, n_magnit + n_pyat))
+
+    similarity_of = {(int(r), int(c)): int(s)
+                     for r, c, s in zip(rows, cols, similarities)}
+    row_ind, col_ind = min_weight_full_bipartite_matching(graph)
+    for pyat_idx, magnit_idx in zip(row_ind.tolist(), col_ind.tolist()):
+        if magnit_idx >= n_magnit:
+            continue
+        pyat_prod = pyat_products[pyat_idx]
+        best_match = magnit_products[magnit_idx]
+        pairs.append({
+            'similarity': similarity_of[pyat_idx, magnit_idx],
+            'pyat': pyat_prod,
+            'price_pyat': pyat_prod['price'],
+            'magnit': best_match,
+            'price_mag': best_match['price'],
+        })
+        used_pyat_indices.add(pyat_idx)
+        used_magnit_indices.add(magnit_idx)
+
+    return pairs, used_pyat_indices, used_magnit_indices
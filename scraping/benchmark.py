@@ -0,0 +1,91 @@
+"""
+Синтетические каталоги и замеры времени для бенчмарков сопоставления
+"""
+from decimal import Decimal
+import random
+import time
+
+CATEGORIES = [
+    'Молоко', 'Кефир', 'Сыр', 'Йогурт', 'Творог', 'Сметана', 'Масло сливочное',
+    'Хлеб', 'Батон', 'Колбаса', 'Сосиски', 'Чай', 'Кофе', 'Сок', 'Вода',
+    'Печенье', 'Шоколад', 'Макароны', 'Рис', 'Гречка',
+]
+BRANDS = [
+    'Простоквашино', 'Домик в деревне', 'Весёлый молочник', 'Parmalat',
+    'Савушкин', 'Агуша', 'Valio', 'Bonduelle', 'Черкизово', 'Останкино',
+    'Lipton', 'Jacobs', 'Добрый', 'Любятово', 'Alpen Gold', 'Макфа', 'Barilla',
+    'Увелка', 'Мираторг', 'Брест-Литовск', 'Экомилк', 'Тёма', 'Коровка из Кореновки',
+]
+DESCRIPTORS = [
+    'ультрапастеризованное', 'отборное', 'классический', 'нежный',
+    'безлактозный', 'фермерский', 'цельный', 'питьевой', 'традиционный',
+    'хрустящий', 'ржаной', 'пшеничный', 'копчёная', 'варёная', 'молочные',
+    'чёрный', 'молотый', 'яблочный', 'газированная', 'овсяное', 'с ванилью',
+    'с клубникой', 'без сахара', 'детский', 'домашний',
+]
+FATS = ['0,5%', '1%', '1,5%', '2,5%', '3,2%', '3,5%', '6%', '9%', '15%', '20%', '82,5%']
+SIZES = ['930мл', '1л', '900г', '500г', '200г', '180г', '0,5л', '400г', '250г',
+         '1кг', '100г', '300мл', '1,4л', '750г', '330мл']
+
+
+def _random_name(rnd):
+    parts = [rnd.choice(CATEGORIES), rnd.choice(BRANDS)]
+    parts += rnd.sample(DESCRIPTORS, rnd.randint(0, 2))
+    if rnd.random() < 0.6:
+        parts.append(rnd.choice(FATS))
+    parts.append(rnd.choice(SIZES))
+    return " ".join(parts)
+
+
+def _perturb(name, rnd):
+    """Как один и тот же товар называется в другом магазине"""
+    tokens = name.split()
+    if rnd.random() < 0.3:
+        tokens.insert(rnd.randint(1, len(tokens)), 'БЗМЖ')
+    if rnd.random() < 0.3 and len(tokens) > 3:
+        tokens.pop(rnd.randint(2, len(tokens) - 1))
+    if rnd.random() < 0.3:
+        rnd.shuffle(tokens)
+    text = " ".join(tokens)
+    if rnd.random() < 0.4:
+        text = text.replace(',', '.')
+    if rnd.random() < 0.3:
+        text = text.replace('мл', ' мл').replace('г', ' г')
+    if rnd.random() < 0.2:
+        text = text.upper()
+    return text
+
+
+def _price(rnd):
+    return Decimal(rnd.randint(3000, 99999)) / 100
+
+
+def make_catalogs(n_pyat, n_magnit, seed=0, overlap=0.5):
+    """
+    Синтетические результаты поиска двух магазинов
+
+    Доля overlap товаров Магнита - это товары Пятёрочки под другим
+    названием, остальные - случайные товары.
+    """
+    rnd = random.Random(seed)
+    pyat_products = [
+        {'name': _random_name(rnd), 'price': _price(rnd), 'page': 1}
+        for _ in range(n_pyat)
+    ]
+
+    magnit_products = []
+    for _ in range(n_magnit):
+        if pyat_products and rnd.random() < overlap:
+            name = _perturb(rnd.choice(pyat_products)['name'], rnd)
+        else:
+            name = _random_name(rnd)
+        magnit_products.append({'name': name, 'price': _price(rnd), 'page': 1})
+    rnd.shuffle(magnit_products)
+    return pyat_products, magnit_products
+
+
+def timed(func, *args, **kwargs):
+    """Вызывает func и возвращает (результат, секунды)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
@@ -0,0 +1,187 @@
+"""
+Пул прогретых драйверов Chrome.
+
+Запуск headless Chrome занимает секунды, поэтому драйвер после парсинга
+не закрывается, а возвращается в пул и достаётся следующему магазину.
+Одновременно живёт не больше max_size драйверов: если все заняты,
+acquire ждёт, пока какой-нибудь освободится.
+
+Чтобы пул не копил ресурсы:
+
+* свободный дольше max_idle секунд драйвер закрывается фоновым потоком;
+* перед выдачей драйвер проверяется - упавший браузер заменяется новым;
+* после max_pages загруженных страниц драйвер пересоздаётся (Chrome со
+  временем разрастается по памяти);
+* close() закрывает всё при остановке процесса.
+"""
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from selenium.common.exceptions import WebDriverException
+
+logger = logging.getLogger(__name__)
+
+
+class DriverPool:
+    """Ограниченный пул переиспользуемых драйверов"""
+
+    def __init__(self, factory, max_size=2, max_idle=300, max_pages=50):
+        """
+        Args:
+            factory: Функция без аргументов, создающая новый драйвер
+            max_size: Максимум одновременно живых драйверов
+            max_idle: Через сколько секунд простоя драйвер закрывается
+            max_pages: После скольких страниц драйвер пересоздаётся
+        """
+        self._factory = factory
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_pages = max_pages
+        self._idle = []  # [(драйвер, time.monotonic() возврата в пул)]
+        self._pages = {}
+        self._created = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._reaper = None
+        # У фонового потока свое событие: notify() в release/_discard должен
+        # будить ожидающего драйвер, а не его
+        self._stopped = threading.Event()
+
+    def acquire(self, timeout=None):
+        """
+        Берёт свободный рабочий драйвер из пула или создаёт новый
+
+        Raises:
+            TimeoutError: Все драйверы заняты дольше timeout секунд
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise RuntimeError("Пул драйверов закрыт")
+                while not self._idle and self._created >= self.max_size:
+                    if self._closed:
+                        # close() разбудил ожидающих - новых драйверов не создаём
+                        raise RuntimeError("Пул драйверов закрыт")
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("Нет свободного драйвера в пуле")
+                    self._condition.wait(remaining)
+                if not self._idle:
+                    self._created += 1
+                    break
+                driver, _ = self._idle.pop()
+
+            if self._is_alive(driver):
+                return driver
+            logger.warning("⚠️ Браузер из пула не отвечает, создаём новый")
+            self._discard(driver)
+
+        try:
+            driver = self._factory()
+        except Exception:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._pages[driver] = 0
+        self._start_reaper()
+        return driver
+
+    def add_pages(self, driver, pages):
+        """Учитывает страницы, загруженные драйвером"""
+        with self._condition:
+            self._pages[driver] = self._pages.get(driver, 0) + pages
+
+    def release(self, driver, discard=False):
+        """
+        Возвращает драйвер в пул; сломанный (discard=True) или
+        отработавший max_pages страниц - закрывает
+        """
+        with self._condition:
+            worn_out = self._pages.get(driver, 0) >= self.max_pages
+            if not (discard or worn_out or self._closed):
+                self._idle.append((driver, time.monotonic()))
+                self._condition.notify()
+                return
+        if worn_out:
+            logger.info("♻️ Браузер загрузил %s страниц, пересоздаём", self._pages[driver])
+        self._discard(driver)
+
+    @contextmanager
+    def driver(self, timeout=None):
+        """Драйвер на время блока with, после - обратно в пул"""
+        driver = self.acquire(timeout)
+        discard = False
+        try:
+            yield driver
+        except WebDriverException:
+            # Браузер мог упасть - второй раз его не выдаём
+            discard = True
+            raise
+        finally:
+            self.release(driver, discard=discard)
+
+    def evict_idle(self):
+        """Закрывает драйверы, простаивающие дольше max_idle секунд"""
+        now = time.monotonic()
+        with self._condition:
+            expired = [driver for driver, released_at in self._idle
+                       if now - released_at >= self.max_idle]
+            self._idle = [(driver, released_at) for driver, released_at in self._idle
+                          if now - released_at < self.max_idle]
+        for driver in expired:
+            self._discard(driver)
+        if expired:
+            logger.info("💤 Закрыто простаивающих браузеров: %s", len(expired))
+
+    def close(self):
+        """Закрывает все свободные драйверы, занятые закроются при release"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._condition.notify_all()
+        self._stopped.set()
+        for driver, _ in idle:
+            self._discard(driver)
+        if idle:
+            logger.info("🔚 Закрыто браузеров из пула: %s", len(idle))
+
+    def _discard(self, driver):
+        with self._condition:
+            self._created -= 1
+            self._pages.pop(driver, None)
+            self._condition.notify()
+        _quit(driver)
+
+    @staticmethod
+    def _is_alive(driver):
+        """Проверка здоровья: браузер отвечает на простую команду"""
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def _start_reaper(self):
+        with self._condition:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(
+                target=self._reap, name='driver-pool-reaper', daemon=True)
+        self._reaper.start()
+
+    def _reap(self):
+        """Фоновый поток: периодически закрывает простаивающие драйверы"""
+        while not self._stopped.wait(max(self.max_idle / 2, 1)):
+            self.evict_idle()
+
+
+def _quit(driver):
+    try:
+        driver.quit()
+    except Exception as e:
+        logger.warning("⚠️ Не удалось закрыть браузер: %s", str(e))
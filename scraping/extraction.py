@@ -0,0 +1,55 @@
+"""
+Разбор HTML страниц магазинов.
+
+Страница поиска - сотни килобайт разметки, а парсерам нужны только
+карточки товаров. Поэтому:
+
+- дерево строит самый быстрый доступный бэкенд BeautifulSoup: lxml (C),
+  если установлен, иначе встроенный html.parser;
+- SoupStrainer оставляет только поддеревья карточек - остальная страница
+  не превращается в объекты Tag.
+
+Карточки - обычные bs4 Tag, поэтому extract_product_name/
+extract_product_price парсеров работают с ними как раньше.
+"""
+import functools
+import logging
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+logger = logging.getLogger(__name__)
+
+# Бэкенды BeautifulSoup в порядке предпочтения (SoupStrainer поддерживают оба)
+HTML_PARSERS = ('lxml', 'html.parser')
+
+
+@functools.lru_cache(maxsize=None)
+def default_html_parser():
+    """Первый установленный бэкенд из HTML_PARSERS"""
+    for parser in HTML_PARSERS:
+        if parser == 'html.parser':
+            return parser
+        try:
+            __import__(parser)
+        except ImportError:
+            continue
+        logger.debug("HTML-бэкенд разбора: %s", parser)
+        return parser
+    return 'html.parser'
+
+
+def parse_cards(html, name, attrs, parser=None):
+    """
+    Карточки товаров страницы без построения дерева всей страницы
+
+    Args:
+        html: Разметка страницы (driver.page_source)
+        name, attrs: Тег и атрибуты карточки (как в find_all)
+        parser: Бэкенд BeautifulSoup (по умолчанию - default_html_parser())
+
+    Returns:
+        Список карточек (bs4 Tag) в порядке на странице
+    """
+    soup = BeautifulSoup(html, parser or default_html_parser(),
+                         parse_only=SoupStrainer(name, attrs=attrs))
+    return soup.find_all(name, attrs=attrs)
@@ -0,0 +1,230 @@
+"""
+Очередь заданий на парсинг в БД.
+
+Вместо отдельного потока с браузером на каждый поиск страница только ставит
+задание в очередь, а выполняют их воркеры (manage.py scrape_worker) с
+ограниченным числом одновременных парсингов:
+
+* одинаковые запросы не дублируются - активное задание на запрос одно,
+  повторная постановка только поднимает приоритет;
+* поиск пользователя (PRIORITY_USER) берётся раньше планового обновления;
+* задание берётся атомарным UPDATE ... WHERE status='pending', поэтому
+  несколько воркеров не возьмут одно задание; завершить задание может
+  только воркер, который его держит;
+* упавшее задание повторяется с экспоненциальной задержкой;
+* воркер продлевает locked_at выполняющегося задания, а задание умершего
+  воркера (locked_at старше JOB_TIMEOUT_SECONDS) claim_job возвращает
+  в очередь;
+* поиск пользователя - быстрый этап (deep=False): первый экран/страница
+  магазинов сохраняется через секунды, а после него ставится полный
+  парсинг (PRIORITY_DEEP), результат которого сливается с уже сохраненным.
+"""
+from datetime import timedelta
+import logging
+import threading
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, IntegerField, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
+
+from scraping.models import ScrapeJob
+
+logger = logging.getLogger(__name__)
+
+# Задержка перед повтором: RETRY_BASE_SECONDS * 2 ** (попытка - 1)
+RETRY_BASE_SECONDS = 60
+# Через сколько "выполняющееся" задание без продления считается брошенным
+JOB_TIMEOUT_SECONDS = 15 * 60
+# Как часто воркер продлевает locked_at выполняющегося задания
+JOB_HEARTBEAT_SECONDS = 60
+# Ключ pg_advisory_xact_lock: захваты с лимитом max_running идут по одному
+CLAIM_LOCK_ID = 0x5c7a9e
+
+
+def normalize_query(query):
+    """Ключ дедупликации: как имя категории (лишние пробелы, регистр)"""
+    return " ".join(query.split()).capitalize()
+
+
+def enqueue_scrape(query, priority=ScrapeJob.PRIORITY_USER, deep=True):
+    """
+    Ставит парсинг запроса в очередь (или поднимает приоритет уже стоящего)
+
+    Args:
+        deep: Полный парсинг; False - быстрый этап, после которого
+            run_job сам поставит полный
+
+    Returns:
+        (задание, создано ли новое)
+    """
+    query = normalize_query(query)
+    active = ScrapeJob.objects.filter(
+        query=query, deep=deep, status__in=[ScrapeJob.PENDING, ScrapeJob.RUNNING])
+    for _ in range(2):
+        job = active.first()
+        if job is not None:
+            if job.priority < priority:
+                active.filter(priority__lt=priority).update(priority=priority)
+                job.priority = priority
+            return job, False
+        try:
+            with transaction.atomic():
+                job = ScrapeJob.objects.create(
+                    query=query, priority=priority, deep=deep, run_after=timezone.now())
+            logger.info("📥 Задание на %s парсинг '%s' поставлено в очередь",
+                        'полный' if deep else 'быстрый', query)
+            return job, True
+        except IntegrityError:
+            # Параллельный запрос успел поставить такое же задание
+            continue
+    return active.first(), False
+
+
+def requeue_stale(timeout=JOB_TIMEOUT_SECONDS):
+    """Возвращает в очередь задания, воркер которых пропал"""
+    count = ScrapeJob.objects.filter(
+        status=ScrapeJob.RUNNING,
+        locked_at__lt=timezone.now() - timedelta(seconds=timeout),
+    ).update(status=ScrapeJob.PENDING, locked_by='', locked_at=None)
+    if count:
+        logger.warning("⚠️ Возвращено в очередь брошенных заданий: %s", count)
+    return count
+
+
+def claim_job(worker_id, max_running=None):
+    """
+    Берёт самое приоритетное готовое задание
+
+    Args:
+        worker_id: Имя исполнителя (для диагностики)
+        max_running: Сколько заданий может выполняться сразу во всех воркерах.
+            Лимит проверяется в том же UPDATE, которым задание берется
+    Returns:
+        ScrapeJob или None, если очередь пуста или лимит занят
+    """
+    # Задания умерших воркеров иначе навсегда остаются RUNNING
+    requeue_stale()
+    now = timezone.now()
+    with transaction.atomic():
+        if max_running is not None:
+            _lock_claims()
+        # Блокируется только выбранная строка; задание, которое сейчас берет
+        # другой воркер, пропускается (в SQLite запись и так последовательна)
+        job_id = ScrapeJob.objects.select_for_update(skip_locked=True).filter(
+            status=ScrapeJob.PENDING, run_after__lte=now,
+        ).order_by('-priority', 'run_after', 'id').values_list('id', flat=True).first()
+        if job_id is None:
+            return None
+        claimable = ScrapeJob.objects.filter(id=job_id, status=ScrapeJob.PENDING)
+        if max_running is not None:
+            claimable = claimable.filter(_below_limit(max_running))
+        claimed = claimable.update(
+            status=ScrapeJob.RUNNING, locked_by=worker_id, locked_at=now,
+            attempts=F('attempts') + 1)
+    if not claimed:
+        # Лимит занят
+        return None
+    return ScrapeJob.objects.get(id=job_id)
+
+
+def _lock_claims():
+    """
+    PostgreSQL: UPDATE в READ COMMITTED считает выполняющиеся по своему
+    снимку - два воркера, взявшие разные задания, вместе превысили бы
+    max_running. Транзакционная advisory-блокировка выстраивает захваты
+    в очередь, не блокируя строки заданий
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [CLAIM_LOCK_ID])
+
+
+def _below_limit(max_running):
+    """Условие UPDATE: выполняющихся заданий меньше max_running"""
+    running = ScrapeJob.objects.filter(status=ScrapeJob.RUNNING).order_by().values(
+        'status').annotate(count=Count('id')).values('count')
+    return GreaterThan(Value(max_running),
+                       Coalesce(Subquery(running, output_field=IntegerField()), 0))
+
+
+def _owned(job):
+    """Задание, пока его держит взявший воркер (не возвращено и не перехвачено)"""
+    return ScrapeJob.objects.filter(
+        id=job.id, status=ScrapeJob.RUNNING, locked_by=job.locked_by, locked_at__isnull=False)
+
+
+def touch_job(job):
+    """Продлевает locked_at своего выполняющегося задания"""
+    return bool(_owned(job).update(locked_at=timezone.now()))
+
+
+def _heartbeat(job, stop, interval):
+    """Фоновый поток: продлевает задание, пока выполняется run_job"""
+    try:
+        while not stop.wait(interval):
+            if not touch_job(job):
+                logger.warning("⚠️ Задание #%s больше не наше - продление остановлено", job.id)
+                return
+    finally:
+        connection.close()
+
+
+def complete_job(job):
+    """
+    Returns:
+        False, если задание уже не наше (возвращено в очередь и взято заново)
+    """
+    done = bool(_owned(job).update(
+        status=ScrapeJob.DONE, finished_at=timezone.now(), last_error=''))
+    if not done:
+        logger.warning("⚠️ Задание #%s перехвачено другим воркером - не завершаем", job.id)
+    return done
+
+
+def fail_job(job, error):
+    """Повтор с экспоненциальной задержкой или окончательная ошибка"""
+    if job.attempts < job.max_attempts:
+        delay = RETRY_BASE_SECONDS * 2 ** (job.attempts - 1)
+        updated = _owned(job).update(
+            status=ScrapeJob.PENDING, locked_by='', locked_at=None, last_error=error,
+            run_after=timezone.now() + timedelta(seconds=delay))
+        if updated:
+            logger.warning("🔁 Парсинг '%s' упал (попытка %s/%s), повтор через %s с",
+                           job.query, job.attempts, job.max_attempts, delay)
+    else:
+        updated = _owned(job).update(
+            status=ScrapeJob.FAILED, finished_at=timezone.now(), last_error=error)
+        if updated:
+            logger.error("❌ Парсинг '%s' не удался после %s попыток",
+                         job.query, job.attempts)
+    if not updated:
+        logger.warning("⚠️ Задание #%s перехвачено другим воркером - ошибку не записываем", job.id)
+
+
+def run_job(job):
+    """Выполняет задание и отмечает результат"""
+    # catalog.views импортирует scraping - импортируем по требованию
+    from catalog.views import run_parser
+
+    logger.info("⚙️ Задание #%s: %s парсинг '%s' (попытка %s)", job.id,
+                'полный' if job.deep else 'быстрый', job.query, job.attempts)
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job, stop, JOB_HEARTBEAT_SECONDS),
+                                 name=f'job-{job.id}-heartbeat', daemon=True)
+    heartbeat.start()
+    try:
+        run_parser(job.query, quick=not job.deep)
+    except Exception as e:
+        fail_job(job, str(e))
+        return False
+    finally:
+        stop.set()
+        heartbeat.join()
+    if not complete_job(job):
+        return False
+    if not job.deep:
+        # Первые цены сохранены - остальное дособирает полный парсинг
+        enqueue_scrape(job.query, priority=ScrapeJob.PRIORITY_DEEP, deep=True)
+    return True
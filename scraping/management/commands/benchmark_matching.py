@@ -0,0 +1,68 @@
+import logging
+from django.core.management.base import BaseCommand
+from scraping.benchmark import make_catalogs, timed
+from scraping.scrapers import MATCHING_ENGINES
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк движков сопоставления товаров на синтетических каталогах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                            help='Размеры каталогов N (сравнивается N×N), по умолчанию: 1000 10000')
+        parser.add_argument('--threshold', type=int, default=75,
+                            help='Порог сходства (по умолчанию: 75)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--engine', default='indexed', choices=sorted(MATCHING_ENGINES),
+                            help='Движок, который сравнивается с legacy')
+        parser.add_argument('--legacy-max-pairs', type=int, default=1_000_000,
+                            help='До скольких пар legacy запускается полностью, '
+                                 'дальше время оценивается по выборке')
+        parser.add_argument('--legacy-sample', type=int, default=50,
+                            help='Сколько товаров Пятёрочки берётся для оценки legacy')
+
+    def handle(self, *args, **options):
+        # Построчные логи пар на больших каталогах только мешают замеру
+        logging.getLogger('scraping.scrapers').setLevel(logging.WARNING)
+        legacy = MATCHING_ENGINES['legacy']
+        engine = MATCHING_ENGINES[options['engine']]
+        threshold = options['threshold']
+
+        for size in options['sizes']:
+            pyat, magnit = make_catalogs(size, size, seed=options['seed'])
+            self.stdout.write(f"📦 Каталоги {size}×{size}, порог {threshold}")
+
+            result, engine_time = timed(engine, pyat, magnit, threshold)
+            self.stdout.write(
+                f"   ⚡ {options['engine']}: {engine_time:.2f} с, пар: {len(result[0])}")
+
+            if size * size <= options['legacy_max_pairs']:
+                expected, legacy_time = timed(legacy, pyat, magnit, threshold)
+                self.stdout.write(
+                    f"   🐢 legacy: {legacy_time:.2f} с, пар: {len(expected[0])}")
+                if _pairs_key(result) == _pairs_key(expected):
+                    self.stdout.write(self.style.SUCCESS("   ✅ Пары совпадают"))
+                else:
+                    common = _name_pairs(result) & _name_pairs(expected)
+                    self.stdout.write(self.style.WARNING(
+                        f"   ⚠️ Пары отличаются: общих {len(common)} "
+                        f"из {len(expected[0])} пар legacy"))
+            else:
+                sample = min(options['legacy_sample'], size)
+                _, sample_time = timed(legacy, pyat[:sample], magnit, threshold)
+                legacy_time = sample_time * size / sample
+                self.stdout.write(
+                    f"   🐢 legacy: ~{legacy_time:.0f} с (оценка по {sample} товарам)")
+
+            self.stdout.write(self.style.SUCCESS(
+                f"   🚀 Ускорение: ×{legacy_time / engine_time:.0f}"))
+
+
+def _name_pairs(result):
+    return {(p['pyat']['name'], p['magnit']['name']) for p in result[0]}
+
+
+def _pairs_key(result):
+    pairs, used_pyat, used_magnit = result
+    return ([(p['pyat']['name'], p['magnit']['name'], p['similarity']) for p in pairs],
+            used_pyat, used_magnit)
@@ -0,0 +1,84 @@
+import logging
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.models import Category
+from scraping.benchmark import make_catalogs, timed
+from scraping.drivers import DriverPool
+from scraping.replay import ReplayDriver, preload, write_fixtures
+from scraping.scrapers import (
+    DRIVER_POOL_SIZE, MagnitParser, PyaterochkaParser, save_results_to_db,
+    smart_product_search)
+
+STAGES = ('load', 'scroll', 'parse')
+
+
+class Command(BaseCommand):
+    help = ('Бенчмарк парсинга целиком (smart_product_search) на записанных страницах '
+            'магазинов, без сети: время этапов load/scroll/parse/match/save')
+
+    def add_arguments(self, parser):
+        parser.add_argument('query', nargs='?', default='молоко',
+                            help='Поисковый запрос (по умолчанию: молоко)')
+        parser.add_argument('--fixtures',
+                            help='Каталог записей страниц (см. scraping/replay.py); '
+                                 'без него записи генерируются из синтетических каталогов')
+        parser.add_argument('--size', type=int, default=300,
+                            help='Товаров каждого магазина в синтетических записях (по умолчанию: 300)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Задержка загрузки страницы и подгрузки после прокрутки, с')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Сколько раз повторить парсинг (по умолчанию: 3)')
+        parser.add_argument('--no-save', action='store_true',
+                            help='Не замерять сохранение в БД')
+
+    def handle(self, *args, **options):
+        # Построчные логи товаров только мешают замеру
+        logging.getLogger('scraping.scrapers').setLevel(logging.WARNING)
+        query = options['query']
+
+        with tempfile.TemporaryDirectory() as tmp:
+            root = options['fixtures']
+            if not root:
+                root = tmp
+                pyat, magnit = make_catalogs(options['size'], options['size'],
+                                             seed=options['seed'])
+                write_fixtures(root, query, pyat, magnit)
+                self.stdout.write(f"📦 Синтетические записи: {options['size']} товаров в магазине")
+            self.stdout.write(f"📄 Записей страниц: {preload(root)}")
+
+            for run in range(1, options['repeat'] + 1):
+                self._run(run, root, query, options)
+
+    def _run(self, run, root, query, options):
+        pool = DriverPool(lambda: ReplayDriver(root, latency=options['latency']),
+                          max_size=DRIVER_POOL_SIZE)
+        timings = {}
+        started = time.perf_counter()
+        try:
+            result = smart_product_search(query, pool=pool, timings=timings)
+        finally:
+            pool.close()
+        total = time.perf_counter() - started
+
+        self.stdout.write(f"🔁 Прогон {run}: пар {len(result['pairs'])}, "
+                          f"одиночных {len(result['pyat_single']) + len(result['magnit_single'])}")
+        for store in (PyaterochkaParser.STORE_NAME, MagnitParser.STORE_NAME):
+            stages = timings.get(store, {})
+            self.stdout.write(f"   {store}: " + ", ".join(
+                f"{stage} {stages.get(stage, 0):.3f} с" for stage in STAGES))
+        self.stdout.write(f"   match {timings.get('match', 0):.3f} с")
+
+        if not options['no_save']:
+            # Сохранение замеряется на настоящей БД, но откатывается
+            with transaction.atomic():
+                Category.objects.get_or_create(name=query.capitalize())
+                _, save_time = timed(save_results_to_db, result, query)
+                transaction.set_rollback(True)
+            self.stdout.write(f"   save {save_time:.3f} с")
+            total += save_time
+        self.stdout.write(self.style.SUCCESS(f"   ⏱ Всего {total:.3f} с"))
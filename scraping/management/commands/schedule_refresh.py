@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from scraping.scheduler import REFRESH_BUDGET_PER_HOUR, schedule_refresh
+
+
+class Command(BaseCommand):
+    help = 'Планировщик: заранее ставит в очередь обновление популярных устаревающих категорий'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget', type=int, default=REFRESH_BUDGET_PER_HOUR,
+                            help=f'Плановых парсингов в час (по умолчанию: {REFRESH_BUDGET_PER_HOUR})')
+        parser.add_argument('--interval', type=float, default=60.0,
+                            help='Пауза между проходами, с (по умолчанию: 60)')
+        parser.add_argument('--once', action='store_true',
+                            help='Один проход и выход (для cron)')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"🗓 Планировщик обновлений: бюджет {options['budget']} парсингов/ч")
+        try:
+            while True:
+                close_old_connections()
+                scheduled = schedule_refresh(options['budget'])
+                if scheduled:
+                    self.stdout.write(f"📥 В очередь: {', '.join(c.name for c in scheduled)}")
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("⏹ Остановка планировщика")
+        self.stdout.write(self.style.SUCCESS("✅ Планировщик остановлен"))
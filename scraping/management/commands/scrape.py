@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from scraping.scrapers import smart_product_search
+from scraping.scrapers import smart_product_search, driver_pool
 
 class Command(BaseCommand):
     help = 'Умный поиск и парсинг по запросу'
@@ -11,5 +11,9 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         query = options['query']
         self.stdout.write(f"🔍 Запуск умного поиска: '{query}'")
-        matches = smart_product_search(query)
+        try:
+            matches = smart_product_search(query)
+        finally:
+            # Браузеры из пула больше не понадобятся
+            driver_pool.close()
         self.stdout.write(self.style.SUCCESS(f'✅ Найдено {len(matches)} совпадений'))
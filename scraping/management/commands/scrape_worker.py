@@ -0,0 +1,67 @@
+import os
+import socket
+import threading
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from scraping.jobs import claim_job, run_job
+from scraping.scrapers import chromedriver_path, driver_pool
+
+
+class Command(BaseCommand):
+    help = 'Воркер очереди парсинга: выполняет задания ScrapeJob'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2,
+                            help='Сколько парсингов выполняется одновременно (по умолчанию: 2)')
+        parser.add_argument('--max-running', type=int, default=None,
+                            help='Общий лимит выполняющихся заданий во всех воркерах')
+        parser.add_argument('--poll', type=float, default=2.0,
+                            help='Пауза между проверками пустой очереди, с (по умолчанию: 2)')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить задания, готовые сейчас, и выйти')
+
+    def handle(self, *args, **options):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        stop = threading.Event()
+        self.stdout.write(f"👷 Воркер {worker_id}: потоков {options['concurrency']}")
+
+        # chromedriver ищется/скачивается до первого задания, а не внутри поиска пользователя
+        try:
+            chromedriver_path()
+        except Exception as e:
+            self.stderr.write(f"⚠️ chromedriver не найден заранее: {e}")
+
+        threads = [
+            threading.Thread(target=self._work, name=f'scrape-worker-{i}',
+                             args=(f"{worker_id}/{i}", stop, options))
+            for i in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.stdout.write("⏹ Остановка: дожидаемся текущих заданий...")
+            stop.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            driver_pool.close()
+        self.stdout.write(self.style.SUCCESS("✅ Воркер остановлен"))
+
+    def _work(self, worker_id, stop, options):
+        """Цикл одного потока: взять задание, выполнить, повторить"""
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                job = claim_job(worker_id, max_running=options['max_running'])
+                if job is None:
+                    if options['once']:
+                        return
+                    stop.wait(options['poll'])
+                    continue
+                run_job(job)
+        finally:
+            close_old_connections()
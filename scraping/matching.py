@@ -0,0 +1,352 @@
+"""
+Движки сопоставления товаров Пятёрочки и Магнита.
+
+Индексный движок (``find_pairs_indexed``) выдаёт те же пары, что и
+перебор ``fuzz.token_set_ratio`` в ``scrapers._find_pairs``, но не сравнивает
+каждый товар с каждым:
+
+* название нормализуется и разбивается на токены один раз;
+* по товарам Магнита строятся инвертированные индексы: для каждого токена и
+  каждого символа - битовая маска товаров, в которых он встречается;
+* для товара Пятёрочки сразу по всем товарам Магнита считается, сколько у них
+  общих токенов и символов, и отбираются только те, кто вообще может набрать
+  порог сходства;
+* кандидаты проверяются в порядке убывания верхней оценки сходства, точный
+  ``ratio`` считается только пока оценка может побить лучший результат.
+
+Верхние оценки строгие (совпавших символов не больше, чем общих символов),
+поэтому отсечение не теряет пар: результат совпадает с жадным алгоритмом при
+любом пороге.
+"""
+from collections import Counter, defaultdict
+import logging
+
+from fuzzywuzzy import fuzz, utils
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_name(name):
+    """
+    Нормализует название так же, как это делает сравнение в _find_pairs:
+    нижний регистр + обработка fuzzywuzzy (только буквы и цифры)
+    """
+    return utils.full_process(name.lower(), force_ascii=True)
+
+
+class NameProfile:
+    """Предрассчитанное представление названия товара"""
+    __slots__ = ('tokens', 'length', 'features')
+
+    def __init__(self, name):
+        processed = normalize_name(name or '')
+        self.tokens = frozenset(processed.split())
+        # token_set_ratio сравнивает строки из тех же токенов через пробел:
+        # у них такая же длина и такой же набор символов
+        joined = " ".join(self.tokens)
+        self.length = len(joined)
+        # Символы как множество чисел (код символа, номер вхождения):
+        # размер пересечения = число общих символов с учётом повторов
+        self.features = frozenset(
+            ord(char) << 16 | k for char, count in Counter(joined).items()
+            for k in range(count))
+
+
+def token_set_score(first, second):
+    """
+    fuzz.token_set_ratio для двух NameProfile без повторной обработки строк
+    """
+    if not first.tokens or not second.tokens:
+        return 0
+
+    intersection = first.tokens & second.tokens
+    sorted_sect = " ".join(sorted(intersection))
+    sorted_1to2 = " ".join(sorted(first.tokens - intersection))
+    sorted_2to1 = " ".join(sorted(second.tokens - intersection))
+
+    combined_1to2 = (sorted_sect + " " + sorted_1to2).strip()
+    combined_2to1 = (sorted_sect + " " + sorted_2to1).strip()
+
+    return max(
+        fuzz.ratio(sorted_sect, combined_1to2),
+        fuzz.ratio(sorted_sect, combined_2to1),
+        fuzz.ratio(combined_1to2, combined_2to1),
+    )
+
+
+def _ratio_bound(matches, length):
+    """fuzz.ratio при заданном числе совпавших символов (та же арифметика)"""
+    return utils.intr(100 * (2.0 * matches / length))
+
+
+def shared_tokens_bound(first, second):
+    """
+    Верхняя оценка сравнений общей части токенов с каждой из строк
+
+    ratio(a, b) = 2 * M / (len(a) + len(b)), где M - число совпавших символов.
+    Общая часть - префикс строки, поэтому M не больше её длины.
+    """
+    intersection = first.tokens & second.tokens
+    if not intersection:
+        return 0
+    sect_len = sum(map(len, intersection)) + len(intersection) - 1
+    return _ratio_bound(sect_len, sect_len + min(first.length, second.length))
+
+
+def common_chars_bound(first, second):
+    """
+    Верхняя оценка сравнения строк целиком: M не больше числа общих символов
+    """
+    if not first.tokens or not second.tokens:
+        return 0
+    common_chars = len(first.features & second.features)
+    return _ratio_bound(common_chars, first.length + second.length)
+
+
+def _bit_indices(bits):
+    """Номера установленных битов числа"""
+    reversed_bits = bin(bits)[:1:-1]
+    pos = reversed_bits.find('1')
+    while pos != -1:
+        yield pos
+        pos = reversed_bits.find('1', pos + 1)
+
+
+def _add_bits(counter, bits, value=1):
+    """
+    Прибавляет value ко всем позициям bits в побитово-разрезанном счётчике:
+    counter[i] - i-й разряд счётчиков сразу всех товаров
+    """
+    digit_idx = 0
+    while value:
+        if value & 1:
+            carry = bits
+            i = digit_idx
+            while carry:
+                while i >= len(counter):
+                    counter.append(0)
+                counter[i], carry = counter[i] ^ carry, counter[i] & carry
+                i += 1
+        value >>= 1
+        digit_idx += 1
+
+
+def _at_least(counter, value, universe):
+    """Биты позиций из universe, где значение счётчика >= value"""
+    greater = 0
+    equal = universe
+    for i in reversed(range(max(len(counter), value.bit_length()))):
+        digit = counter[i] if i < len(counter) else 0
+        if (value >> i) & 1:
+            equal &= digit
+        else:
+            greater |= equal & digit
+            equal &= ~digit
+    return greater | equal
+
+
+class CandidateIndex:
+    """
+    Инвертированный индекс по товарам Магнита
+
+    Для товара Пятёрочки отбирает товары Магнита, которые могут набрать
+    similarity_threshold хотя бы в одном из сравнений token_set_ratio:
+
+    * общая часть токенов против строки - нужна достаточная суммарная длина
+      общих токенов;
+    * строка против строки - нужно достаточно общих символов.
+
+    Оба количества считаются сразу для всех товаров побитовыми операциями над
+    масками из индекса.
+    """
+
+    def __init__(self, profiles, similarity_threshold):
+        self.profiles = profiles
+        # Пара засчитывается при score > 0 и score >= порога (не больше 100)
+        self.threshold = min(max(similarity_threshold, 1), 101)
+
+        self.token_bits = defaultdict(int)
+        self.char_bits = defaultdict(int)
+        self.length_bits = defaultdict(int)
+        for idx, profile in enumerate(profiles):
+            if not profile.tokens:
+                continue
+            bit = 1 << idx
+            for token in profile.tokens:
+                self.token_bits[token] |= bit
+            for feature in profile.features:
+                self.char_bits[feature] |= bit
+            self.length_bits[profile.length] |= bit
+
+        self.alive = (1 << len(profiles)) - 1
+        self._groups = {}
+
+    def _length_groups(self, length):
+        """
+        Пороги отбора для строки длины length по длинам товаров Магнита
+
+        intr(100 * r) >= порог требует r >= (порог - 0.5) / 100, в целых
+        числах с k = 2 * порог - 1:
+
+        * токены:  2 * S / (S + min(Lx, Ly)) => (400 - k) * S >= k * min(Lx, Ly),
+          где S = сумма длин общих токенов + пробелы между ними;
+        * символы: 2 * C / (Lx + Ly)         => 400 * C >= k * (Lx + Ly).
+
+        Returns:
+            ([(мин. вес общих токенов, биты товаров)],
+             [(мин. число общих символов, биты товаров)])
+        """
+        if length not in self._groups:
+            k = 2 * self.threshold - 1
+            token_groups = defaultdict(int)
+            char_groups = defaultdict(int)
+            for other_length, bits in self.length_bits.items():
+                shorter = min(length, other_length)
+                # Вес токена = длина + 1, поэтому вес общей части = S + 1
+                need_sect = -(-k * shorter // (400 - k))
+                if need_sect <= shorter:
+                    token_groups[need_sect + 1] |= bits
+                need_chars = -(-k * (length + other_length) // 400)
+                if need_chars <= shorter:
+                    char_groups[need_chars] |= bits
+            self._groups[length] = (sorted(token_groups.items()),
+                                    sorted(char_groups.items()))
+        return self._groups[length]
+
+    def remove(self, idx):
+        """Исключает товар Магнита из дальнейшего поиска (он уже в паре)"""
+        self.alive &= ~(1 << idx)
+
+    def _select(self, counter, groups):
+        selected = 0
+        for need, bits in groups:
+            selected |= _at_least(counter, need, bits & self.alive)
+        return set(_bit_indices(selected))
+
+    def candidates(self, profile):
+        """
+        Кандидаты для товара Пятёрочки, которые могут пройти порог
+
+        Returns:
+            (token_hits, char_hits) - индексы товаров Магнита, прошедших
+            отбор по общим токенам и по общим символам
+        """
+        if not profile.tokens:
+            return set(), set()
+        token_groups, char_groups = self._length_groups(profile.length)
+
+        shared_weight = []
+        for token in profile.tokens:
+            bits = self.token_bits.get(token, 0) & self.alive
+            if bits:
+                _add_bits(shared_weight, bits, len(token) + 1)
+
+        common_chars = []
+        for feature in profile.features:
+            bits = self.char_bits.get(feature, 0) & self.alive
+            if bits:
+                _add_bits(common_chars, bits)
+
+        return (self._select(shared_weight, token_groups),
+                self._select(common_chars, char_groups))
+
+
+def _bounded_candidates(index, pyat_profile, magnit_profiles):
+    """
+    Кандидаты из индекса с верхней оценкой сходства не ниже порога
+
+    Returns:
+        [(-оценка, magnit_idx)] по убыванию оценки
+    """
+    token_hits, char_hits = index.candidates(pyat_profile)
+    bounded = []
+    for magnit_idx in token_hits | char_hits:
+        magnit_profile = magnit_profiles[magnit_idx]
+        # Не прошедшим отбор сравнение по этому признаку порог не даст,
+        # поэтому для них достаточно второй оценки
+        bound = 0
+        if magnit_idx in token_hits:
+            bound = shared_tokens_bound(pyat_profile, magnit_profile)
+        if magnit_idx in char_hits:
+            bound = max(bound, common_chars_bound(
+                pyat_profile, magnit_profile))
+        if bound >= index.threshold:
+            bounded.append((-bound, magnit_idx))
+    bounded.sort()
+    return bounded
+
+
+def find_pairs_indexed(pyat_products, magnit_products, similarity_threshold):
+    """
+    Жадный поиск пар (как _find_pairs) с отбором кандидатов по индексу
+
+    Returns:
+        (pairs, used_pyat_indices, used_magnit_indices)
+    """
+    pyat_profiles = [NameProfile(p['name']) for p in pyat_products]
+    magnit_profiles = [NameProfile(p['name']) for p in magnit_products]
+    index = CandidateIndex(magnit_profiles, similarity_threshold)
+
+    pairs = []
+    used_pyat_indices = set()
+    used_magnit_indices = set()
+    scored = 0
+
+    for pyat_idx, pyat_profile in enumerate(pyat_profiles):
+        bounded = _bounded_candidates(index, pyat_profile, magnit_profiles)
+
+        # Как в _find_pairs: максимум сходства, при равенстве - первый индекс
+        best_similarity = 0
+        best_magnit_idx = -1
+        for neg_bound, magnit_idx in bounded:
+            if -neg_bound < best_similarity:
+                break
+            if -neg_bound == best_similarity and magnit_idx > best_magnit_idx:
+                break
+            similarity = token_set_score(
+                pyat_profile, magnit_profiles[magnit_idx])
+            scored += 1
+            if similarity < index.threshold:
+                continue
+            if similarity > best_similarity or (
+                    similarity == best_similarity and magnit_idx < best_magnit_idx):
+                best_similarity = similarity
+                best_magnit_idx = magnit_idx
+
+        if best_magnit_idx >= 0:
+            pyat_prod = pyat_products[pyat_idx]
+            best_match = magnit_products[best_magnit_idx]
+            pairs.append({
+                'similarity': best_similarity,
+                'pyat': pyat_prod,
+                'price_pyat': pyat_prod['price'],
+                'magnit': best_match,
+                'price_mag': best_match['price'],
+            })
+            used_pyat_indices.add(pyat_idx)
+            used_magnit_indices.add(best_magnit_idx)
+            index.remove(best_magnit_idx)
+
+    logger.debug("Индекс: точных сравнений %s из %s возможных",
+                 scored, len(pyat_products) * len(magnit_products))
+    return pairs, used_pyat_indices, used_magnit_indices
+
+
+def similarity_edges_indexed(pyat_products, magnit_products, similarity_threshold):
+    """
+    Все пары с token_set_ratio не ниже порога (для оптимального назначения)
+
+    Returns:
+        [(pyat_idx, magnit_idx, similarity)]
+    """
+    pyat_profiles = [NameProfile(p['name']) for p in pyat_products]
+    magnit_profiles = [NameProfile(p['name']) for p in magnit_products]
+    index = CandidateIndex(magnit_profiles, similarity_threshold)
+
+    edges = []
+    for pyat_idx, pyat_profile in enumerate(pyat_profiles):
+        for _, magnit_idx in _bounded_candidates(index, pyat_profile, magnit_profiles):
+            similarity = token_set_score(pyat_profile, magnit_profiles[magnit_idx])
+            if similarity >= index.threshold:
+                edges.append((pyat_idx, magnit_idx, similarity))
+    return edges
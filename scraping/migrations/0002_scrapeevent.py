@@ -0,0 +1,47 @@
+# Generated by Django 6.0 on 2026-10-17 00:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scraping", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ScrapeEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("query", models.CharField(max_length=100, verbose_name="Запрос")),
+                ("kind", models.CharField(max_length=10, verbose_name="Тип")),
+                (
+                    "store",
+                    models.CharField(
+                        blank=True, default="", max_length=20, verbose_name="Магазин"
+                    ),
+                ),
+                ("data", models.JSONField(default=dict, verbose_name="Данные")),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Создано"),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["query", "id"], name="scrapeevent_query_idx"
+                    )
+                ],
+            },
+        ),
+    ]
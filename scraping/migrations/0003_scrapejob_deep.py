@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-17 01:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scraping", "0002_scrapeevent"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="scrapejob",
+            name="scrapejob_one_active_per_query",
+        ),
+        migrations.AddField(
+            model_name="scrapejob",
+            name="deep",
+            field=models.BooleanField(
+                default=True,
+                help_text="Нет - быстрый этап: только первый экран/страница магазинов",
+                verbose_name="Полный парсинг",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="scrapejob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status__in", ["pending", "running"])),
+                fields=("query", "deep"),
+                name="scrapejob_one_active_per_query",
+            ),
+        ),
+    ]
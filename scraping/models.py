@@ -0,0 +1,95 @@
+from django.db import models
+from django.db.models import Q
+
+
+class ScrapeJob(models.Model):
+    """
+    Задание на парсинг категории в очереди (выполняется manage.py scrape_worker)
+
+    Поиск пользователя парсится в два этапа: быстрый (deep=False) собирает
+    первый экран/страницу магазинов и сразу сохраняет, а после него в
+    очередь ставится полный парсинг (deep=True), который дособирает
+    остальное. На один нормализованный запрос в очереди не больше одного
+    активного (ожидающего или выполняющегося) задания каждого этапа.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Ожидает'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнено'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    # Поиск пользователя важнее планового обновления; полный парсинг после
+    # быстрого этапа - после чужих поисков, но раньше планового обновления
+    PRIORITY_USER = 10
+    PRIORITY_DEEP = 5
+    PRIORITY_REFRESH = 0
+
+    query = models.CharField("Запрос", max_length=100, db_index=True)
+    status = models.CharField("Статус", max_length=10,
+                              choices=STATUS_CHOICES, default=PENDING)
+    priority = models.IntegerField("Приоритет", default=PRIORITY_USER)
+    deep = models.BooleanField(
+        "Полный парсинг", default=True,
+        help_text="Нет - быстрый этап: только первый экран/страница магазинов")
+    attempts = models.PositiveIntegerField("Попыток", default=0)
+    max_attempts = models.PositiveIntegerField("Максимум попыток", default=3)
+    run_after = models.DateTimeField(
+        "Не раньше", help_text="Время, раньше которого задание не берётся (повтор с задержкой)")
+    locked_by = models.CharField("Исполнитель", max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField("Взято в работу", null=True, blank=True)
+    last_error = models.TextField("Последняя ошибка", blank=True, default='')
+    finished_at = models.DateTimeField("Завершено", null=True, blank=True)
+
+    created_at = models.DateTimeField("Создано", auto_now_add=True)
+    updated_at = models.DateTimeField("Обновлено", auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['query', 'deep'],
+                condition=Q(status__in=['pending', 'running']),
+                name='scrapejob_one_active_per_query',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_after'],
+                         name='scrapejob_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.query} ({self.status})"
+
+
+class ScrapeEvent(models.Model):
+    """
+    Событие хода парсинга - читается потоком SSE страницы поиска
+
+    Парсинг идет в процессе воркера, поэтому события передаются через БД.
+    Хранятся только события последнего парсинга запроса.
+    """
+    START = 'start'
+    PRODUCTS = 'products'
+    PAIRS = 'pairs'
+    DONE = 'done'
+    ERROR = 'error'
+    # После этих событий поток закрывается
+    FINAL = (DONE, ERROR)
+
+    query = models.CharField("Запрос", max_length=100)
+    kind = models.CharField("Тип", max_length=10)
+    store = models.CharField("Магазин", max_length=20, blank=True, default='')
+    data = models.JSONField("Данные", default=dict)
+    created_at = models.DateTimeField("Создано", auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['query', 'id'], name='scrapeevent_query_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.query}: {self.kind}"
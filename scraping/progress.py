@@ -0,0 +1,81 @@
+"""
+Ход парсинга для потока частичных результатов (SSE).
+
+Парсеры по мере сбора отдают новые товары в ScrapeProgress, а он пишет их
+событиями ScrapeEvent: страница поиска видит первые товары магазина через
+секунды, а не после сохранения всего результата.
+"""
+import logging
+
+from scraping.models import ScrapeEvent
+
+logger = logging.getLogger(__name__)
+
+# Сколько событий отдается потоку за одно чтение
+EVENTS_BATCH = 100
+
+
+def _product_json(product):
+    return {'name': product['name'], 'price': str(product['price'])}
+
+
+class ScrapeProgress:
+    """Публикует события парсинга одного запроса"""
+
+    def __init__(self, query):
+        self.query = query
+
+    def publish(self, kind, data=None, store=''):
+        try:
+            ScrapeEvent.objects.create(
+                query=self.query, kind=kind, store=store, data=data or {})
+        except Exception as e:
+            # Поток на странице - не повод ронять парсинг
+            logger.warning("⚠️ Событие парсинга '%s' не записано: %s", self.query, str(e))
+
+    def start(self):
+        """Новый парсинг: события прошлого больше не нужны"""
+        ScrapeEvent.objects.filter(query=self.query).delete()
+        self.publish(ScrapeEvent.START)
+
+    def products(self, store, products):
+        """Новые товары магазина (вызывается из потока парсера)"""
+        if products:
+            self.publish(ScrapeEvent.PRODUCTS,
+                         {'products': [_product_json(p) for p in products]}, store)
+
+    def pairs(self, result):
+        """Итог сопоставления smart_compare_products"""
+        self.publish(ScrapeEvent.PAIRS, {
+            'pairs': [{
+                'name_pyat': pair['pyat']['name'],
+                'price_pyat': str(pair['price_pyat']),
+                'name_mag': pair['magnit']['name'],
+                'price_mag': str(pair['price_mag']),
+                'similarity': pair['similarity'],
+            } for pair in result.get('pairs', [])],
+            'pyat_single': len(result.get('pyat_single', [])),
+            'magnit_single': len(result.get('magnit_single', [])),
+        })
+
+    def done(self, stats):
+        self.publish(ScrapeEvent.DONE, stats)
+
+    def error(self, message):
+        self.publish(ScrapeEvent.ERROR, {'message': message})
+
+
+def events_after(query, after_id=None, limit=EVENTS_BATCH):
+    """
+    События парсинга запроса после after_id
+
+    Без after_id поток начинается с последнего старта парсинга.
+    """
+    events = ScrapeEvent.objects.filter(query=query)
+    if after_id is None:
+        start = events.filter(kind=ScrapeEvent.START).order_by('-id').values_list(
+            'id', flat=True).first()
+        if start is None:
+            return []
+        after_id = start - 1
+    return list(events.filter(id__gt=after_id).order_by('id')[:limit])
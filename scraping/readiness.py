@@ -0,0 +1,88 @@
+"""
+Ожидание готовности страницы вместо фиксированных time.sleep.
+
+Страница считается готовой, когда она "затихла": DOM разобран (readyState
+interactive или complete - при стратегии загрузки eager onload не ждём), DOM не
+меняется (MutationObserver) и не приходят новые ответы сети (Performance
+Resource Timing) в течение idle секунд. Все ожидания ограничены timeout -
+если страница так и не затихла, парсинг продолжается с тем, что есть.
+"""
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# document.readyState, после которого можно ждать тишины: картинки и iframe,
+# которых ждёт complete, парсерам не нужны
+READY_STATES = ('interactive', 'complete')
+
+# Ставит MutationObserver (один раз на документ) и возвращает состояние
+# страницы; время - performance.now() браузера в миллисекундах
+PROBE_SCRIPT = """
+if (!window.__readinessProbe) {
+    var probe = window.__readinessProbe = {lastMutation: performance.now()};
+    new MutationObserver(function () { probe.lastMutation = performance.now(); })
+        .observe(document, {childList: true, subtree: true, attributes: true,
+                            characterData: true});
+}
+var lastResponse = 0;
+performance.getEntriesByType('resource').forEach(function (entry) {
+    lastResponse = Math.max(lastResponse, entry.responseEnd);
+});
+return {
+    state: document.readyState,
+    now: performance.now(),
+    last_activity: Math.max(window.__readinessProbe.lastMutation, lastResponse),
+    count: arguments[0] ? document.querySelectorAll(arguments[0]).length : 0
+};
+"""
+
+
+def page_state(driver, selector=None):
+    """
+    Состояние страницы
+
+    Returns:
+        {'state', 'now', 'last_activity', 'count'} - count: число элементов
+        по CSS-селектору selector
+    """
+    return driver.execute_script(PROBE_SCRIPT, selector)
+
+
+def wait_for_idle(driver, selector=None, idle=0.5, timeout=10, since=None, poll=0.1):
+    """
+    Ждёт, пока страница затихнет на idle секунд (но не дольше timeout)
+
+    Args:
+        selector: CSS-селектор, число элементов по которому вернуть
+        since: Момент (now из page_state), раньше которого тишина не
+            засчитывается - например, момент прокрутки, после которой
+            страница ещё не успела начать подгрузку
+    Returns:
+        Последнее состояние страницы (см. page_state)
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        state = page_state(driver, selector)
+        last_activity = max(state['last_activity'], since or 0)
+        if state['state'] in READY_STATES and state['now'] - last_activity >= idle * 1000:
+            return state
+        if time.monotonic() >= deadline:
+            logger.debug("⏱ Страница не затихла за %s с", timeout)
+            return state
+        time.sleep(poll)
+
+
+def wait_for_count(driver, selector, minimum=1, timeout=10, poll=0.1):
+    """
+    Ждёт, пока элементов по selector станет не меньше minimum
+
+    Returns:
+        Число найденных элементов (меньше minimum, если не дождались)
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        count = page_state(driver, selector)['count']
+        if count >= minimum or time.monotonic() >= deadline:
+            return count
+        time.sleep(poll)
@@ -0,0 +1,234 @@
+"""
+Драйвер-запись: отдает парсерам сохраненные страницы магазинов вместо Chrome.
+
+Нужен, чтобы гонять парсинг целиком (smart_product_search) без сети -
+для бенчмарка (manage.py benchmark_scraping) и регрессионных тестов.
+
+Записи лежат в каталоге:
+
+    <каталог>/pyaterochka/<запрос>/000.html, 001.html, ...
+        страница поиска после 0, 1, ... прокруток (каждая следующая
+        содержит больше карточек);
+    <каталог>/magnit/<запрос>/001.html, 002.html, ...
+        страницы результатов 1, 2, ... (с блоком пагинации, по которому
+        парсер узнаёт число страниц); страницы после последней - пустые.
+
+Запись - это driver.page_source настоящего браузера (или синтетическая
+страница из write_fixtures). Из скриптов страницы драйвер понимает те, что
+используют парсеры: PROBE_SCRIPT (готовность), HARVEST_SCRIPT (новые
+карточки) и прокрутку. Время страницы виртуальное - ожидания готовности
+выполняются сразу; задержку сети можно изобразить параметром latency.
+"""
+from html import escape
+from pathlib import Path
+from urllib.parse import parse_qs, quote, urlsplit
+import logging
+import threading
+import time
+
+from bs4 import BeautifulSoup
+
+from scraping.readiness import PROBE_SCRIPT
+from scraping.scrapers import HARVEST_SCRIPT
+
+logger = logging.getLogger(__name__)
+
+# Магазин записи по адресу страницы: часть домена -> (каталог, параметр запроса)
+STORES = {
+    '5ka.ru': ('pyaterochka', 'text'),
+    'magnit.ru': ('magnit', 'term'),
+}
+EMPTY_PAGE = "<html><head></head><body></body></html>"
+# На сколько продвигается время страницы (мс) за каждый опрос готовности
+PROBE_STEP_MS = 60_000
+
+# Разобранные записи общие для всех драйверов: файл -> (html, soup)
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def fixture_dir(root, store, query):
+    """Каталог записей магазина для запроса"""
+    return Path(root) / store / query.strip().lower()
+
+
+def _snapshot(path):
+    with _snapshots_lock:
+        if path not in _snapshots:
+            html = path.read_text(encoding='utf-8') if path.exists() else EMPTY_PAGE
+            _snapshots[path] = (html, BeautifulSoup(html, 'html.parser'))
+        return _snapshots[path]
+
+
+def preload(root):
+    """
+    Разбирает все записи каталога заранее
+
+    Разбор записи - работа "браузера", а не парсера: без предзагрузки она
+    попадает в этапы load/scroll первого прогона бенчмарка.
+    """
+    paths = sorted(Path(root).glob('*/*/*.html'))
+    for path in paths:
+        _snapshot(path)
+    return len(paths)
+
+
+def _text(elem):
+    """Текст элемента как text() в HARVEST_SCRIPT: непустые строки без пробелов по краям"""
+    return ''.join(elem.stripped_strings)
+
+
+class ReplayDriver:
+    """Минимальная замена selenium WebDriver для PyaterochkaParser и MagnitParser"""
+
+    def __init__(self, root, latency=0.0):
+        """
+        Args:
+            root: Каталог с записями страниц
+            latency: Сколько секунд "грузится" страница и подгрузка после прокрутки
+        """
+        self.root = Path(root)
+        self.latency = latency
+        self.current_url = 'about:blank'
+        # Все открытые адреса по порядку
+        self.history = []
+        # Записи текущей страницы: одна (Магнит) или по одной на прокрутку (Пятёрочка)
+        self._pages = [self.root / 'about:blank']
+        self._index = 0
+        self._harvested = set()
+        self._clock = 0
+        self._changed_at = 0
+
+    @property
+    def page_source(self):
+        return _snapshot(self._pages[self._index])[0]
+
+    @property
+    def _soup(self):
+        return _snapshot(self._pages[self._index])[1]
+
+    def get(self, url):
+        """Открывает запись страницы по адресу поиска магазина"""
+        self.current_url = url
+        self.history.append(url)
+        parts = urlsplit(url)
+        params = parse_qs(parts.query)
+        self._pages = [self.root / 'about:blank']
+        self._index = 0
+        self._harvested = set()
+        for domain, (store, param) in STORES.items():
+            if not parts.netloc.endswith(domain):
+                continue
+            directory = fixture_dir(self.root, store, params.get(param, [''])[0])
+            if not directory.is_dir():
+                logger.warning("⚠️ Нет записей страниц %s в %s", url, directory)
+            elif store == 'magnit':
+                # Страница после последней - пустая, как у магазина
+                page = int(params.get('page', ['1'])[0])
+                self._pages = [directory / f"{page:03d}.html"]
+            else:
+                self._pages = sorted(directory.glob('*.html')) or self._pages
+        _snapshot(self._pages[0])
+        self._changed()
+
+    def execute_script(self, script, *args):
+        if script == PROBE_SCRIPT:
+            self._clock += PROBE_STEP_MS
+            selector = args[0] if args else None
+            return {
+                'state': 'complete',
+                'now': self._clock,
+                'last_activity': self._changed_at,
+                'count': len(self._soup.select(selector)) if selector else 0,
+            }
+        if script == HARVEST_SCRIPT:
+            return self._harvest(args[0])
+        if script.startswith('window.scrollTo'):
+            if self._index + 1 < len(self._pages):
+                self._index += 1
+                _snapshot(self._pages[self._index])
+                self._changed()
+            return None
+        return None
+
+    def _harvest(self, selector):
+        """Новые карточки в формате HARVEST_SCRIPT"""
+        cards = []
+        for card in self._soup.select(selector):
+            link = card.find('a', href=True)
+            key = link['href'] if link else f"{card.get('data-qa')}|{_text(card)}"
+            if key in self._harvested:
+                continue
+            self._harvested.add(key)
+            cards.append({
+                'key': key,
+                'names': [_text(p) for p in card.find_all('p')],
+                'prices': [_text(span) for span in card.find_all('span')],
+            })
+        return cards
+
+    def _changed(self):
+        """Страница изменилась: загрузка или подгрузка после прокрутки"""
+        if self.latency:
+            time.sleep(self.latency)
+        self._changed_at = self._clock
+
+    def quit(self):
+        self._pages = [self.root / 'about:blank']
+        self._index = 0
+
+
+def _pyaterochka_card(index, product):
+    rubles, kopecks = f"{product['price']:.2f}".split('.')
+    return (
+        f'<div data-qa="product-card-{index}"><a href="/product/item--{100000 + index}/">'
+        f'<p>4.8</p><p>{escape(product["name"])}</p></a>'
+        f'<div><span>{rubles}</span><span>{kopecks}</span></div></div>'
+    )
+
+
+def _magnit_card(index, product):
+    price = f"{product['price']:.2f}".replace('.', ',')
+    return (
+        f'<article data-test-id="v-product-preview"><a href="/product/{2000000 + index}-item">'
+        f'<div class="unit-catalog-product-preview-title">{escape(product["name"])}</div>'
+        f'<span class="unit-catalog-product-preview-prices__regular">{price} ₽</span>'
+        f'</a></article>'
+    )
+
+
+def _pagination(query, pages):
+    links = ''.join(f'<a href="/search?term={quote(query)}&amp;page={page}">{page}</a>'
+                    for page in range(1, pages + 1))
+    return f'<nav class="pagination">{links}</nav>'
+
+
+def _page(cards, footer=''):
+    return (f"<html><head><title>Поиск</title></head>"
+            f"<body><main>{''.join(cards)}</main>{footer}</body></html>")
+
+
+def write_fixtures(root, query, pyat_products, magnit_products,
+                   cards_per_scroll=20, cards_per_page=30, pagination=True):
+    """
+    Синтетические записи страниц из списков товаров (см. benchmark.make_catalogs)
+
+    Пятёрочка: каждая прокрутка добавляет cards_per_scroll карточек.
+    Магнит: по cards_per_page карточек на страницу, с пагинацией
+    (pagination=False - без неё, число страниц парсер не знает).
+    """
+    pyat_dir = fixture_dir(root, 'pyaterochka', query)
+    pyat_dir.mkdir(parents=True, exist_ok=True)
+    cards = [_pyaterochka_card(i, product) for i, product in enumerate(pyat_products)]
+    for step, end in enumerate(range(cards_per_scroll, len(cards) + cards_per_scroll,
+                                     cards_per_scroll)):
+        (pyat_dir / f"{step:03d}.html").write_text(_page(cards[:end]), encoding='utf-8')
+
+    magnit_dir = fixture_dir(root, 'magnit', query)
+    magnit_dir.mkdir(parents=True, exist_ok=True)
+    cards = [_magnit_card(i, product) for i, product in enumerate(magnit_products)]
+    starts = range(0, len(cards), cards_per_page)
+    footer = _pagination(query, len(starts)) if pagination else ''
+    for page, start in enumerate(starts, start=1):
+        (magnit_dir / f"{page:03d}.html").write_text(
+            _page(cards[start:start + cards_per_page], footer), encoding='utf-8')
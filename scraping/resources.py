@@ -0,0 +1,85 @@
+"""
+Облегченный профиль Chrome: блокировка ненужных парсерам ресурсов.
+
+Парсеры читают только текст карточек товаров, а страницы магазинов тянут
+картинки, видео, шрифты, счётчики и рекламу. Всё это блокируется:
+
+- правилами Chrome (prefs profile.managed_default_content_settings) -
+  картинки, камера и микрофон, уведомления, геолокация, всплывающие окна.
+  Правила задаются при запуске браузера и общие для всех магазинов, которые
+  на нём парсятся;
+- списком адресов CDP Network.setBlockedURLs - ставится заново каждый раз,
+  когда драйвер из пула достаётся парсеру, поэтому у каждого магазина свой.
+
+Парсер может вернуть себе нужные ресурсы: BaseParser.ALLOWED_RESOURCES -
+набор категорий из RESOURCE_PATTERNS (например, {'image'}).
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Категории ресурсов -> шаблоны адресов для Network.setBlockedURLs ('*' - любые символы)
+RESOURCE_PATTERNS = {
+    'image': ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico'],
+    'media': ['*.mp4', '*.webm', '*.m3u8', '*.mp3', '*.ogg'],
+    'font': ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot'],
+    'tracker': [
+        '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+        '*mc.yandex.ru*', '*an.yandex.ru*', '*yandex.ru/ads*', '*top-fwz1.mail.ru*',
+        '*vk.com/rtrg*', '*facebook.net*', '*criteo.*', '*mindbox.ru*', '*flocktory.com*',
+        '*adriver.ru*', '*sentry.io*', '*hotjar.com*',
+    ],
+}
+
+# Правила Chrome для категорий (2 - запретить)
+CONTENT_SETTINGS = {
+    'image': ['images'],
+}
+# Не нужны ни одному парсеру - запрещаются всегда
+ALWAYS_BLOCKED_SETTINGS = ['notifications', 'geolocation', 'popups', 'media_stream']
+
+# Стратегия загрузки страниц: driver.get возвращается после DOMContentLoaded,
+# не дожидаясь картинок и iframe - готовность проверяет scraping.readiness
+PAGE_LOAD_STRATEGY = 'eager'
+
+
+def blocked_patterns(allowed=()):
+    """Шаблоны адресов всех категорий, кроме allowed"""
+    return [pattern for category, patterns in RESOURCE_PATTERNS.items()
+            if category not in allowed for pattern in patterns]
+
+
+def lean_prefs(allowed=()):
+    """
+    prefs профиля Chrome (options.add_experimental_option('prefs', ...))
+
+    Args:
+        allowed: Категории, которые нужны хотя бы одному магазину на этом
+            браузере - их правила не запрещаются
+    """
+    settings = list(ALWAYS_BLOCKED_SETTINGS)
+    for category, names in CONTENT_SETTINGS.items():
+        if category not in allowed:
+            settings.extend(names)
+    return {f'profile.managed_default_content_settings.{name}': 2 for name in settings}
+
+
+def block_resources(driver, allowed=()):
+    """
+    Блокирует в браузере драйвера все категории ресурсов, кроме allowed
+
+    Работает только для Chrome (CDP); для других драйверов ничего не делает.
+
+    Returns:
+        True, если блокировка включена
+    """
+    execute_cdp_cmd = getattr(driver, 'execute_cdp_cmd', None)
+    if execute_cdp_cmd is None:
+        return False
+    try:
+        execute_cdp_cmd('Network.enable', {})
+        execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked_patterns(allowed)})
+        return True
+    except Exception as e:
+        logger.warning("⚠️ Не удалось включить блокировку ресурсов: %s", str(e))
+        return False
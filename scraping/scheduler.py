@@ -0,0 +1,91 @@
+"""
+Плановое обновление популярных категорий до истечения срока свежести.
+
+Без планировщика категория обновляется только когда ее ищут, и первый
+пользователь после истечения срока видит устаревшие данные. Планировщик
+(manage.py schedule_refresh) заранее ставит в очередь обновление категорий,
+которые скоро устареют, начиная с самых востребованных:
+
+    вес = log(1 + поисков) * (1 + изменчивость цен) * доля прошедшего срока
+
+Число плановых парсингов в час ограничено бюджетом - он делится между всеми
+категориями, а поиск пользователя (PRIORITY_USER) в бюджет не входит.
+"""
+from datetime import timedelta
+import logging
+import math
+
+from django.db.models import F
+from django.utils import timezone
+
+from catalog.models import Category
+from scraping.jobs import enqueue_scrape
+from scraping.models import ScrapeJob
+
+logger = logging.getLogger(__name__)
+
+# Плановых парсингов в час на все категории
+REFRESH_BUDGET_PER_HOUR = 20
+# С какой доли срока свежести категорию уже можно обновлять
+REFRESH_AHEAD = 0.8
+# Категории, которые не искали дольше этого, обновляются только по запросу
+HOT_DAYS = 7
+
+
+def refresh_weight(category):
+    """Вес категории в очереди обновления (0 - обновлять рано)"""
+    staleness = category.staleness
+    if staleness < REFRESH_AHEAD:
+        return 0
+    staleness = min(staleness, 10)
+    return math.log1p(category.search_count) * (1 + category.volatility) * staleness
+
+
+def refresh_candidates(now=None):
+    """Популярные категории, которые скоро устареют - по убыванию веса"""
+    now = now or timezone.now()
+    categories = Category.objects.filter(
+        search_count__gt=0,
+        last_searched_at__gte=now - timedelta(days=HOT_DAYS),
+        last_parsed_at__isnull=False,
+    ).order_by(F('last_parsed_at').asc())
+    weighted = [(refresh_weight(category), category) for category in categories
+                if not category.is_parsing]
+    weighted = [(weight, category) for weight, category in weighted if weight > 0]
+    weighted.sort(key=lambda item: item[0], reverse=True)
+    return [category for _, category in weighted]
+
+
+def used_budget(now=None):
+    """Сколько плановых обновлений поставлено за последний час"""
+    now = now or timezone.now()
+    return ScrapeJob.objects.filter(
+        priority=ScrapeJob.PRIORITY_REFRESH,
+        created_at__gte=now - timedelta(hours=1),
+    ).count()
+
+
+def schedule_refresh(budget_per_hour=REFRESH_BUDGET_PER_HOUR, now=None):
+    """
+    Ставит в очередь обновление самых важных устаревающих категорий
+
+    Returns:
+        Список категорий, для которых создано задание
+    """
+    now = now or timezone.now()
+    left = budget_per_hour - used_budget(now)
+    if left <= 0:
+        logger.info("⏸ Бюджет обновлений на час исчерпан (%s)", budget_per_hour)
+        return []
+
+    scheduled = []
+    for category in refresh_candidates(now):
+        if len(scheduled) >= left:
+            break
+        _, created = enqueue_scrape(category.name, priority=ScrapeJob.PRIORITY_REFRESH)
+        if created:
+            scheduled.append(category)
+            logger.info("🗓 Плановое обновление '%s': прошло %.0f%% срока (%.1f ч), поисков %s",
+                        category.name, category.staleness * 100, category.ttl_hours,
+                        category.search_count)
+    return scheduled
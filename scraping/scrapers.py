@@ -1,21 +1,35 @@
 from abc import ABC, abstractmethod
-from bs4 import BeautifulSoup
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
 from selenium import webdriver
-from selenium.webdriver.common.by import By
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Q
 from django.utils import timezone
-from urllib.parse import quote
+from urllib.parse import quote, urlsplit
 from fuzzywuzzy import fuzz
 from decimal import Decimal
+import atexit
+import functools
+import queue
 import re
 import sys
+import threading
 import time
 import logging
-from catalog.models import Product, Category
+from catalog import history as price_history
+from catalog.identity import identity_key
+from catalog.models import (
+    CartItem, Category, Offer, PriceObservation, Product, Store, normalize_name)
+from scraping.drivers import DriverPool
+from scraping.extraction import parse_cards
+from scraping.readiness import page_state, wait_for_count, wait_for_idle
+from scraping.resources import PAGE_LOAD_STRATEGY, block_resources, lean_prefs
+from scraping.matching import find_pairs_indexed, similarity_edges_indexed
 
 logger = logging.getLogger(__name__)
 handler = logging.StreamHandler(sys.stdout)
@@ -26,10 +40,31 @@ logger.addHandler(handler)
 logger.setLevel(logging.DEBUG)
 
 
-def get_driver():
-    """Настройка драйвера Chrome"""
+@functools.lru_cache(maxsize=None)
+def chromedriver_path():
+    """Путь к chromedriver: скачивается/ищется один раз на процесс"""
+    path = ChromeDriverManager().install()
+    logger.info("🔧 chromedriver: %s", path)
+    return path
+
+
+def get_driver(lean=None):
+    """
+    Настройка драйвера Chrome
+
+    Args:
+        lean: Облегченный профиль (см. scraping.resources); по умолчанию LEAN_PROFILE
+    """
     logger.debug("🔧 Инициализация Chrome драйвера...")
     options = Options()
+    if lean is None:
+        lean = LEAN_PROFILE
+    if lean:
+        # Браузер из пула достаётся любому магазину: правилами профиля
+        # запрещается только то, что не нужно ни одному из них
+        allowed = PyaterochkaParser.ALLOWED_RESOURCES | MagnitParser.ALLOWED_RESOURCES
+        options.add_experimental_option('prefs', lean_prefs(allowed))
+        options.page_load_strategy = PAGE_LOAD_STRATEGY
     options.add_argument("--headless=new")
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
@@ -40,45 +75,239 @@ def get_driver():
     options.add_argument(
         "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
 
-    service = Service(ChromeDriverManager().install())
+    service = Service(chromedriver_path())
     driver = webdriver.Chrome(service=service, options=options)
     logger.info("✅ Chrome драйвер инициализирован")
     return driver
 
 
-def smart_product_search(query):
-    """Основная функция поиска"""
+# Облегченный профиль браузера: без картинок, медиа, шрифтов и счётчиков
+# (магазин возвращает себе нужное через ALLOWED_RESOURCES парсера)
+LEAN_PROFILE = True
+
+# Сколько строк пишется в БД одним запросом при сохранении результатов
+BULK_BATCH_SIZE = 500
+
+# Поля товара, которые обновляет сохранение парсинга
+PRODUCT_UPSERT_FIELDS = ['name_pyat', 'price_pyat', 'name_mag', 'price_mag', 'similarity']
+
+# Артикул товара в ссылке карточки - самое длинное число пути (от 5 цифр)
+SKU_RE = re.compile(r'\d{5,}')
+
+# Общий на процесс пул драйверов: следующий поиск берёт уже запущенный браузер.
+# Один поиск занимает два драйвера (по одному на магазин), Магнит догружает
+# страницы на свободных драйверах пула, если они есть
+DRIVER_POOL_SIZE = 4
+DRIVER_MAX_IDLE_SECONDS = 300
+DRIVER_MAX_PAGES = 50
+
+driver_pool = DriverPool(get_driver, max_size=DRIVER_POOL_SIZE,
+                         max_idle=DRIVER_MAX_IDLE_SECONDS, max_pages=DRIVER_MAX_PAGES)
+atexit.register(driver_pool.close)
+
+
+def _scrape_store(parser_class, query, deadline, parsers, progress=None, pool=None,
+                  quick=False):
+    """Парсит один магазин на драйвере из пула (выполняется в отдельном потоке)"""
+    pool = pool or driver_pool
+    try:
+        # Пул может быть занят (например, страницами Магнита) - ждем не дольше дедлайна
+        with pool.driver(timeout=max(deadline - time.monotonic(), 0)) as driver:
+            parser = parser_class(driver, deadline=deadline, progress=progress, pool=pool,
+                                  quick=quick)
+            parser.prepare_driver(driver)
+            parsers[parser_class] = parser
+            try:
+                return parser.scrape_search(query)
+            finally:
+                pool.add_pages(driver, parser.pages_loaded)
+                parser.flush_progress()
+    except TimeoutError:
+        # Иначе smart_product_search принял бы это за зависший парсер
+        logger.error("❌ %s: нет свободного браузера до дедлайна парсинга",
+                     parser_class.STORE_NAME)
+        return []
+    finally:
+        if progress is not None:
+            # События пишутся из этого потока - его соединение с БД больше не нужно
+            connections.close_all()
+
+
+def smart_product_search(query, progress=None, pool=None, timings=None, quick=False):
+    """
+    Основная функция поиска
+
+    Args:
+        query: Поисковый запрос
+        progress: ScrapeProgress - получает товары магазинов по мере сбора
+            и итог сопоставления (для потока частичных результатов)
+        pool: DriverPool, из которого берутся драйверы (по умолчанию - общий
+            пул процесса; бенчмарк подставляет пул драйверов-записей)
+        timings: Словарь, в который записывается время этапов, с:
+            {название магазина: {'load', 'scroll', 'parse'}, 'match': ...}
+        quick: Быстрый этап - только первый экран Пятёрочки и первая
+            страница Магнита (остальное собирает полный парсинг)
+    """
     logger.info("🔍 Запуск умного поиска: '%s'", query)
 
-    driver = get_driver()
+    # 1. Парсим оба магазина одновременно, каждый на своём драйвере
+    logger.info("🔵🔴 Начинаем парсинг Пятёрочки и Магнита...")
+    store_parsers = (PyaterochkaParser, MagnitParser)
+    parsers = {}
+    products = {}
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=len(store_parsers))
     try:
-        # 1. Парсим Пятёрочку
-        logger.info("🔵 Начинаем парсинг Пятёрочки...")
-        pyat_parser = PyaterochkaParser(driver)
-        pyat_products = pyat_parser.scrape_search(query)
-        logger.info("✅ Пятёрочка завершена: %s товаров", len(pyat_products))
-
-        # 2. Парсим Магнит
-        logger.info("🔴 Начинаем парсинг Магнита...")
-        magnit_parser = MagnitParser(driver)
-        magnit_products = magnit_parser.scrape_search(query)
-        logger.info("✅ Магнит завершен: %s товаров", len(magnit_products))
-
-        # 3. Сопоставляем результаты
-        logger.info("🔀 Сравниваем товары из обоих магазинов...")
-        result = smart_compare_products(pyat_products, magnit_products)
-        logger.info("✅ Сравнение завершено: пар=%s, одиночных=%s", len(
-            result['pairs']), len(result['pyat_single']) + len(result['magnit_single']))
-        return result
+        futures = {
+            parser_class: executor.submit(
+                _scrape_store, parser_class, query,
+                started + parser_class.SCRAPE_TIMEOUT, parsers, progress, pool, quick)
+            for parser_class in store_parsers
+        }
+        for parser_class, future in futures.items():
+            # Парсер сам останавливается к дедлайну, запас - на зависший браузер
+            timeout = started + parser_class.SCRAPE_TIMEOUT + \
+                parser_class.TIMEOUT_GRACE - time.monotonic()
+            try:
+                products[parser_class] = future.result(timeout=max(timeout, 0))
+            except FuturesTimeoutError:
+                parser = parsers.get(parser_class)
+                products[parser_class] = list(parser.get_products()) if parser else []
+                logger.warning("⏱ %s не уложился в %s с, берём частичный результат: %s товаров",
+                               parser_class.STORE_NAME, parser_class.SCRAPE_TIMEOUT,
+                               len(products[parser_class]))
+            except Exception as e:
+                products[parser_class] = []
+                logger.error("❌ Ошибка парсинга (%s): %s",
+                             parser_class.STORE_NAME, str(e), exc_info=True)
     finally:
-        driver.quit()
-        logger.info("🔚 Браузер закрыт")
+        # Зависший парсер дорабатывает в фоне и сам вернёт драйвер в пул
+        executor.shutdown(wait=False)
+
+    pyat_products = products[PyaterochkaParser]
+    magnit_products = products[MagnitParser]
+    logger.info("✅ Парсинг завершён за %.1f с: Пятёрочка %s, Магнит %s товаров",
+                time.monotonic() - started, len(pyat_products), len(magnit_products))
+    for parser_class, parser in parsers.items():
+        logger.info("   ⏱ %s: %s", parser_class.STORE_NAME, ", ".join(
+            f"{stage} {seconds:.2f} с" for stage, seconds in parser.timings.items()))
+        if timings is not None:
+            timings[parser_class.STORE_NAME] = dict(parser.timings)
+
+    # 2. Сопоставляем результаты
+    logger.info("🔀 Сравниваем товары из обоих магазинов...")
+    match_started = time.perf_counter()
+    result = smart_compare_products(pyat_products, magnit_products)
+    if timings is not None:
+        timings['match'] = time.perf_counter() - match_started
+    logger.info("✅ Сравнение завершено: пар=%s, одиночных=%s", len(
+        result['pairs']), len(result['pyat_single']) + len(result['magnit_single']))
+    if progress is not None:
+        progress.pairs(result)
+    return result
+
+
+# Новые карточки товаров: тексты <p> (название) и <span> (цена), как
+# get_text(strip=True) у BeautifulSoup. Собранная карточка помечается
+# своим ключом, при перерисовке с другим товаром ключ не совпадёт
+HARVEST_SCRIPT = """
+function text(el) {
+    var parts = [], walker = document.createTreeWalker(el, NodeFilter.SHOW_TEXT), node;
+    while ((node = walker.nextNode())) {
+        var value = node.nodeValue.trim();
+        if (value) parts.push(value);
+    }
+    return parts.join('');
+}
+var result = [];
+document.querySelectorAll(arguments[0]).forEach(function (card) {
+    var link = card.querySelector('a[href]');
+    var key = link ? link.getAttribute('href') : card.getAttribute('data-qa') + '|' + text(card);
+    if (card.dataset.harvested === key) return;
+    card.dataset.harvested = key;
+    result.push({
+        key: key,
+        names: Array.prototype.map.call(card.querySelectorAll('p'), text),
+        prices: Array.prototype.map.call(card.querySelectorAll('span'), text)
+    });
+});
+return result;
+"""
 
 
 class BaseParser(ABC):
-    def __init__(self, driver):
+    STORE_NAME = ''
+    # Сколько секунд магазин может парситься в smart_product_search
+    SCRAPE_TIMEOUT = 90
+    # Сколько ещё ждать парсер после дедлайна, прежде чем взять частичный результат
+    TIMEOUT_GRACE = 10
+    # Как часто новые товары отдаются в поток частичных результатов (секунды)
+    PROGRESS_INTERVAL = 1.0
+    # Карточка товара в разметке (тег и атрибуты для find_all/SoupStrainer)
+    CARD_TAG = None
+    CARD_ATTRS = {}
+    # Бэкенд BeautifulSoup ('lxml', 'html.parser'); None - самый быстрый из установленных
+    HTML_PARSER = None
+    # Категории ресурсов, которые магазину нужны в облегченном профиле
+    # (см. scraping.resources.RESOURCE_PATTERNS), например frozenset({'image'})
+    ALLOWED_RESOURCES = frozenset()
+
+    def __init__(self, driver, deadline=None, progress=None, pool=None, quick=False):
         self.driver = driver
+        # DriverPool, из которого можно взять дополнительные драйверы (или None)
+        self.pool = pool
+        # Быстрый этап: только первый экран/первая страница результатов
+        self.quick = quick
         self.products = []
+        # time.monotonic(), после которого парсер прекращает загружать новые товары
+        self.deadline = deadline
+        self.pages_loaded = 0
+        # ScrapeProgress: получатель частичных результатов (или None)
+        self.progress = progress
+        self._reported = 0
+        self._reported_at = time.monotonic()
+        # Время этапов парсинга (load, scroll, parse), с
+        self.timings = defaultdict(float)
+
+    def time_is_up(self):
+        """Истёк ли дедлайн парсинга"""
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    @contextmanager
+    def stage(self, name):
+        """Засчитывает время блока with в этап name (self.timings)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - started
+
+    def prepare_driver(self, driver):
+        """Блокирует на драйвере ресурсы, не нужные магазину (драйверы из пула общие)"""
+        if LEAN_PROFILE:
+            block_resources(driver, self.ALLOWED_RESOURCES)
+
+    def open_page(self, url):
+        """Открывает страницу в браузере (с учётом числа загрузок для пула)"""
+        self.driver.get(url)
+        self.pages_loaded += 1
+
+    def parse_cards(self):
+        """Карточки товаров текущей страницы браузера (только их поддеревья)"""
+        return parse_cards(self.driver.page_source, self.CARD_TAG, self.CARD_ATTRS,
+                           parser=self.HTML_PARSER)
+
+    @staticmethod
+    def sku_from_link(href):
+        """Артикул товара из ссылки на карточку или '', если его там нет"""
+        if not href:
+            return ''
+        return max(SKU_RE.findall(urlsplit(href).path), key=len, default='')
+
+    def extract_product_sku(self, elem):
+        """Извлечь артикул товара из ссылки в элементе страницы"""
+        link = elem.find('a', href=True)
+        return self.sku_from_link(link['href']) if link else ''
 
     @abstractmethod
     def extract_product_name(self, elem):
@@ -92,7 +321,7 @@ class BaseParser(ABC):
     def scrape_search(self, query):
         """Выполнить поиск и вернуть список товаров"""
 
-    def add_product(self, name: str, price: Decimal, page: int = 1):
+    def add_product(self, name: str, price: Decimal, page: int = 1, sku: str = ''):
         """Универсальный метод добавления товара"""
         if name and price:
             product_dict = {
@@ -100,41 +329,74 @@ class BaseParser(ABC):
                 'price': price,
                 'page': page
             }
+            if sku:
+                product_dict['sku'] = sku
             self.products.append(product_dict)
+            if time.monotonic() - self._reported_at >= self.PROGRESS_INTERVAL:
+                self.flush_progress()
             return True
         return False
 
+    def flush_progress(self):
+        """Отдает в поток частичных результатов товары, собранные с прошлого раза"""
+        if self.progress is not None and self._reported < len(self.products):
+            self.progress.products(self.STORE_NAME, self.products[self._reported:])
+            self._reported = len(self.products)
+        self._reported_at = time.monotonic()
+
     def get_products(self):
         """Получить все спарсенные товары"""
         return self.products
 
 
 class PyaterochkaParser(BaseParser):
+    STORE_NAME = 'Пятёрочка'
     BASE_URL = "https://5ka.ru/search/"
+    CARD_SELECTOR = "div[data-qa^='product-card']"
+    CARD_TAG = 'div'
+    CARD_ATTRS = {'data-qa': re.compile('^product-card')}
+    # Тексты <p>, которые не могут быть названием: число (рейтинг, вес) и без букв
+    NUMBER_RE = re.compile(r'^\d+[.,]?\d*$')
+    LETTER_RE = re.compile(r'[а-яА-ЯёЁa-zA-Z]')
+    # Части цены в <span>: рубли и копейки отдельными числами
+    PRICE_PART_RE = re.compile(r'^\d+$')
     MAX_SCROLL_ATTEMPTS = 20
-    SCROLL_WAIT = 2
+    # Быстрый этап - только первый экран, без прокрутки
+    QUICK_SCROLL_ATTEMPTS = 0
+    # Потоковый сбор новых карточек (harvest) вместо разбора page_source
+    STREAMING = True
+    # Верхние границы ожиданий (секунды): реально ждём, пока страница затихнет
+    READY_TIMEOUT = 20
+    SCROLL_TIMEOUT = 5
+    # Сколько страница должна "молчать", чтобы считаться загруженной
+    IDLE_SECONDS = 0.5
+    # После прокрутки - дольше: подгрузка стартует не мгновенно
+    SCROLL_IDLE_SECONDS = 1
 
     def extract_product_name(self, elem):
         """
         Извлекает название товара из карточки Пятёрочки
         Ищет <p> с самым длинным текстом среди всех <p>
         """
-        all_p_elements = elem.find_all('p')
-        candidates = []
+        return self._pick_name(
+            p_elem.get_text(strip=True) for p_elem in elem.find_all('p'))
 
-        for p_elem in all_p_elements:
-            text = p_elem.get_text(strip=True)
+    @classmethod
+    def _pick_name(cls, texts):
+        """Название - самый длинный из текстов <p> карточки"""
+        candidates = []
 
+        for text in texts:
             # Пропускаем пустые
             if not text or len(text) < 5:
                 continue
 
             # Пропускаем только цифры (рейтинг, вес)
-            if re.match(r'^\d+[.,]?\d*$', text):
+            if cls.NUMBER_RE.match(text):
                 continue
 
             # Пропускаем элементы без букв
-            if not re.search(r'[а-яА-ЯёЁa-zA-Z]', text):
+            if not cls.LETTER_RE.search(text):
                 continue
 
             candidates.append({'text': text, 'length': len(text)})
@@ -151,14 +413,17 @@ class PyaterochkaParser(BaseParser):
         На Пятёрочке две цены: старая (до скидки) и акционная (со скидкой)
         Берём АКЦИОННУЮ цену!
         """
-        all_spans = elem.find_all('span')
-        price_numbers = []
+        return self._pick_price(
+            span.get_text(strip=True) for span in elem.find_all('span'))
 
-        for span in all_spans:
-            text = span.get_text(strip=True)
+    @classmethod
+    def _pick_price(cls, texts):
+        """Цена из текстов <span> карточки"""
+        price_numbers = []
 
+        for text in texts:
             # Ищем только span'ы с цифрами (пропускаем ₽, скидки и т.д.)
-            if re.match(r'^\d+$', text):
+            if cls.PRICE_PART_RE.match(text):
                 price_numbers.append(text)
 
         if not price_numbers:
@@ -190,23 +455,28 @@ class PyaterochkaParser(BaseParser):
             encoded_query = quote(query, safe='')
             search_url = f"{self.BASE_URL}?text={encoded_query}"
 
-            self.driver.get(search_url)
-            time.sleep(5)
-
-            try:
-                WebDriverWait(self.driver, 15).until(
-                    EC.presence_of_all_elements_located(
-                        (By.CSS_SELECTOR, "div[data-qa^='product-card']")
-                    )
-                )
-                logger.info("✅ Товары загружены (Пятёрочка)")
-            except Exception as e:
-                logger.warning("❌ Товары не загружены (Пятёрочка): %s", str(e))
+            with self.stage('load'):
+                self.open_page(search_url)
+                loaded = wait_for_count(self.driver, self.CARD_SELECTOR,
+                                        timeout=self.READY_TIMEOUT)
+                if loaded:
+                    # Дожидаемся, пока догрузятся цены и картинки первой порции
+                    wait_for_idle(self.driver, idle=self.IDLE_SECONDS,
+                                  timeout=self.SCROLL_TIMEOUT)
+            if not loaded:
+                logger.warning("❌ Товары не загружены (Пятёрочка) за %s с",
+                               self.READY_TIMEOUT)
                 return []
+            logger.info("✅ Товары загружены (Пятёрочка)")
 
-            time.sleep(2)
-            self._scroll_and_load()
-            self._parse_products()
+            if self.STREAMING:
+                for _ in self.harvest():
+                    pass
+            else:
+                with self.stage('scroll'):
+                    self._scroll_and_load()
+                with self.stage('parse'):
+                    self._parse_products()
 
             logger.info("✅ ИТОГО (Пятёрочка): Спарсено %s товаров",
                         len(self.products))
@@ -216,25 +486,87 @@ class PyaterochkaParser(BaseParser):
             logger.error("❌ ОШИБКА Пятёрочки: %s", str(e), exc_info=True)
             return []
 
+    @property
+    def scroll_limit(self):
+        """Сколько раз можно прокрутить страницу"""
+        return self.QUICK_SCROLL_ATTEMPTS if self.quick else self.MAX_SCROLL_ATTEMPTS
+
+    def harvest(self):
+        """
+        Прокручивает страницу и отдаёт товары по мере появления
+
+        За прокрутку - один execute_script, который возвращает только
+        новые карточки (названия и цены текстом), без page_source и
+        повторного разбора всей страницы. Карточки различаются по ссылке
+        на товар, повторно отрисованная карточка второй раз не попадает.
+
+        Yields:
+            Словари товаров (как в add_product)
+        """
+        logger.debug("📜 Начинаем потоковый сбор товаров...")
+        seen = set()
+        scroll_attempts = 0
+
+        while True:
+            new_cards = 0
+            batch = []
+            with self.stage('parse'):
+                for card in self.driver.execute_script(HARVEST_SCRIPT, self.CARD_SELECTOR):
+                    if card['key'] in seen:
+                        continue
+                    seen.add(card['key'])
+                    new_cards += 1
+
+                    name = self._pick_name(card['names'])
+                    price = self._pick_price(card['prices'])
+                    sku = self.sku_from_link(card['key']) if card['key'].startswith(('/', 'http')) else ''
+                    if self.add_product(name, price, page=1, sku=sku):
+                        logger.debug("  ✅ [%s] %s... - %s₽", len(seen), name[:50], price)
+                        batch.append(self.products[-1])
+                    else:
+                        logger.debug("  ⚠️ [%s] Название или цена не найдены", len(seen))
+            yield from batch
+
+            if not new_cards or scroll_attempts >= self.scroll_limit:
+                break
+            if self.time_is_up():
+                logger.warning("⏱ Время парсинга Пятёрочки истекло, прокрутка остановлена")
+                break
+
+            with self.stage('scroll'):
+                scrolled_at = page_state(self.driver)['now']
+                self.driver.execute_script(
+                    "window.scrollTo(0, document.body.scrollHeight);")
+                wait_for_idle(self.driver, idle=self.SCROLL_IDLE_SECONDS,
+                              timeout=self.SCROLL_TIMEOUT, since=scrolled_at)
+            scroll_attempts += 1
+
+        logger.info(
+            "✅ Сбор завершён. Карточек: %s, потребовалось %s прокруток", len(seen), scroll_attempts)
+
     def _scroll_and_load(self):
         """Прокручивает страницу для загрузки всех товаров"""
         logger.debug("📜 Начинаем прокрутку страницы...")
         previous_count = 0
+        current_count = 0
         scroll_attempts = 0
 
-        while scroll_attempts < self.MAX_SCROLL_ATTEMPTS:
-            soup = BeautifulSoup(self.driver.page_source, 'html.parser')
-            current_products = soup.find_all(
-                'div', attrs={'data-qa': re.compile('^product-card')})
-            current_count = len(current_products)
+        while scroll_attempts < self.scroll_limit:
+            if self.time_is_up():
+                logger.warning("⏱ Время парсинга Пятёрочки истекло, прокрутка остановлена")
+                break
+            current_count = page_state(self.driver, self.CARD_SELECTOR)['count']
 
             if current_count == previous_count:
                 break
 
             previous_count = current_count
+            scrolled_at = page_state(self.driver)['now']
             self.driver.execute_script(
                 "window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(self.SCROLL_WAIT)
+            # Ждём подгрузки новой порции: страница затихла после прокрутки
+            wait_for_idle(self.driver, idle=self.SCROLL_IDLE_SECONDS,
+                          timeout=self.SCROLL_TIMEOUT, since=scrolled_at)
             scroll_attempts += 1
 
         logger.info(
@@ -244,9 +576,7 @@ class PyaterochkaParser(BaseParser):
         """Парсит товары со страницы"""
         logger.debug("📄 Начинаем парсинг товаров...")
 
-        soup = BeautifulSoup(self.driver.page_source, 'html.parser')
-        product_elements = soup.find_all(
-            'div', attrs={'data-qa': re.compile('^product-card')})
+        product_elements = self.parse_cards()
 
         if not product_elements:
             logger.warning("⚠️ Товары не найдены на странице (Пятёрочка)")
@@ -265,7 +595,7 @@ class PyaterochkaParser(BaseParser):
                         "  ⚠️ [%s] %s... - цена не найдена", i+1, name[:40])
                     continue
 
-                if self.add_product(name, price, page=1):
+                if self.add_product(name, price, page=1, sku=self.extract_product_sku(elem)):
                     logger.debug("  ✅ [%s] %s... - %s₽", i+1, name[:50], price)
 
             except Exception as e:
@@ -274,12 +604,27 @@ class PyaterochkaParser(BaseParser):
 
 
 class MagnitParser(BaseParser):
+    STORE_NAME = 'Магнит'
     BASE_URL = "https://magnit.ru/search"
-    PAGE_WAIT = 3
+    CARD_SELECTOR = "article[data-test-id='v-product-preview']"
+    CARD_TAG = 'article'
+    CARD_ATTRS = {'data-test-id': 'v-product-preview'}
+    NAME_CLASS_RE = re.compile('unit-catalog-product-preview-title')
+    PRICE_CLASS_RE = re.compile('unit-catalog-product-preview-prices__regular')
+    # Число цены: "149.99 ₽", "149,99 ₽" или "149 ₽"
+    PRICE_NUMBER_RE = re.compile(r'\d+[.,]\d+|\d+')
+    # Верхняя граница ожидания страницы (секунды): реально ждём, пока затихнет
+    PAGE_TIMEOUT = 10
+    IDLE_SECONDS = 0.5
+    # Ссылки пагинации: номер страницы в параметре page
+    PAGE_LINK_RE = re.compile(r'[?&]page=(\d+)')
+    # Больше страниц по пагинации не грузим (защита от мусорных ссылок)
+    MAX_PAGES = 50
+    # Сколько страниц грузится одновременно (драйвер парсера + свободные из пула)
+    CONCURRENT_PAGES = 3
 
     def extract_product_name(self, elem):
-        name_elem = elem.find('div', class_=re.compile(
-            'unit-catalog-product-preview-title'))
+        name_elem = elem.find('div', class_=self.NAME_CLASS_RE)
 
         if name_elem:
             name = name_elem.get_text(strip=True)
@@ -289,8 +634,7 @@ class MagnitParser(BaseParser):
         return None
 
     def extract_product_price(self, elem):
-        price_elem = elem.find('span', class_=re.compile(
-            'unit-catalog-product-preview-prices__regular'))
+        price_elem = elem.find('span', class_=self.PRICE_CLASS_RE)
 
         if not price_elem:
             return None
@@ -298,7 +642,7 @@ class MagnitParser(BaseParser):
         price_text = price_elem.get_text(strip=True)
 
         # Извлекаем цифры из текста (может быть "149.99 ₽" или "149,99 ₽")
-        numbers = re.findall(r'\d+[.,]\d+|\d+', price_text)
+        numbers = self.PRICE_NUMBER_RE.findall(price_text)
 
         if not numbers:
             return None
@@ -312,24 +656,44 @@ class MagnitParser(BaseParser):
         except Exception:
             return None
 
+    def page_url(self, encoded_query, page):
+        """Адрес страницы page результатов поиска"""
+        return f"{self.BASE_URL}?term={encoded_query}&page={page}"
+
+    def page_count(self, html):
+        """
+        Число страниц результатов по пагинации страницы или None, если
+        пагинации нет (тогда страницы грузятся по одной до пустой)
+        """
+        pages = []
+        for link in parse_cards(html, 'a', {'href': self.PAGE_LINK_RE}, parser=self.HTML_PARSER):
+            match = self.PAGE_LINK_RE.search(link['href'])
+            pages.append(int(match.group(1)))
+        if not pages:
+            return None
+        return min(max(pages), self.MAX_PAGES)
+
     def scrape_search(self, query):
-        current_page = 1
         try:
             encoded_query = quote(query, safe='')
 
-            while True:
-                logger.info("📄 Парсим страницу %s Магнита...", current_page)
-                url = f"{self.BASE_URL}?term={encoded_query}&page={current_page}"
-
-                self.driver.get(url)
-                time.sleep(self.PAGE_WAIT)
-
-                if not self._parse_page():
-                    logger.debug("📍 Достигнута последняя страница Магнита")
-                    break
-
-                current_page += 1
-                time.sleep(1)
+            logger.info("📄 Парсим страницу 1 Магнита...")
+            with self.stage('load'):
+                html = self._load_page(self.driver, self.page_url(encoded_query, 1))
+            total = self.page_count(html)
+
+            if self.quick:
+                # Быстрый этап - только первая страница
+                with self.stage('parse'):
+                    self._parse_page(html, page=1)
+            elif total is None:
+                with self.stage('parse'):
+                    found = self._parse_page(html, page=1)
+                if found:
+                    self._scrape_serial(encoded_query, 2)
+            else:
+                logger.info("📚 Страниц результатов Магнита: %s", total)
+                self._scrape_concurrent(encoded_query, html, total)
 
             logger.info("✅ ИТОГО (Магнит): Спарсено %s товаров",
                         len(self.products))
@@ -339,14 +703,143 @@ class MagnitParser(BaseParser):
             logger.error("❌ ОШИБКА Магнита: %s", str(e), exc_info=True)
             return []
 
-    def _parse_page(self) -> bool:
+    def _load_page(self, driver, url):
+        """Загружает страницу и ждёт, пока она затихнет; возвращает разметку"""
+        if driver is self.driver:
+            self.open_page(url)
+        else:
+            driver.get(url)
+        # Карточки и цены отрисованы, сеть и DOM затихли
+        wait_for_idle(driver, idle=self.IDLE_SECONDS, timeout=self.PAGE_TIMEOUT)
+        return driver.page_source
+
+    def _scrape_serial(self, encoded_query, current_page):
+        """Страницы по одной, пока не придёт пустая (число страниц неизвестно)"""
+        while True:
+            if self.time_is_up():
+                logger.warning("⏱ Время парсинга Магнита истекло на странице %s",
+                               current_page)
+                break
+            logger.info("📄 Парсим страницу %s Магнита...", current_page)
+
+            with self.stage('load'):
+                html = self._load_page(self.driver, self.page_url(encoded_query, current_page))
+
+            with self.stage('parse'):
+                found = self._parse_page(html, page=current_page)
+            if not found:
+                logger.debug("📍 Достигнута последняя страница Магнита")
+                break
+
+            current_page += 1
+
+    def _scrape_concurrent(self, encoded_query, first_html, total):
+        """
+        Страницы 2..total грузятся параллельно (до CONCURRENT_PAGES драйверов:
+        свой и свободные из пула), а разбираются по порядку в этом потоке -
+        пока разбирается страница N, следующие уже грузятся
         """
-        Парсит одну страницу результатов
+        pages = {page: Future() for page in range(2, total + 1)}
+        pending = queue.SimpleQueue()
+        for page in pages:
+            pending.put(page)
+        stop = threading.Event()
+
+        # Драйвер парсера грузит, пока есть страницы; остальные - если нашлись в пуле
+        borrows = [False] + [True] * (min(self.CONCURRENT_PAGES, len(pages)) - 1) if pages else []
+        workers = [threading.Thread(target=self._page_worker,
+                                    args=(encoded_query, pending, pages, stop, borrow),
+                                    name=f'magnit-pages-{i}', daemon=True)
+                   for i, borrow in enumerate(borrows)]
+        for worker in workers:
+            worker.start()
+        try:
+            with self.stage('parse'):
+                found = self._parse_page(first_html, page=1)
+            for page, future in pages.items():
+                if not found:
+                    logger.debug("📍 Достигнута последняя страница Магнита")
+                    break
+                with self.stage('load'):
+                    html = future.result()
+                if html is None:
+                    # Страница не загрузилась (ошибка или дедлайн) - разбираем следующие
+                    continue
+                with self.stage('parse'):
+                    found = self._parse_page(html, page=page)
+        finally:
+            # Пустая страница раньше пагинации: оставшиеся не грузим
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+    def _page_worker(self, encoded_query, pending, pages, stop, borrow):
+        """
+        Поток загрузки страниц: берёт номера из pending, пока они есть
+        и не выставлен stop
+
+        borrow=False - работает на драйвере парсера, True - на свободном
+        драйвере пула (если свободного нет, сразу завершается)
+        """
+        driver = self.driver
+        if borrow:
+            if self.pool is None:
+                return
+            try:
+                driver = self.pool.acquire(timeout=0)
+            except (TimeoutError, RuntimeError):
+                return
+            except Exception as e:
+                logger.warning("⚠️ Не удалось взять дополнительный браузер: %s", str(e))
+                return
+        loaded = 0
+        broken = False
+        try:
+            if driver is not self.driver:
+                try:
+                    self.prepare_driver(driver)
+                except Exception as e:
+                    # Браузер не отвечает на CDP - закрываем, страницы достанутся другим
+                    logger.warning("⚠️ Не удалось подготовить дополнительный браузер: %s", str(e))
+                    broken = True
+                    return
+            while not (broken or stop.is_set()):
+                try:
+                    page = pending.get_nowait()
+                except queue.Empty:
+                    return
+                html = None
+                if not self.time_is_up():
+                    logger.info("📄 Загружаем страницу %s Магнита...", page)
+                    try:
+                        html = self._load_page(driver, self.page_url(encoded_query, page))
+                        loaded += 1
+                    except WebDriverException as e:
+                        logger.warning("⚠️ Страница %s Магнита не загрузилась: %s", page, str(e))
+                        # Упавший браузер больше не используем, страницы достанутся другим
+                        broken = driver is not self.driver
+                    except Exception as e:
+                        logger.warning("⚠️ Страница %s Магнита не загрузилась: %s", page, str(e))
+                else:
+                    logger.warning("⏱ Время парсинга Магнита истекло, страница %s пропущена", page)
+                pages[page].set_result(html)
+        finally:
+            if driver is not self.driver:
+                self.pool.add_pages(driver, loaded)
+                self.pool.release(driver, discard=broken)
+
+    def _parse_page(self, html=None, page=None) -> bool:
+        """
+        Парсит одну страницу результатов (разметку html или текущую страницу браузера)
         Возвращает True если товары найдены, False если это последняя страница
         """
-        soup = BeautifulSoup(self.driver.page_source, 'html.parser')
-        product_elements = soup.find_all(
-            'article', attrs={'data-test-id': 'v-product-preview'})
+        if html is None:
+            product_elements = self.parse_cards()
+        else:
+            product_elements = parse_cards(html, self.CARD_TAG, self.CARD_ATTRS,
+                                           parser=self.HTML_PARSER)
+        if page is None:
+            page = self.products[-1]['page'] + 1 if self.products else 1
 
         if not product_elements:
             logger.debug("⚠️ Товары не найдены на этой странице")
@@ -368,7 +861,8 @@ class MagnitParser(BaseParser):
                         "  ⚠️ [%s] %s... - цена не найдена", i+1, name[:40])
                     continue
 
-                if self.add_product(name, price, page=self.products[-1]['page'] + 1 if self.products else 1):
+                if self.add_product(name, price, page=page,
+                                    sku=self.extract_product_sku(elem)):
                     logger.debug("  ✅ [%s] %s... - %s₽", i+1, name[:50], price)
 
             except Exception as e:
@@ -430,10 +924,73 @@ def _find_pairs(pyat_products, magnit_products, similarity_threshold):
     return pairs, used_pyat_indices, used_magnit_indices
 
 
+def _find_pairs_tfidf(pyat_products, magnit_products, similarity_threshold):
+    # numpy/scipy нужны только этому движку - импортируем по требованию
+    from scraping.vectorized import find_pairs_tfidf
+    return find_pairs_tfidf(pyat_products, magnit_products, similarity_threshold)
+
+
+def _similarity_edges(pyat_products, magnit_products, similarity_threshold):
+    """Все пары с token_set_ratio не ниже порога полным перебором"""
+    edges = []
+    for pyat_idx, pyat_prod in enumerate(pyat_products):
+        for magnit_idx, magnit_prod in enumerate(magnit_products):
+            similarity = fuzz.token_set_ratio(
+                pyat_prod['name'].lower(),
+                magnit_prod['name'].lower()
+            )
+            if similarity > 0 and similarity >= similarity_threshold:
+                edges.append((pyat_idx, magnit_idx, similarity))
+    return edges
+
+
+def _similarity_edges_tfidf(pyat_products, magnit_products, similarity_threshold):
+    from scraping.vectorized import similarity_edges_tfidf
+    return similarity_edges_tfidf(pyat_products, magnit_products, similarity_threshold)
+
+
+def _find_pairs_optimal(pyat_products, magnit_products, similarity_threshold, engine):
+    """
+    Глобально оптимальные пары: максимум суммарного сходства вместо
+    жадного выбора по порядку товаров Пятёрочки
+    """
+    # scipy нужен только оптимальному назначению - импортируем по требованию
+    from scraping.assignment import optimal_pairs
+    edges = SIMILARITY_EDGES[engine](pyat_products, magnit_products, similarity_threshold)
+    logger.debug("  Рёбер сходства не ниже порога: %s", len(edges))
+    pairs, used_pyat_indices, used_magnit_indices = optimal_pairs(
+        pyat_products, magnit_products, edges)
+    logger.info("✅ Найдено пар: %s", len(pairs))
+    return pairs, used_pyat_indices, used_magnit_indices
+
+
+# Движки поиска пар: 'legacy' - перебор всех пар fuzzywuzzy, 'indexed' - тот же
+# результат с отбором кандидатов по индексу (scraping.matching), 'tfidf' -
+# пакетная матрица косинусного сходства на NumPy (scraping.vectorized)
+MATCHING_ENGINES = {
+    'legacy': _find_pairs,
+    'indexed': find_pairs_indexed,
+    'tfidf': _find_pairs_tfidf,
+}
+
+# Все пары не ниже порога для каждого движка - вход оптимального назначения
+SIMILARITY_EDGES = {
+    'legacy': _similarity_edges,
+    'indexed': similarity_edges_indexed,
+    'tfidf': _similarity_edges_tfidf,
+}
+
+# 'greedy' - товары Пятёрочки по порядку берут лучший свободный товар Магнита,
+# 'optimal' - назначение с максимальным суммарным сходством (scraping.assignment)
+MATCHING_STRATEGIES = ('greedy', 'optimal')
+
+
 def smart_compare_products(
     pyat_products: list[dict],
     magnit_products: list[dict],
-    similarity_threshold: int = 75
+    similarity_threshold: int = 75,
+    engine: str = 'indexed',
+    strategy: str = 'greedy'
 ) -> dict:
     """
     Умное сравнение товаров из двух магазинов
@@ -442,6 +999,10 @@ def smart_compare_products(
         pyat_products: Товары из Пятёрочки
         magnit_products: Товары из Магнита
         similarity_threshold: Минимальный % сходства для пары (0-100)
+        engine: Движок поиска пар из MATCHING_ENGINES
+        strategy: Выбор пар из MATCHING_STRATEGIES: 'greedy' (по порядку
+            товаров) или 'optimal' (не зависит от порядка, меньше смен пар
+            между парсингами)
 
     Returns:
         {
@@ -453,10 +1014,20 @@ def smart_compare_products(
     logger.info("🔍 СРАВНЕНИЕ ТОВАРОВ: %s из Пятёрочки vs %s из Магнита", len(
         pyat_products), len(magnit_products))
 
+    if engine not in MATCHING_ENGINES:
+        raise ValueError(f"Неизвестный движок сопоставления: {engine}")
+    if strategy not in MATCHING_STRATEGIES:
+        raise ValueError(f"Неизвестная стратегия сопоставления: {strategy}")
+
     # НАХОДИМ ПАРЫ
-    logger.info("🔍 Ищем пары товаров...")
-    pairs, used_pyat_indices, used_magnit_indices = _find_pairs(
-        pyat_products, magnit_products, similarity_threshold)
+    logger.info("🔍 Ищем пары товаров (движок: %s, стратегия: %s)...",
+                engine, strategy)
+    if strategy == 'optimal':
+        pairs, used_pyat_indices, used_magnit_indices = _find_pairs_optimal(
+            pyat_products, magnit_products, similarity_threshold, engine)
+    else:
+        pairs, used_pyat_indices, used_magnit_indices = MATCHING_ENGINES[engine](
+            pyat_products, magnit_products, similarity_threshold)
 
     # НАХОДИМ ОДИНОЧНЫЕ ТОВАРЫ
     logger.info("🔎 Ищем товары без пары...")
@@ -488,160 +1059,351 @@ def smart_compare_products(
     }
 
 
-def _save_single_products_to_db(single_products, store_name, category):
-    stats = {
-        'created': 0,
-        'updated': 0,
-        'errors': 0,
-        'categories_added': 0
-    }
-    for item in single_products:
+def _product_rows(res):
+    """
+    Строки товаров из результата сравнения
+
+    Returns:
+        ({(name_pyat, name_mag): поля товара},
+         {(name_pyat, name_mag): {код магазина: артикул}},
+         число ошибочных записей)
+        Для товара только в одном магазине второе название - None.
+    """
+    rows = {}
+    skus = {}
+    errors = 0
+
+    for pair in res.get('pairs', []):
         try:
+            key = (pair['pyat']['name'], pair['magnit']['name'])
+            fields = {
+                'price_pyat': pair['price_pyat'],
+                'price_mag': pair['price_mag'],
+                'similarity': pair['similarity'],
+            }
+        except (KeyError, TypeError) as e:
+            errors += 1
+            logger.error("  ❌ Ошибка сохранения парного товара: %s", str(e))
+            continue
+        if not all(key):
+            errors += 1
+            logger.error("  ❌ Ошибка сохранения парного товара: нет названия")
+            continue
+        rows[key] = fields
+        skus[key] = {'pyat': pair['pyat'].get('sku', ''), 'mag': pair['magnit'].get('sku', '')}
+
+    for store_name, items in (("Пятёрочка", res.get('pyat_single', [])),
+                              ("Магнит", res.get('magnit_single', []))):
+        for item in items:
             name = item.get('name')
-            price = item.get('price')
-            try:
-                if store_name == 'Пятёрочка':
-                    product = Product.objects.get(
-                        name_pyat=name,
-                        name_mag__isnull=True,
-                    )
-                else:
-                    product = Product.objects.get(
-                        name_mag=name,
-                        name_pyat__isnull=True,
-                    )
-
-                if store_name == 'Пятёрочка' and product.price_pyat != price:
-                    product.price_pyat = price
-                    product.save()
-                    stats['updated'] += 1
-                    logger.debug("    🔄 Обновлена цена")
-                elif store_name == 'Магнит' and product.price_mag != price:
-                    product.price_mag = price
-                    product.save()
-                    stats['updated'] += 1
-                    logger.debug("    🔄 Обновлена цена")
-
-            except Product.DoesNotExist:
-                if store_name == 'Пятёрочка':
-                    product, _ = Product.objects.get_or_create(
-                        name_pyat=name,
-                        price_pyat=price,
-                        name_mag=None,
-                        price_mag=None,
-                        created_at=timezone.now()
-                    )
-                else:
-                    product, _ = Product.objects.get_or_create(
-                        name_mag=name,
-                        price_mag=price,
-                        name_pyat=None,
-                        price_pyat=None,
-                        created_at=timezone.now()
-                    )
-                stats['created'] += 1
-                logger.info("  ✨ НОВЫЙ (%s): %s...",
-                            store_name, name[:50])
-
-            if not product.categories.filter(id=category.id).exists():
-                product.categories.add(category)
-                stats['categories_added'] += 1
+            if not name:
+                errors += 1
+                logger.error("  ❌ Ошибка сохранения товара %s: нет названия", store_name)
+                continue
+            if store_name == "Пятёрочка":
+                key = (name, None)
+                rows[key] = {'price_pyat': item.get('price')}
+                skus[key] = {'pyat': item.get('sku', '')}
+            else:
+                key = (None, name)
+                rows[key] = {'price_mag': item.get('price')}
+                skus[key] = {'mag': item.get('sku', '')}
+
+    return rows, skus, errors
 
-        except Exception as e:
-            stats['errors'] += 1
-            logger.error(
-                "  ❌ Ошибка сохранения товара %s: %s", store_name, str(e))
-    return stats
 
+def _row_items(rows, skus):
+    """
+    Товары магазинов каждой строки: {строка: {код магазина: (название, артикул, ключ)}}
 
-def _save_pair_to_db(pairs, category):
+    Товар магазина (по артикулу или ключу идентичности) попадает только
+    в первую строку с ним - иначе две строки обновляли бы одно предложение.
+    """
+    items = {}
+    seen = set()
+    for key in rows:
+        row = {}
+        for code, name in zip(Product.LEGACY_STORE_FIELDS, key):
+            if name:
+                row[code] = (name, skus.get(key, {}).get(code, ''), identity_key(name))
+        idents = {(code, sku or ikey) for code, (name, sku, ikey) in row.items()}
+        if idents & seen:
+            logger.debug("  ⚠️ Товар уже сохраняется другой строкой: %s / %s", key[0], key[1])
+            continue
+        seen |= idents
+        items[key] = row
+    return items
+
+
+def _match_offer(by_sku, by_key, code, sku, ikey):
+    """Существующее предложение товара магазина: по артикулу, затем по ключу"""
+    offer = by_sku.get((code, sku)) if sku else None
+    if offer is None:
+        offer = by_key.get((code, ikey))
+        # Ключ совпал, но артикулы разные - это другой товар
+        if offer is not None and sku and offer.external_id and offer.external_id != sku:
+            offer = None
+    return offer
+
+
+def _merge_products(merged):
+    """
+    Сливает опустевшие товары с товарами, забравшими их предложения
+
+    Категории, позиции корзин и история цен переходят к оставшемуся
+    товару, сам дубликат удаляется.
+
+    Args:
+        merged: {id дубликата: товар, в который он сливается}
+    """
+    through = Product.categories.through
+    for duplicate_id, product in merged.items():
+        links = [through(product_id=product.id, category_id=category_id)
+                 for category_id in through.objects.filter(
+                     product_id=duplicate_id).values_list('category_id', flat=True)]
+        through.objects.bulk_create(links, ignore_conflicts=True)
+        CartItem.objects.filter(product_id=duplicate_id).update(product_id=product.id)
+        PriceObservation.objects.filter(product_id=duplicate_id).update(product_id=product.id)
+        logger.debug("  🔗 Товар %s слит с %s", duplicate_id, product.id)
+    Product.objects.filter(id__in=list(merged)).delete()
+
+
+def _bulk_upsert(rows, category, skus=None):
+    """
+    Пакетно создаёт/обновляет товары и привязывает их к категории
+
+    Товар находится по предложениям магазинов: по артикулу, а без него -
+    по ключу идентичности названия (catalog.identity), поэтому иначе
+    записанное название или новая пара обновляют прежнюю строку, а не
+    создают дубликат. Существующие товары с предложениями читаются одним
+    запросом, новые создаются через bulk_create, изменения - через
+    bulk_update, связи с категорией - одной вставкой в промежуточную
+    таблицу M2M. В историю цен дописываются только изменения.
+
+    Если строка связала предложения разных товаров, предложение переходит
+    к первому из них, а опустевший товар сливается с ним (_merge_products).
+    Строка только с одним магазином не отвязывает предложение другого.
+    """
     stats = {
         'created': 0,
         'updated': 0,
+        'price_changed': 0,
+        'unchanged': 0,
         'errors': 0,
         'categories_added': 0
     }
-    for pair in pairs:
-        try:
-            name_pyat = pair.get('pyat').get('name')
-            name_mag = pair.get('magnit').get('name')
-            price_pyat = pair.get('price_pyat')
-            price_mag = pair.get('price_mag')
-            try:
-                product = Product.objects.get(
-                    name_pyat=name_pyat,
-                    name_mag=name_mag,
-                )
-                logger.debug("  ✓ Найдено: %s... / %s...",
-                             name_pyat[:50], name_mag[:50])
-
-                price_pyat_changed = product.price_pyat != price_pyat
-                price_mag_changed = product.price_mag != price_mag
-
-                if price_pyat_changed:
-                    product.price_pyat = price_pyat
-
-                if price_mag_changed:
-                    product.price_mag = price_mag
-
-                if price_pyat_changed or price_mag_changed:
-                    product.save()
-                    stats['updated'] += 1
-                    logger.debug("    🔄 Обновлены цены")
-
-            except Product.DoesNotExist:
-                product, _ = Product.objects.get_or_create(
-                    name_pyat=pair['pyat']['name'],
-                    price_pyat=pair['price_pyat'],
-                    name_mag=pair['magnit']['name'],
-                    price_mag=pair['price_mag'],
-                    similarity=pair['similarity'],
-                    created_at=timezone.now()
-                )
-                stats['created'] += 1
-                logger.info("  ✨ НОВЫЙ (пара): %s... / %s...",
-                            name_pyat[:50], name_mag[:50])
-
-            if not product.categories.filter(id=category.id).exists():
-                product.categories.add(category)
-                stats['categories_added'] += 1
+    stores = {code: Store.id_for(code) for code in Product.LEGACY_STORE_FIELDS}
+    codes = {store_id: code for code, store_id in stores.items()}
+    items = _row_items(rows, skus or {})
+
+    # Предложения найденных товаров - по индексам (магазин, артикул) и (магазин, ключ)
+    lookup = Q(pk__in=[])
+    for code, store_id in stores.items():
+        row_items = [row[code] for row in items.values() if code in row]
+        lookup |= Q(store_id=store_id, identity_key__in={ikey for _, _, ikey in row_items})
+        lookup |= Q(store_id=store_id, external_id__in={sku for _, sku, _ in row_items if sku})
+    by_sku, by_key, offers, products = {}, {}, {}, {}
+    for offer in Offer.objects.filter(
+            product_id__in=Offer.objects.filter(lookup).values('product_id')
+    ).select_related('product').order_by('product_id', 'id'):
+        code = codes.get(offer.store_id)
+        if code is None:
+            continue
+        offer.product = products.setdefault(offer.product_id, offer.product)
+        offers.setdefault(offer.product_id, {})[code] = offer
+        if offer.external_id:
+            by_sku[(code, offer.external_id)] = offer
+        if offer.identity_key:
+            by_key[(code, offer.identity_key)] = offer
+
+    now = timezone.now()
+    to_create = []
+    changed = {}
+    new_offers = []
+    touched = {}
+    dropped = []
+    moved_from = {}
+    claimed = set()
+    linked_products = []
+    history = []
+    updated = 0
+    # Известные товары, у которых изменилась цена (а не только название/пара)
+    price_changed = 0
+    for key, row in items.items():
+        fields = rows[key]
+        matched = {code: _match_offer(by_sku, by_key, code, sku, ikey)
+                   for code, (_, sku, ikey) in row.items()}
+        owners = list(dict.fromkeys(offer.product_id for offer in matched.values() if offer))
+        if claimed.intersection(owners):
+            logger.debug("  ⚠️ Товар уже обновлён другой строкой: %s / %s", key[0], key[1])
+            continue
+
+        if not owners:
+            product = Product(name_pyat=key[0], name_mag=key[1], created_at=now, **fields)
+            to_create.append(product)
+            new_offers.extend((product, code, item) for code, item in row.items())
+            linked_products.append(product)
+            logger.debug("  ✨ НОВЫЙ: %s / %s", key[0], key[1])
+            continue
+
+        claimed.update(owners)
+        product = products[owners[0]]
+        old_prices = {store: getattr(product, field)
+                      for store, field in price_history.PRICE_FIELDS.items()}
+        was = {field: getattr(product, field) for field in PRODUCT_UPSERT_FIELDS}
+        for code, (name, sku, ikey) in row.items():
+            name_field, price_field = Product.LEGACY_STORE_FIELDS[code]
+            offer = matched[code]
+            if offer is None or offer.product_id != product.id:
+                # Товар получает другое предложение этого магазина - прежнее удаляется
+                current = offers.setdefault(product.id, {}).pop(code, None)
+                if current is not None:
+                    dropped.append(current.id)
+                    touched.pop(current.id, None)
+                if offer is None:
+                    new_offers.append((product, code, (name, sku, ikey)))
+                else:
+                    donor = products[offer.product_id]
+                    del offers[donor.id][code]
+                    setattr(donor, name_field, None)
+                    setattr(donor, price_field, None)
+                    donor.updated_at = now
+                    changed[donor.id] = donor
+                    moved_from[donor.id] = product
+                    offer.product = product
+                    offer.updated_at = now
+                    offers[product.id][code] = offer
+                    touched[offer.id] = offer
+            setattr(product, name_field, name)
+            if price_field in fields:
+                setattr(product, price_field, fields[price_field])
+            if offer is not None:
+                price = getattr(product, price_field)
+                offer_was = (offer.name, offer.price, offer.external_id)
+                offer.name, offer.normalized_name, offer.price = name, normalize_name(name), price
+                offer.external_id = sku or offer.external_id
+                if (offer.name, offer.price, offer.external_id) != offer_was:
+                    offer.updated_at = now
+                    touched[offer.id] = offer
+        if 'similarity' in fields:
+            product.similarity = fields['similarity']
+        if any(getattr(product, field) != value for field, value in was.items()):
+            product.updated_at = now
+            changed[product.id] = product
+            updated += 1
+            price_changed += any(
+                old_prices[store] is not None and getattr(product, field) != old_prices[store]
+                for store, field in price_history.PRICE_FIELDS.items())
+            history.extend(price_history.observations(product, old_prices, now))
+        linked_products.append(product)
+
+    # Опустевшие товары (все предложения перешли к другим) сливаются
+    merged = {donor_id: product for donor_id, product in moved_from.items()
+              if not offers.get(donor_id)}
+    for donor_id in merged:
+        changed.pop(donor_id, None)
+
+    Offer.objects.filter(id__in=dropped).delete()
+    Product.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+    Offer.objects.bulk_update(
+        touched.values(), ['product', 'name', 'normalized_name', 'external_id', 'price', 'updated_at'],
+        batch_size=BULK_BATCH_SIZE)
+    _create_offers(new_offers, stores, taken={
+        (code, ikey) for (code, ikey), offer in by_key.items() if offer.id not in dropped})
+    if merged:
+        _merge_products(merged)
+    Product.objects.bulk_update(changed.values(), PRODUCT_UPSERT_FIELDS + ['updated_at'],
+                                batch_size=BULK_BATCH_SIZE)
+    # История цен: первая цена новых товаров и изменившиеся цены старых
+    for product in to_create:
+        history.extend(price_history.observations(product, {}, now))
+    price_history.record(history)
+    stats['created'] = len(to_create)
+    stats['updated'] = updated
+    stats['price_changed'] = price_changed
+    stats['unchanged'] = len(linked_products) - len(to_create) - updated
+
+    # Связи с категорией: новые товары точно без неё, старые - проверяем одним запросом
+    through = Product.categories.through
+    created_ids = {product.id for product in to_create}
+    existing_ids = [product.id for product in linked_products if product.id not in created_ids]
+    linked = set(through.objects.filter(
+        category_id=category.id, product_id__in=existing_ids
+    ).values_list('product_id', flat=True)) if existing_ids else set()
+    links = [through(product_id=product.id, category_id=category.id)
+             for product in linked_products if product.id not in linked]
+    through.objects.bulk_create(links, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+    stats['categories_added'] = len(links)
 
-        except Exception as e:
-            stats['errors'] += 1
-            logger.error(
-                "  ❌ Ошибка сохранения парного товара: %s", str(e))
     return stats
 
 
+def _create_offers(new_offers, stores, taken):
+    """
+    Пакетно создает предложения товаров
+
+    Args:
+        new_offers: [(товар, код магазина, (название, артикул, ключ))]
+        taken: {(код магазина, ключ)} - ключи, занятые другими предложениями;
+            предложение с занятым ключом (другой артикул при том же
+            названии) сохраняется без ключа
+    """
+    offers = []
+    for product, code, (name, sku, ikey) in new_offers:
+        if (code, ikey) in taken:
+            ikey = ''
+        else:
+            taken.add((code, ikey))
+        offers.append(Offer(
+            product=product, store_id=stores[code], name=name, normalized_name=normalize_name(name),
+            external_id=sku, identity_key=ikey,
+            price=getattr(product, Product.LEGACY_STORE_FIELDS[code][1])))
+    Offer.objects.bulk_create(offers, batch_size=BULK_BATCH_SIZE)
+
+
 def save_results_to_db(res, query):
     """
     Сохраняет результаты парсинга в базу данных (Product)
+
+    Все товары сохраняются пакетно в одной транзакции: при ошибке БД
+    не остаётся наполовину сохранённого результата.
+
+    Returns:
+        {'created', 'updated', 'price_changed', 'unchanged', 'errors', 'categories_added'}:
+        price_changed - сколько из обновленных товаров изменили цену
     """
     logger.info("💾 Начинаем сохранение результатов в БД для '%s'...", query)
 
     category: Category
     category = Category.objects.get(name=query.capitalize())
 
-    logger.info("📊 Обработка ПАРНЫХ ТОВАРОВ...")
-    stats_pair = _save_pair_to_db(res.get('pairs', []), category)
-
-    logger.info("🏪 Обработка товаров ТОЛЬКО В ПЯТЁРОЧКЕ...")
-    stats_pyat = _save_single_products_to_db(
-        res.get('pyat_single', []), "Пятёрочка", category)
+    rows, skus, errors = _product_rows(res)
+    logger.info("📊 Товаров к сохранению: %s (пар: %s, только в Пятёрочке: %s, только в Магните: %s)",
+                len(rows), len(res.get('pairs', [])), len(res.get('pyat_single', [])),
+                len(res.get('magnit_single', [])))
 
-    logger.info("🏪 Обработка товаров ТОЛЬКО В МАГНИТЕ...")
-    stats_mag = _save_single_products_to_db(
-        res.get('magnit_single', []), "Магнит", category)
-
-    stats = {
-        'created': stats_pair['created'] + stats_pyat['created'] + stats_mag['created'],
-        'updated': stats_pair['updated'] + stats_pyat['updated'] + stats_mag['updated'],
-        'errors': stats_pair['errors'] + stats_pyat['errors'] + stats_mag['errors'],
-        'categories_added': stats_pair['categories_added'] + stats_pyat['categories_added'] + stats_mag['categories_added']
-    }
+    try:
+        with transaction.atomic():
+            stats = _bulk_upsert(rows, category, skus)
+            # Новая версия товаров - закэшированные страницы поиска устаревают
+            # во всех процессах вместе с коммитом
+            category.bump_products_version()
+    except DatabaseError as e:
+        logger.error("  ❌ Ошибка сохранения товаров: %s", str(e), exc_info=True)
+        stats = {
+            'created': 0,
+            'updated': 0,
+            'price_changed': 0,
+            'unchanged': 0,
+            'errors': len(rows),
+            'categories_added': 0
+        }
+    stats['errors'] += errors
 
     logger.info("\n✨ СТАТИСТИКА СОХРАНЕНИЯ:")
     logger.info("   ✨ Создано новых: %s", stats['created'])
-    logger.info("   🔄 Обновлено: %s", stats['updated'])
+    logger.info("   🔄 Обновлено: %s (цена изменилась: %s)", stats['updated'], stats['price_changed'])
+    logger.info("   💤 Без изменений: %s", stats['unchanged'])
     logger.info("   📁 Добавлено в категории: %s", stats['categories_added'])
     logger.info("   ❌ Ошибок: %s", stats['errors'])
+    return stats
@@ -1,9 +1,35 @@
+import io
+import tempfile
+import threading
+import time
 import unittest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from datetime import timedelta
 from decimal import Decimal
-from unittest.mock import MagicMock, patch
+from django.utils import timezone
+from unittest.mock import MagicMock, PropertyMock, patch
 from bs4 import BeautifulSoup
+from selenium.common.exceptions import WebDriverException
 from scraping.scrapers import PyaterochkaParser, MagnitParser, BaseParser, smart_compare_products
-from scraping.scrapers import save_results_to_db
+from scraping.scrapers import get_driver, smart_product_search, HARVEST_SCRIPT
+from scraping.drivers import DriverPool
+from scraping.extraction import HTML_PARSERS, default_html_parser, parse_cards
+from scraping.readiness import wait_for_count, wait_for_idle
+from scraping.replay import ReplayDriver, write_fixtures
+from scraping.scrapers import save_results_to_db, _find_pairs, _similarity_edges
+from scraping.matching import NameProfile, token_set_score, find_pairs_indexed, similarity_edges_indexed
+from scraping.benchmark import make_catalogs
+from scraping.jobs import (
+    enqueue_scrape, claim_job, complete_job, run_job, touch_job, JOB_TIMEOUT_SECONDS,
+    RETRY_BASE_SECONDS)
+from scraping.models import ScrapeJob
+from scraping.scheduler import schedule_refresh
+from catalog.models import CartItem, Category, Offer, PriceObservation, Product, Store
+from fuzzywuzzy import fuzz
 
 class TestPyaterochkaParser(unittest.TestCase):
 
@@ -57,6 +83,35 @@ class TestPyaterochkaParser(unittest.TestCase):
         self.assertEqual(len(products), 0)  # Возвращает пустой список, не падает
         self.assertIsInstance(products, list)
 
+    def test_harvest_streams_new_cards(self):
+        """Потоковый сбор: только новые карточки, без повторов"""
+        card = {'key': '/product/1', 'names': ['4.8', 'Молоко Простоквашино 930мл'],
+                'prices': ['89', '99', '79', '99']}
+        batches = [
+            [card],
+            [dict(card), {'key': '/product/2', 'names': ['Кефир 1%'], 'prices': ['59', '9']}],
+            [],
+        ]
+        driver = MagicMock()
+        clock = iter(range(0, 10**6, 1000))
+
+        def execute_script(script, *args):
+            if script == HARVEST_SCRIPT:
+                return batches.pop(0)
+            # Страница сразу затихает после прокрутки
+            return {'state': 'complete', 'now': next(clock), 'last_activity': 0, 'count': 0}
+        driver.execute_script.side_effect = execute_script
+
+        parser = PyaterochkaParser(driver)
+        products = list(parser.harvest())
+
+        self.assertEqual([(p['name'], p['price']) for p in products], [
+            ('Молоко Простоквашино 930мл', Decimal('79.99')),
+            ('Кефир 1%', Decimal('59.90')),
+        ])
+        self.assertEqual(parser.get_products(), products)
+
+
 class TestMagnitParser(unittest.TestCase):
 
     def setUp(self):
@@ -88,6 +143,36 @@ class TestMagnitParser(unittest.TestCase):
         name = self.parser.extract_product_name(elem)
         self.assertEqual(name, "Молоко Простоквашино 2.5%")
 
+    def test_parse_page_reads_only_cards(self):
+        """Разбираются только карточки товаров, обоими HTML-бэкендами"""
+        card = """
+        <article data-test-id="v-product-preview"><a href="/product/1000254323-moloko">
+            <div class="unit-catalog-product-preview-title">Молоко 2.5% 1л</div>
+            <span class="unit-catalog-product-preview-prices__regular">89,99 ₽</span>
+        </a></article>"""
+        self.mock_driver.page_source = f"""
+        <html><head><script>var x = "<article>";</script></head>
+        <body><nav><span class="unit-catalog-product-preview-prices__regular">1 ₽</span></nav>
+        {card}{card.replace('Молоко', 'Кефир')}</body></html>"""
+
+        self.assertTrue(self.parser._parse_page())
+        self.assertEqual([(p['name'], p['price'], p['sku']) for p in self.parser.products], [
+            ('Молоко 2.5% 1л', Decimal('89.99'), '1000254323'),
+            ('Кефир 2.5% 1л', Decimal('89.99'), '1000254323'),
+        ])
+        cards = parse_cards(self.mock_driver.page_source, MagnitParser.CARD_TAG,
+                            MagnitParser.CARD_ATTRS, parser='html.parser')
+        self.assertEqual(len(cards), 2)
+        self.assertIn(default_html_parser(), HTML_PARSERS)
+
+    def test_extract_sku_from_link(self):
+        """Артикул - число из ссылки на карточку товара"""
+        html = '<article><a href="/product/1000254323-moloko-2-5?shopCode=992301">Молоко</a></article>'
+        elem = BeautifulSoup(html, 'html.parser')
+        self.assertEqual(self.parser.extract_product_sku(elem), '1000254323')
+        self.assertEqual(self.parser.sku_from_link('https://5ka.ru/product/moloko--3442817/'), '3442817')
+        self.assertEqual(self.parser.extract_product_sku(BeautifulSoup('<article></article>', 'html.parser')), '')
+
 
 class TestSmartCompare(unittest.TestCase):
 
@@ -132,26 +217,800 @@ class TestSmartCompare(unittest.TestCase):
         self.assertEqual(len(result['pairs']), 0)
         self.assertEqual(len(result['pyat_single']), 0)
         self.assertEqual(len(result['magnit_single']), 0)
-    
-    # 🆕 НОВЫЙ ТЕСТ 2: Сохранение в БД
-    @patch('catalog.models.Category.objects.get')
-    @patch('catalog.models.Product.objects.get_or_create')
-    def test_save_results_to_db(self, mock_product, mock_category):
-        """Проверяем сохранение результатов в базу"""
-        mock_cat = MagicMock()
-        mock_category.return_value = mock_cat
-        
-        result = {
-            'pairs': [{'pyat': {'name': 'Молоко'}, 'magnit': {'name': 'Молоко'}}],
-            'pyat_single': [{'name': 'Хлеб'}],
-            'magnit_single': []
+
+
+class TestSaveResultsToDb(TestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Молоко')
+        self.result = {
+            'pairs': [{'similarity': 90,
+                       'pyat': {'name': 'Молоко 1л'}, 'price_pyat': Decimal('80.00'),
+                       'magnit': {'name': 'Молоко 1 л'}, 'price_mag': Decimal('85.00')}],
+            'pyat_single': [{'name': 'Хлеб', 'price': Decimal('40.00')}],
+            'magnit_single': [{'name': 'Кефир', 'price': Decimal('60.00')}],
         }
-        
-        save_results_to_db(result, 'Молоко')
-        
-        mock_category.assert_called_once()
-        mock_product.assert_called()
-    
+
+    def test_save_results_to_db(self):
+        """Проверяем сохранение результатов в базу"""
+        stats = save_results_to_db(self.result, 'молоко')
+
+        self.assertEqual(stats, {'created': 3, 'updated': 0, 'price_changed': 0, 'unchanged': 0,
+                                 'errors': 0, 'categories_added': 3})
+        pair = Product.objects.get(name_pyat='Молоко 1л')
+        self.assertEqual(pair.name_mag, 'Молоко 1 л')
+        self.assertEqual(pair.similarity, 90)
+        self.assertTrue(Product.objects.filter(name_pyat='Хлеб', name_mag__isnull=True).exists())
+        self.assertTrue(Product.objects.filter(name_mag='Кефир', name_pyat__isnull=True).exists())
+        self.assertEqual(self.category.products.count(), 3)
+
+    def test_second_save_updates_prices(self):
+        save_results_to_db(self.result, 'молоко')
+        self.result['pyat_single'][0]['price'] = Decimal('42.00')
+
+        stats = save_results_to_db(self.result, 'молоко')
+
+        self.assertEqual(stats, {'created': 0, 'updated': 1, 'price_changed': 1, 'unchanged': 2,
+                                 'errors': 0, 'categories_added': 0})
+        self.assertEqual(Product.objects.get(name_pyat='Хлеб').price_pyat, Decimal('42.00'))
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_existing_product_linked_to_new_category(self):
+        save_results_to_db(self.result, 'молоко')
+        Category.objects.create(name='Хлеб')
+
+        stats = save_results_to_db({'pyat_single': [{'name': 'Хлеб', 'price': Decimal('40.00')}]},
+                                   'хлеб')
+
+        self.assertEqual(stats['created'], 0)
+        self.assertEqual(stats['categories_added'], 1)
+        self.assertEqual(Product.objects.get(name_pyat='Хлеб').categories.count(), 2)
+
+    def test_price_history_records_only_changes(self):
+        """История цен пишется при появлении товара и при изменении цены"""
+        save_results_to_db(self.result, 'молоко')
+        save_results_to_db(self.result, 'молоко')
+        self.assertEqual(PriceObservation.objects.count(), 4)
+
+        self.result['pairs'][0]['price_mag'] = Decimal('79.90')
+        save_results_to_db(self.result, 'молоко')
+
+        pair = Product.objects.get(name_pyat='Молоко 1л')
+        series = list(pair.price_history.order_by('id').values_list('store', 'price'))
+        self.assertEqual(series, [('pyat', Decimal('80.00')), ('mag', Decimal('85.00')),
+                                  ('mag', Decimal('79.90'))])
+
+    def test_offers_saved_and_updated(self):
+        """Пакетное сохранение создает предложения магазинов и обновляет их цены"""
+        save_results_to_db(self.result, 'молоко')
+        self.assertEqual(Offer.objects.count(), 4)
+
+        self.result['pairs'][0]['price_mag'] = Decimal('79.90')
+        save_results_to_db(self.result, 'молоко')
+
+        offer = Offer.objects.get(store__code='mag', normalized_name='молоко 1 л')
+        self.assertEqual(offer.price, Decimal('79.90'))
+        self.assertEqual(Offer.objects.count(), 4)
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_respelled_name_updates_same_product(self):
+        """Иначе записанное название того же товара обновляет прежнюю строку"""
+        save_results_to_db(self.result, 'молоко')
+        self.result['pairs'][0]['pyat']['name'] = 'молоко 1000 мл'
+        self.result['pairs'][0]['price_pyat'] = Decimal('82.00')
+
+        stats = save_results_to_db(self.result, 'молоко')
+
+        self.assertEqual((stats['created'], stats['updated']), (0, 1))
+        self.assertEqual(Product.objects.count(), 3)
+        pair = Product.objects.get(name_mag='Молоко 1 л')
+        self.assertEqual((pair.name_pyat, pair.price_pyat), ('молоко 1000 мл', Decimal('82.00')))
+
+    def test_new_pair_merges_single_products(self):
+        """Пара из двух одиночных товаров сливает их в один, корзина переносится"""
+        save_results_to_db(self.result, 'молоко')
+        kefir = Product.objects.get(name_mag='Кефир')
+        user = get_user_model().objects.create_user(username='buyer', password='password')
+        CartItem.objects.create(user=user, product=kefir)
+
+        stats = save_results_to_db({'pairs': [{
+            'similarity': 70, 'pyat': {'name': 'Хлеб'}, 'price_pyat': Decimal('40.00'),
+            'magnit': {'name': 'Кефир'}, 'price_mag': Decimal('60.00')}]}, 'молоко')
+
+        self.assertEqual((stats['created'], stats['updated']), (0, 1))
+        self.assertEqual(Product.objects.count(), 2)
+        pair = Product.objects.get(name_pyat='Хлеб')
+        self.assertEqual((pair.name_mag, pair.similarity), ('Кефир', 70))
+        self.assertEqual(pair.offers.count(), 2)
+        self.assertEqual(CartItem.objects.get().product, pair)
+        self.assertEqual(set(pair.price_history.values_list('store', flat=True)), {'pyat', 'mag'})
+
+    def test_single_store_row_keeps_pair(self):
+        """Товар одного магазина обновляет пару, не отвязывая второй магазин"""
+        save_results_to_db(self.result, 'молоко')
+
+        stats = save_results_to_db(
+            {'pyat_single': [{'name': 'Молоко 1л', 'price': Decimal('78.00')}]}, 'молоко')
+
+        self.assertEqual((stats['created'], stats['updated']), (0, 1))
+        pair = Product.objects.get(name_pyat='Молоко 1л')
+        self.assertEqual((pair.name_mag, pair.price_pyat), ('Молоко 1 л', Decimal('78.00')))
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_sku_identifies_renamed_product(self):
+        """С артикулом товар находится даже при совсем другом названии"""
+        result = {'pyat_single': [{'name': 'Сыр Российский', 'price': Decimal('150.00'), 'sku': '123456'}]}
+        save_results_to_db(result, 'молоко')
+        result['pyat_single'][0]['name'] = 'Сыр полутвердый "Российский" 45%'
+
+        stats = save_results_to_db(result, 'молоко')
+
+        self.assertEqual(stats['created'], 0)
+        offer = Offer.objects.get(external_id='123456')
+        self.assertEqual(offer.product.name_pyat, 'Сыр полутвердый "Российский" 45%')
+
+    def test_invalid_item_counted_as_error(self):
+        self.result['pyat_single'].append({'price': Decimal('1.00')})
+        stats = save_results_to_db(self.result, 'молоко')
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['created'], 3)
+
+    def test_bulk_save_query_budget(self):
+        """1000 товаров сохраняются за несколько запросов, а не тысячи"""
+        pyat, magnit = make_catalogs(500, 500)
+        result = {'pyat_single': pyat, 'magnit_single': magnit}
+        # id магазинов кэшируются на процесс - счет запросов не зависит от порядка тестов
+        for code in Store.DEFAULT_STORES:
+            Store.id_for(code)
+
+        # SQLite ограничивает число параметров запроса, поэтому INSERT (товары,
+        # история цен, связи с категорией) - пачками
+        with CaptureQueriesContext(connection) as queries:
+            stats = save_results_to_db(result, 'молоко')
+        self.assertEqual(stats['created'], Product.objects.count())
+        self.assertLess(len(queries), 30)
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = save_results_to_db(result, 'молоко')
+        self.assertEqual(stats['created'], 0)
+        self.assertLess(len(queries), 10)
+
+
+class TestIndexedMatching(unittest.TestCase):
+
+    @staticmethod
+    def _pairs_key(result):
+        pairs, used_pyat, used_magnit = result
+        return ([(p['pyat']['name'], p['magnit']['name'], p['similarity']) for p in pairs],
+                used_pyat, used_magnit)
+
+    def test_token_set_score_same_as_fuzz(self):
+        """Сходство по профилям совпадает с fuzz.token_set_ratio"""
+        pyat, magnit = make_catalogs(15, 15, seed=3)
+        for a in pyat:
+            for b in magnit:
+                self.assertEqual(
+                    token_set_score(NameProfile(a['name']), NameProfile(b['name'])),
+                    fuzz.token_set_ratio(a['name'].lower(), b['name'].lower()))
+
+    def test_indexed_engine_same_pairs_as_legacy(self):
+        """Индексный движок находит те же пары, что и полный перебор"""
+        pyat, magnit = make_catalogs(40, 40, seed=7, overlap=0.7)
+        pyat.append({'name': 'МОЛОКА', 'price': Decimal('1')})
+        magnit.append({'name': 'молоко', 'price': Decimal('1')})
+        magnit.append({'name': '...', 'price': Decimal('1')})
+
+        for threshold in (0, 50, 75, 100):
+            self.assertEqual(
+                self._pairs_key(find_pairs_indexed(pyat, magnit, threshold)),
+                self._pairs_key(_find_pairs(pyat, magnit, threshold)))
+
+    def test_unknown_engine(self):
+        """Неизвестный движок - ошибка, а не молчаливый fallback"""
+        with self.assertRaises(ValueError):
+            smart_compare_products([], [], engine='magic')
+
+
+class TestVectorizedMatching(unittest.TestCase):
+
+    def test_tfidf_engine_pairs(self):
+        """TF-IDF движок находит одинаковые товары и не берёт товар Магнита дважды"""
+        pyat_data = [
+            {'name': 'Молоко Простоквашино 2,5% 930мл', 'price': Decimal('89.99')},
+            {'name': 'Молоко Простоквашино 2,5% 930 мл БЗМЖ', 'price': Decimal('91.00')},
+            {'name': 'Хлеб Бородинский 400г', 'price': Decimal('55.00')},
+        ]
+        magnit_data = [
+            {'name': 'Масло сливочное Экомилк 82,5%', 'price': Decimal('199.00')},
+            {'name': 'МОЛОКО ПРОСТОКВАШИНО 2,5% 930МЛ', 'price': Decimal('87.50')},
+        ]
+
+        result = smart_compare_products(
+            pyat_data, magnit_data, similarity_threshold=60, engine='tfidf')
+
+        self.assertEqual(len(result['pairs']), 1)
+        pair = result['pairs'][0]
+        self.assertEqual(pair['pyat']['name'], 'Молоко Простоквашино 2,5% 930мл')
+        self.assertEqual(pair['magnit']['name'], 'МОЛОКО ПРОСТОКВАШИНО 2,5% 930МЛ')
+        self.assertEqual(pair['similarity'], 100)
+        self.assertEqual(len(result['pyat_single']), 2)
+        self.assertEqual(len(result['magnit_single']), 1)
+
+    def test_tfidf_engine_empty_lists(self):
+        result = smart_compare_products([], [{'name': 'Молоко', 'price': Decimal('1')}],
+                                        engine='tfidf')
+        self.assertEqual(len(result['pairs']), 0)
+        self.assertEqual(len(result['magnit_single']), 1)
+
+
+class TestOptimalMatching(unittest.TestCase):
+
+    def setUp(self):
+        # Жадный поиск отдаёт точную пару второго товара первому,
+        # у которого она тоже лучшая (100 против 96)
+        self.pyat_data = [
+            {'name': 'Молоко Простоквашино 2,5%', 'price': Decimal('85.00')},
+            {'name': 'Молоко Простоквашино 2,5% 930мл', 'price': Decimal('89.99')},
+        ]
+        self.magnit_data = [
+            {'name': 'Молоко Простоквашино 3,2% 1,4л', 'price': Decimal('129.00')},
+            {'name': 'Молоко Простоквашино 2,5% 930мл', 'price': Decimal('87.50')},
+        ]
+
+    @staticmethod
+    def _name_pairs(result):
+        return {(p['pyat']['name'], p['magnit']['name'], p['similarity'])
+                for p in result['pairs']}
+
+    def test_optimal_strategy_maximizes_total_similarity(self):
+        greedy = smart_compare_products(self.pyat_data, self.magnit_data)
+        optimal = smart_compare_products(
+            self.pyat_data, self.magnit_data, strategy='optimal')
+
+        self.assertEqual(sum(p['similarity'] for p in greedy['pairs']), 188)
+        self.assertEqual(self._name_pairs(optimal), {
+            ('Молоко Простоквашино 2,5%', 'Молоко Простоквашино 3,2% 1,4л', 96),
+            ('Молоко Простоквашино 2,5% 930мл', 'Молоко Простоквашино 2,5% 930мл', 100),
+        })
+
+    def test_optimal_strategy_ignores_order(self):
+        for engine in ('legacy', 'indexed', 'tfidf'):
+            with self.subTest(engine=engine):
+                direct = smart_compare_products(
+                    self.pyat_data, self.magnit_data,
+                    similarity_threshold=50, engine=engine, strategy='optimal')
+                reversed_ = smart_compare_products(
+                    self.pyat_data[::-1], self.magnit_data[::-1],
+                    similarity_threshold=50, engine=engine, strategy='optimal')
+                self.assertEqual(self._name_pairs(direct), self._name_pairs(reversed_))
+
+    def test_optimal_strategy_same_edges_for_engines(self):
+        pyat, magnit = make_catalogs(40, 40, seed=3)
+        self.assertEqual(sorted(_similarity_edges(pyat, magnit, 75)),
+                         sorted(similarity_edges_indexed(pyat, magnit, 75)))
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            smart_compare_products(self.pyat_data, self.magnit_data, strategy='random')
+
+
+class TestDriverPool(unittest.TestCase):
+
+    def test_driver_reused(self):
+        """Драйвер возвращается в пул и выдаётся повторно"""
+        factory = MagicMock(side_effect=lambda: MagicMock())
+        pool = DriverPool(factory, max_size=2)
+        with pool.driver() as first:
+            pass
+        with pool.driver() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(factory.call_count, 1)
+        first.quit.assert_not_called()
+
+    def test_pool_is_bounded(self):
+        pool = DriverPool(MagicMock, max_size=1)
+        pool.acquire()
+        with self.assertRaises(TimeoutError):
+            pool.acquire(timeout=0.05)
+
+    def test_close_wakes_waiting_acquire(self):
+        """Ожидающий драйвера поток после close() получает ошибку, а не новый драйвер"""
+        factory = MagicMock(side_effect=lambda: MagicMock())
+        pool = DriverPool(factory, max_size=1)
+        held = pool.acquire()
+        errors = []
+
+        def wait_for_driver():
+            try:
+                pool.acquire()
+            except RuntimeError as e:
+                errors.append(e)
+
+        waiter = threading.Thread(target=wait_for_driver)
+        waiter.start()
+        time.sleep(0.05)
+        pool.close()
+        waiter.join(1)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(len(errors), 1)
+        pool.release(held)
+        self.assertEqual(factory.call_count, 1)
+
+    def test_release_wakes_waiting_acquire(self):
+        """Освобожденный драйвер сразу достается ожидающему, а не будит фоновый поток"""
+        pool = DriverPool(lambda: MagicMock(), max_size=1, max_idle=10)
+        held = pool.acquire()
+        waited = []
+
+        def wait_for_driver():
+            started = time.monotonic()
+            pool.acquire(timeout=5)
+            waited.append(time.monotonic() - started)
+
+        waiter = threading.Thread(target=wait_for_driver)
+        waiter.start()
+        time.sleep(0.2)
+        pool.release(held)
+        waiter.join(6)
+        pool.close()
+        self.assertLess(waited[0], 1)
+
+    def test_broken_driver_discarded(self):
+        pool = DriverPool(lambda: MagicMock(), max_size=1)
+        with self.assertRaises(WebDriverException):
+            with pool.driver() as broken:
+                raise WebDriverException("chrome not reachable")
+        broken.quit.assert_called_once()
+        with pool.driver() as driver:
+            self.assertIsNot(driver, broken)
+
+    def test_dead_driver_replaced(self):
+        """Упавший браузер не выдаётся из пула"""
+        pool = DriverPool(lambda: MagicMock(), max_size=1)
+        with pool.driver() as dead:
+            pass
+        type(dead).current_url = PropertyMock(side_effect=WebDriverException("dead"))
+        with pool.driver() as driver:
+            self.assertIsNot(driver, dead)
+        dead.quit.assert_called_once()
+
+    def test_driver_recycled_after_max_pages(self):
+        pool = DriverPool(lambda: MagicMock(), max_size=1, max_pages=10)
+        with pool.driver() as first:
+            pool.add_pages(first, 10)
+        first.quit.assert_called_once()
+        with pool.driver() as second:
+            self.assertIsNot(second, first)
+
+    def test_idle_driver_evicted(self):
+        pool = DriverPool(lambda: MagicMock(), max_size=1, max_idle=0)
+        with pool.driver() as driver:
+            pass
+        pool.evict_idle()
+        driver.quit.assert_called_once()
+        pool.close()
+
+    def test_close_quits_idle_drivers(self):
+        pool = DriverPool(lambda: MagicMock(), max_size=2)
+        with pool.driver() as driver:
+            pass
+        pool.close()
+        driver.quit.assert_called_once()
+
+
+class TestSmartProductSearch(unittest.TestCase):
+
+    @staticmethod
+    def _slow_scrape(delay):
+        def scrape_search(parser, query):
+            parser.add_product(query, Decimal('10.00'))
+            time.sleep(delay)
+            return parser.get_products()
+        return scrape_search
+
+    @patch('scraping.scrapers.driver_pool', DriverPool(MagicMock, max_size=2))
+    def test_stores_scraped_concurrently(self):
+        with patch.object(PyaterochkaParser, 'scrape_search', self._slow_scrape(0.5)), \
+                patch.object(MagnitParser, 'scrape_search', self._slow_scrape(0.5)):
+            started = time.monotonic()
+            result = smart_product_search('молоко')
+
+        self.assertLess(time.monotonic() - started, 0.9)
+        # Оба магазина вернули по товару, и они сопоставились
+        self.assertEqual(len(result['pairs']), 1)
+
+    @patch('scraping.scrapers.driver_pool', DriverPool(MagicMock, max_size=2))
+    def test_slow_store_returns_partial_results(self):
+        with patch.object(PyaterochkaParser, 'scrape_search', self._slow_scrape(0)), \
+                patch.object(MagnitParser, 'scrape_search', self._slow_scrape(2)), \
+                patch.object(MagnitParser, 'SCRAPE_TIMEOUT', 0.1), \
+                patch.object(MagnitParser, 'TIMEOUT_GRACE', 0.1):
+            started = time.monotonic()
+            result = smart_product_search('молоко')
+
+        self.assertLess(time.monotonic() - started, 1)
+        # Товар, найденный Магнитом до таймаута, не потерян
+        self.assertEqual(len(result['pairs']), 1)
+
+
+    def test_store_without_free_driver_fails_by_deadline(self):
+        """Пул занят - магазин без браузера пустой к дедлайну, а не ждёт бесконечно"""
+        pool = DriverPool(MagicMock, max_size=1)
+        with patch.object(PyaterochkaParser, 'scrape_search', self._slow_scrape(1)), \
+                patch.object(MagnitParser, 'scrape_search', self._slow_scrape(1)), \
+                patch.object(PyaterochkaParser, 'SCRAPE_TIMEOUT', 0.2), \
+                patch.object(MagnitParser, 'SCRAPE_TIMEOUT', 0.2), \
+                patch.object(MagnitParser, 'TIMEOUT_GRACE', 2):
+            started = time.monotonic()
+            result = smart_product_search('молоко', pool=pool)
+        pool.close()
+
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual(len(result['pairs']), 0)
+        self.assertEqual(len(result['pyat_single']) + len(result['magnit_single']), 1)
+
+
+class TestReplayDriver(unittest.TestCase):
+
+    def test_smart_search_on_recorded_pages(self):
+        """Парсинг целиком на записях страниц: прокрутка, страницы, время этапов"""
+        pyat, magnit = make_catalogs(45, 70, seed=1, overlap=0.6)
+        with tempfile.TemporaryDirectory() as root:
+            write_fixtures(root, 'молоко', pyat, magnit, cards_per_scroll=20, cards_per_page=30)
+            pool = DriverPool(lambda: ReplayDriver(root), max_size=2)
+            timings = {}
+            try:
+                result = smart_product_search('Молоко', pool=pool, timings=timings)
+            finally:
+                pool.close()
+
+        found_pyat = [p['pyat'] for p in result['pairs']] + result['pyat_single']
+        found_magnit = [p['magnit'] for p in result['pairs']] + result['magnit_single']
+        self.assertEqual(sorted(p['name'] for p in found_pyat), sorted(p['name'] for p in pyat))
+        self.assertEqual(sorted(p['name'] for p in found_magnit), sorted(p['name'] for p in magnit))
+        self.assertTrue(all(p['sku'] for p in found_pyat + found_magnit))
+        self.assertEqual(set(timings), {'Пятёрочка', 'Магнит', 'match'})
+        self.assertEqual(set(timings['Пятёрочка']), {'load', 'scroll', 'parse'})
+
+
+    def test_quick_search_reads_first_screen_and_page(self):
+        """Быстрый этап: Пятёрочка без прокрутки, у Магнита только первая страница"""
+        pyat, magnit = make_catalogs(45, 70, seed=1, overlap=0.6)
+        with tempfile.TemporaryDirectory() as root:
+            write_fixtures(root, 'молоко', pyat, magnit, cards_per_scroll=20, cards_per_page=30)
+            drivers = []
+
+            def factory():
+                drivers.append(ReplayDriver(root))
+                return drivers[-1]
+
+            pool = DriverPool(factory, max_size=4)
+            try:
+                result = smart_product_search('Молоко', pool=pool, quick=True)
+            finally:
+                pool.close()
+
+        found_pyat = [p['pyat'] for p in result['pairs']] + result['pyat_single']
+        found_magnit = [p['magnit'] for p in result['pairs']] + result['magnit_single']
+        self.assertEqual(len(found_pyat), 20)
+        self.assertEqual(len(found_magnit), 30)
+        self.assertEqual(sum(len(driver.history) for driver in drivers), 2)
+
+    @staticmethod
+    def _scrape_magnit(root, pool_size):
+        """Парсит Магнит на записях, возвращает (товары, открытые адреса каждого драйвера)"""
+        drivers = []
+
+        def factory():
+            drivers.append(ReplayDriver(root))
+            return drivers[-1]
+
+        pool = DriverPool(factory, max_size=pool_size)
+        try:
+            with pool.driver() as driver:
+                products = MagnitParser(driver, pool=pool).scrape_search('молоко')
+        finally:
+            pool.close()
+        return products, [driver.history for driver in drivers]
+
+    def test_magnit_pages_load_concurrently(self):
+        """Число страниц из пагинации: страницы грузятся на нескольких драйверах, без лишней"""
+        _, magnit = make_catalogs(1, 100, seed=2)
+        with tempfile.TemporaryDirectory() as root:
+            write_fixtures(root, 'молоко', [], magnit, cards_per_page=30)
+            products, histories = self._scrape_magnit(root, pool_size=3)
+
+        self.assertEqual([p['name'] for p in products], [p['name'] for p in magnit])
+        self.assertEqual([p['page'] for p in products], [1] * 30 + [2] * 30 + [3] * 30 + [4] * 10)
+        pages = sorted(int(url.rsplit('=', 1)[1]) for history in histories for url in history)
+        self.assertEqual(pages, [1, 2, 3, 4])
+        self.assertGreater(len([history for history in histories if history]), 1)
+
+    def test_magnit_borrowed_driver_returned_when_prepare_fails(self):
+        """Дополнительный драйвер, который не удалось подготовить, закрывается, а не теряется"""
+        _, magnit = make_catalogs(1, 100, seed=2)
+        with tempfile.TemporaryDirectory() as root:
+            write_fixtures(root, 'молоко', [], magnit, cards_per_page=30)
+            pool = DriverPool(lambda: ReplayDriver(root), max_size=3)
+            with pool.driver() as driver:
+                parser = MagnitParser(driver, pool=pool)
+                with patch.object(parser, 'prepare_driver', side_effect=WebDriverException('CDP')):
+                    products = parser.scrape_search('молоко')
+            self.assertEqual(len(products), len(magnit))
+            self.assertEqual(pool._created, len(pool._idle))
+            pool.close()
+
+    def test_magnit_without_pagination_loads_until_empty(self):
+        _, magnit = make_catalogs(1, 50, seed=2)
+        with tempfile.TemporaryDirectory() as root:
+            write_fixtures(root, 'молоко', [], magnit, cards_per_page=30, pagination=False)
+            products, histories = self._scrape_magnit(root, pool_size=1)
+
+        self.assertEqual(len(products), 50)
+        self.assertEqual([int(url.rsplit('=', 1)[1]) for url in histories[0]], [1, 2, 3])
+
+
+class TestReadiness(unittest.TestCase):
+
+    @staticmethod
+    def _driver(states):
+        """Драйвер, который отдаёт состояния страницы по очереди (последнее - дальше)"""
+        states = list(states)
+        driver = MagicMock()
+        driver.execute_script.side_effect = lambda script, selector=None: (
+            states.pop(0) if len(states) > 1 else states[0])
+        return driver
+
+    @staticmethod
+    def _state(now, last_activity, count=0, state='complete'):
+        return {'state': state, 'now': now, 'last_activity': last_activity, 'count': count}
+
+    def test_wait_for_idle_returns_when_page_quiet(self):
+        driver = self._driver([
+            self._state(100, 90, state='loading'),
+            self._state(200, 190, count=3),
+            self._state(800, 190, count=5),
+        ])
+        started = time.monotonic()
+        state = wait_for_idle(driver, selector='div', idle=0.5, timeout=5, poll=0)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(state['count'], 5)
+
+    def test_wait_for_idle_respects_since(self):
+        """Тишина до прокрутки не считается"""
+        driver = self._driver([self._state(1000, 0), self._state(1600, 0)])
+        wait_for_idle(driver, idle=0.5, since=1000, timeout=5, poll=0)
+        self.assertEqual(driver.execute_script.call_count, 2)
+
+    def test_wait_for_idle_bounded_by_timeout(self):
+        driver = self._driver([self._state(100, 100)])
+        started = time.monotonic()
+        wait_for_idle(driver, idle=10, timeout=0.2, poll=0.01)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_wait_for_count(self):
+        driver = self._driver([self._state(0, 0), self._state(0, 0, count=2)])
+        self.assertEqual(wait_for_count(driver, 'div', timeout=5, poll=0), 2)
+        driver = self._driver([self._state(0, 0)])
+        self.assertEqual(wait_for_count(driver, 'div', timeout=0.05, poll=0.01), 0)
+
+    def test_wait_for_idle_accepts_interactive_document(self):
+        """При стратегии eager onload (картинки, iframe) не ждём"""
+        driver = self._driver([self._state(1000, 0, state='interactive')])
+        wait_for_idle(driver, idle=0.5, timeout=5, poll=0)
+        self.assertEqual(driver.execute_script.call_count, 1)
+
+
+class TestLeanProfile(unittest.TestCase):
+
+    def test_parser_allowlist_unblocks_resources(self):
+        """Каждый магазин блокирует на драйвере из пула свой набор ресурсов"""
+        driver = MagicMock()
+        with patch.object(MagnitParser, 'ALLOWED_RESOURCES', frozenset({'image'})):
+            MagnitParser(driver).prepare_driver(driver)
+        PyaterochkaParser(driver).prepare_driver(driver)
+
+        blocked = [call.args[1]['urls'] for call in driver.execute_cdp_cmd.call_args_list
+                   if call.args[0] == 'Network.setBlockedURLs']
+        self.assertNotIn('*.png', blocked[0])
+        self.assertIn('*.woff2', blocked[0])
+        self.assertIn('*.png', blocked[1])
+        self.assertIn('*mc.yandex.ru*', blocked[1])
+
+    def test_get_driver_uses_lean_profile(self):
+        with patch('scraping.scrapers.chromedriver_path', return_value='chromedriver'), \
+                patch('scraping.scrapers.Service'), \
+                patch('scraping.scrapers.webdriver.Chrome') as chrome:
+            get_driver()
+            get_driver(lean=False)
+
+        lean, full = (call.kwargs['options'] for call in chrome.call_args_list)
+        self.assertEqual(lean.page_load_strategy, 'eager')
+        self.assertEqual(lean.experimental_options['prefs'][
+            'profile.managed_default_content_settings.images'], 2)
+        self.assertEqual(full.page_load_strategy, 'normal')
+        self.assertNotIn('prefs', full.experimental_options)
+
+
+class TestScrapeJobQueue(TestCase):
+
+    def test_enqueue_deduplicates_and_bumps_priority(self):
+        """Повторный запрос не создаёт второе задание, а поднимает приоритет"""
+        job, created = enqueue_scrape('молоко ', priority=ScrapeJob.PRIORITY_REFRESH)
+        self.assertTrue(created)
+        self.assertEqual(job.query, 'Молоко')
+
+        same, created = enqueue_scrape('МОЛОКО', priority=ScrapeJob.PRIORITY_USER)
+        self.assertFalse(created)
+        self.assertEqual(same.id, job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.priority, ScrapeJob.PRIORITY_USER)
+
+    def test_claim_prefers_user_priority(self):
+        """Поиск пользователя берётся раньше планового обновления, задание берётся один раз"""
+        enqueue_scrape('хлеб', priority=ScrapeJob.PRIORITY_REFRESH)
+        enqueue_scrape('сыр', priority=ScrapeJob.PRIORITY_USER)
+
+        first = claim_job('w1')
+        second = claim_job('w2')
+        self.assertEqual(first.query, 'Сыр')
+        self.assertEqual(first.status, ScrapeJob.RUNNING)
+        self.assertEqual(first.attempts, 1)
+        self.assertEqual(second.query, 'Хлеб')
+        self.assertIsNone(claim_job('w3'))
+
+    def test_claim_requeues_job_of_dead_worker(self):
+        """Задание умершего воркера снова берётся, пока другие воркеры работают"""
+        enqueue_scrape('хлеб')
+        enqueue_scrape('сыр', priority=ScrapeJob.PRIORITY_REFRESH)
+        alive = claim_job('w1')
+        dead = claim_job('w2')
+        self.assertEqual(alive.query, 'Хлеб')
+        ScrapeJob.objects.filter(id=dead.id).update(
+            locked_at=timezone.now() - timedelta(seconds=JOB_TIMEOUT_SECONDS + 1))
+
+        again = claim_job('w3')
+        self.assertEqual(again.id, dead.id)
+        self.assertEqual(again.locked_by, 'w3')
+        self.assertEqual(again.attempts, 2)
+        alive.refresh_from_db()
+        self.assertEqual((alive.status, alive.locked_by), (ScrapeJob.RUNNING, 'w1'))
+
+    def test_touch_job_keeps_long_job_claimed(self):
+        """Продлённое задание не считается брошенным"""
+        enqueue_scrape('хлеб')
+        job = claim_job('w1')
+        ScrapeJob.objects.filter(id=job.id).update(
+            locked_at=timezone.now() - timedelta(seconds=JOB_TIMEOUT_SECONDS - 1))
+        self.assertTrue(touch_job(job))
+        self.assertIsNone(claim_job('w2'))
+        ScrapeJob.objects.filter(id=job.id).update(locked_by='w2')
+        self.assertFalse(touch_job(job))
+
+    @patch('catalog.views.run_parser')
+    def test_reclaimed_job_not_completed_by_old_worker(self, mock_run):
+        """Воркер, у которого задание перехватили, не отмечает его выполненным"""
+        enqueue_scrape('хлеб')
+        stale = claim_job('w1')
+        ScrapeJob.objects.filter(id=stale.id).update(
+            locked_at=timezone.now() - timedelta(seconds=JOB_TIMEOUT_SECONDS + 1))
+        fresh = claim_job('w2')
+        self.assertEqual(fresh.id, stale.id)
+
+        self.assertFalse(complete_job(stale))
+        self.assertFalse(run_job(stale))
+        fresh.refresh_from_db()
+        self.assertEqual((fresh.status, fresh.locked_by), (ScrapeJob.RUNNING, 'w2'))
+        self.assertTrue(complete_job(fresh))
+
+    def test_claim_respects_max_running(self):
+        enqueue_scrape('хлеб')
+        enqueue_scrape('сыр')
+        self.assertIsNotNone(claim_job('w1', max_running=1))
+        self.assertIsNone(claim_job('w2', max_running=1))
+
+    @patch('catalog.views.run_parser', side_effect=RuntimeError('нет сети'))
+    def test_failed_job_retries_with_backoff(self, mock_run):
+        """Упавшее задание возвращается в очередь с задержкой, после max_attempts - FAILED"""
+        job, _ = enqueue_scrape('кефир')
+        self.assertFalse(run_job(claim_job('w1')))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ScrapeJob.PENDING)
+        self.assertEqual(job.last_error, 'нет сети')
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=RETRY_BASE_SECONDS - 5))
+        self.assertIsNone(claim_job('w1'))
+
+        for _ in range(job.max_attempts - 1):
+            ScrapeJob.objects.filter(id=job.id).update(run_after=timezone.now())
+            run_job(claim_job('w1'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ScrapeJob.FAILED)
+        self.assertEqual(mock_run.call_count, job.max_attempts)
+
+        # После окончательной ошибки запрос можно поставить заново
+        _, created = enqueue_scrape('кефир')
+        self.assertTrue(created)
+
+    @patch('catalog.views.run_parser')
+    def test_successful_job_done(self, mock_run):
+        job, _ = enqueue_scrape('кефир')
+        self.assertTrue(run_job(claim_job('w1')))
+        mock_run.assert_called_once_with('Кефир', quick=False)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ScrapeJob.DONE)
+        self.assertIsNotNone(job.finished_at)
+        self.assertFalse(ScrapeJob.objects.filter(status=ScrapeJob.PENDING).exists())
+
+    @patch('catalog.views.run_parser')
+    def test_fast_job_schedules_deep_crawl(self, mock_run):
+        """После быстрого этапа в очередь встаёт полный парсинг того же запроса"""
+        job, _ = enqueue_scrape('кефир', deep=False)
+        # Плановый полный парсинг не мешает поставить быстрый этап
+        self.assertTrue(enqueue_scrape('кефир', priority=ScrapeJob.PRIORITY_REFRESH)[1])
+        ScrapeJob.objects.filter(deep=True).delete()
+
+        self.assertTrue(run_job(claim_job('w1')))
+        mock_run.assert_called_once_with('Кефир', quick=True)
+        deep = ScrapeJob.objects.get(status=ScrapeJob.PENDING)
+        self.assertTrue(deep.deep)
+        self.assertEqual(deep.priority, ScrapeJob.PRIORITY_DEEP)
+
+        self.assertTrue(run_job(claim_job('w1')))
+        mock_run.assert_called_with('Кефир', quick=False)
+        self.assertFalse(ScrapeJob.objects.filter(status=ScrapeJob.PENDING).exists())
+
+
+class TestScrapeWorker(unittest.TestCase):
+
+    def test_chromedriver_resolved_before_jobs(self):
+        """chromedriver ищется при старте воркера, до первого задания"""
+        calls = []
+        command = 'scraping.management.commands.scrape_worker'
+        with patch(f'{command}.chromedriver_path', side_effect=lambda: calls.append('driver')), \
+                patch(f'{command}.claim_job', side_effect=lambda *a, **kw: calls.append('claim')), \
+                patch(f'{command}.driver_pool'):
+            call_command('scrape_worker', '--once', '--concurrency', '1', stdout=io.StringIO())
+        self.assertEqual(calls, ['driver', 'claim'])
+
+
+class TestRefreshScheduler(TestCase):
+
+    def _category(self, name, hours_ago, searches, ttl=24, volatility=0.0, searched_days_ago=0):
+        now = timezone.now()
+        return Category.objects.create(
+            name=name, last_parsed_at=now - timedelta(hours=hours_ago), ttl_hours=ttl,
+            volatility=volatility, search_count=searches,
+            last_searched_at=now - timedelta(days=searched_days_ago))
+
+    def test_hot_expiring_categories_first(self):
+        """Популярные и изменчивые категории обновляются раньше, свежие и забытые - нет"""
+        self._category('Молоко', hours_ago=22, searches=100, volatility=0.5)
+        self._category('Соль', hours_ago=22, searches=2)
+        self._category('Хлеб', hours_ago=2, searches=500)
+        self._category('Икра', hours_ago=48, searches=50, searched_days_ago=30)
+
+        scheduled = schedule_refresh(budget_per_hour=10)
+
+        self.assertEqual([c.name for c in scheduled], ['Молоко', 'Соль'])
+        self.assertEqual(set(ScrapeJob.objects.values_list('priority', flat=True)),
+                         {ScrapeJob.PRIORITY_REFRESH})
+
+    def test_budget_per_hour(self):
+        for i in range(5):
+            self._category(f'Товар {i}', hours_ago=30, searches=10 + i)
+
+        self.assertEqual(len(schedule_refresh(budget_per_hour=3)), 3)
+        # Бюджет часа израсходован - новых заданий нет
+        self.assertEqual(schedule_refresh(budget_per_hour=3), [])
+        self.assertEqual(ScrapeJob.objects.count(), 3)
+
+    def test_leased_category_skipped(self):
+        category = self._category('Молоко', hours_ago=30, searches=10)
+        category.acquire_lease('w1', seconds=60)
+        self.assertEqual(schedule_refresh(budget_per_hour=10), [])
+
 
 class TestBaseParser(unittest.TestCase):
 
@@ -181,3 +1040,29 @@ class TestBaseParser(unittest.TestCase):
 
         self.assertFalse(success_empty)
         self.assertEqual(len(parser.products), 1)
+
+    def test_progress_reports_new_products(self):
+        """Новые товары отдаются в поток частичных результатов один раз"""
+        progress = MagicMock()
+
+        class ConcreteParser(BaseParser):
+            STORE_NAME = 'Тест'
+            PROGRESS_INTERVAL = 0
+
+            def extract_product_name(self, elem):
+                return "test"
+
+            def extract_product_price(self, elem):
+                return Decimal(10)
+
+            def scrape_search(self, query):
+                return []
+
+        parser = ConcreteParser(MagicMock(), progress=progress)
+        parser.add_product("Молоко", Decimal("80"))
+        parser.add_product("Кефир", Decimal("60"))
+        parser.flush_progress()
+
+        reported = [call.args for call in progress.products.call_args_list]
+        self.assertEqual([store for store, _ in reported], ['Тест', 'Тест'])
+        self.assertEqual([p['name'] for _, batch in reported for p in batch], ["Молоко", "Кефир"])
@@ -0,0 +1,141 @@
+"""
+Векторизованный движок сопоставления: TF-IDF по символьным n-граммам.
+
+Вся матрица сходства Пятёрочка×Магнит считается пакетно: названия
+превращаются в разреженные TF-IDF векторы, косинусное сходство - одно
+разреженное матричное произведение (по блокам строк, чтобы не держать в
+памяти всю плотную матрицу), выбор лучшей пары - argmax по строке.
+
+Шкала сходства отличается от fuzz.token_set_ratio, поэтому пары могут
+расходиться с движком 'legacy' - сравнить их можно командой
+``manage.py benchmark_matching --engine tfidf``.
+"""
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+from scraping.matching import normalize_name
+
+NGRAM_SIZE = 3
+# Сколько строк Пятёрочки перемножается за раз
+BLOCK_SIZE = 1024
+
+
+def _ngrams(name):
+    """Символьные n-граммы нормализованного названия (с границами слов)"""
+    text = f" {' '.join(normalize_name(name or '').split())} "
+    return Counter(text[i:i + NGRAM_SIZE]
+                   for i in range(len(text) - NGRAM_SIZE + 1))
+
+
+def tfidf_vectors(pyat_names, magnit_names):
+    """
+    TF-IDF матрицы (L2-нормированные) для двух списков названий
+    с общим словарём n-грамм и IDF по обоим магазинам
+
+    Returns:
+        (pyat_matrix, magnit_matrix) - scipy.sparse.csr_matrix
+    """
+    names = list(pyat_names) + list(magnit_names)
+    vocabulary = {}
+    rows, cols, counts = [], [], []
+    for row, name in enumerate(names):
+        for gram, count in _ngrams(name).items():
+            rows.append(row)
+            cols.append(vocabulary.setdefault(gram, len(vocabulary)))
+            counts.append(count)
+
+    cols = np.asarray(cols, dtype=np.int64)
+    # Сублинейный TF и сглаженный IDF
+    tf = 1.0 + np.log(np.asarray(counts, dtype=np.float32))
+    df = np.bincount(cols, minlength=len(vocabulary))
+    idf = np.log((1.0 + len(names)) / (1.0 + df)) + 1.0
+    matrix = sparse.csr_matrix(
+        (tf * idf[cols], (np.asarray(rows, dtype=np.int64), cols)),
+        shape=(len(names), len(vocabulary)), dtype=np.float32)
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    matrix = sparse.diags(1.0 / norms).dot(matrix).tocsr()
+
+    split = len(pyat_names)
+    return matrix[:split], matrix[split:]
+
+
+def _similarity_blocks(pyat_products, magnit_products):
+    """
+    Матрица сходства (целые проценты) по блокам строк Пятёрочки
+
+    Yields:
+        (номер первой строки блока, np.ndarray блока)
+    """
+    pyat_matrix, magnit_matrix = tfidf_vectors(
+        [p['name'] for p in pyat_products],
+        [p['name'] for p in magnit_products])
+    magnit_t = magnit_matrix.T.tocsc()
+    for start in range(0, len(pyat_products), BLOCK_SIZE):
+        block = (pyat_matrix[start:start + BLOCK_SIZE] @ magnit_t).toarray()
+        yield start, np.rint(block * 100).astype(np.int32)
+
+
+def find_pairs_tfidf(pyat_products, magnit_products, similarity_threshold):
+    """
+    Поиск пар по косинусному сходству TF-IDF векторов
+
+    Как и _find_pairs, товары Пятёрочки обходятся по порядку и каждый берёт
+    самый похожий свободный товар Магнита (при равенстве - первый).
+    Сходство - округлённый косинус в процентах (0-100).
+
+    Returns:
+        (pairs, used_pyat_indices, used_magnit_indices)
+    """
+    pairs = []
+    used_pyat_indices = set()
+    used_magnit_indices = set()
+    if not pyat_products or not magnit_products:
+        return pairs, used_pyat_indices, used_magnit_indices
+
+    # Занятые товары Магнита исключаются из argmax
+    taken = np.zeros(len(magnit_products), dtype=np.float32)
+
+    for start, similarity_block in _similarity_blocks(pyat_products, magnit_products):
+        for offset, row in enumerate(similarity_block):
+            magnit_idx = int(np.argmax(row - taken * 1000))
+            similarity = int(row[magnit_idx])
+            if taken[magnit_idx] or similarity <= 0 or similarity < similarity_threshold:
+                continue
+
+            pyat_idx = start + offset
+            pyat_prod = pyat_products[pyat_idx]
+            best_match = magnit_products[magnit_idx]
+            pairs.append({
+                'similarity': similarity,
+                'pyat': pyat_prod,
+                'price_pyat': pyat_prod['price'],
+                'magnit': best_match,
+                'price_mag': best_match['price'],
+            })
+            used_pyat_indices.add(pyat_idx)
+            used_magnit_indices.add(magnit_idx)
+            taken[magnit_idx] = 1
+
+    return pairs, used_pyat_indices, used_magnit_indices
+
+
+def similarity_edges_tfidf(pyat_products, magnit_products, similarity_threshold):
+    """
+    Все пары с косинусным сходством не ниже порога (для оптимального назначения)
+
+    Returns:
+        [(pyat_idx, magnit_idx, similarity)]
+    """
+    edges = []
+    if not pyat_products or not magnit_products:
+        return edges
+    threshold = max(similarity_threshold, 1)
+    for start, similarity_block in _similarity_blocks(pyat_products, magnit_products):
+        rows, cols = np.nonzero(similarity_block >= threshold)
+        edges.extend(zip((rows + start).tolist(), cols.tolist(),
+                         similarity_block[rows, cols].tolist()))
+    return edges